@@ -0,0 +1,65 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+import os
+import sys
+import importlib
+from pathlib import Path
+from yukon.dsdl import CompilationCache
+
+
+def _make_namespaces(root: Path) -> None:
+    (root / "vendor_base").mkdir(parents=True)
+    (root / "vendor_base" / "Value.1.0.dsdl").write_text("float32 value\n@sealed\n")
+    (root / "vendor_app" / "sub").mkdir(parents=True)
+    (root / "vendor_app" / "sub" / "Sample.1.0.dsdl").write_text("vendor_base.Value.1.0 value\n@sealed\n")
+    (root / "vendor_other").mkdir(parents=True)
+    (root / "vendor_other" / "Flag.1.0.dsdl").write_text("bool flag\n@sealed\n")
+
+
+def _unittest_dsdl_cache(tmp_path: Path) -> None:
+    src = tmp_path / "src"
+    _make_namespaces(src)
+    roots = [src / "vendor_base", src / "vendor_app", src / "vendor_other"]
+
+    cache = CompilationCache(tmp_path / "cache", max_entries=4)
+    first = cache.get(roots)
+    assert cache.statistics.n_compiled == 3  # Compiled in the process pool.
+    assert cache.statistics.n_files_hashed == 3
+    assert [(x / r.name).is_dir() for x, r in zip(first, roots)] == [True, True, True]
+    assert not any(x.name.startswith(".staging-") for x in cache.directory.iterdir())
+
+    sys.path[:0] = [str(x) for x in first]
+    try:
+        sample = importlib.import_module("vendor_app.sub").Sample_1_0  # type: ignore
+        assert sample().value.value == 0
+    finally:
+        del sys.path[: len(first)]
+        for name in list(sys.modules):
+            if name.startswith(("vendor_base", "vendor_app", "vendor_other")):
+                del sys.modules[name]
+
+    # Nothing has changed, so the sources are not even read again.
+    cache = CompilationCache(tmp_path / "cache", max_entries=4)
+    assert cache.get(roots) == first
+    assert cache.statistics.n_hits == 3
+    assert cache.statistics.n_compiled == 0
+    assert cache.statistics.n_files_hashed == 0
+
+    # Touching a file without changing its contents makes it hashed again, but the key is the same.
+    os.utime(src / "vendor_other" / "Flag.1.0.dsdl", ns=(0, 0))
+    assert cache.get(roots) == first
+    assert cache.statistics.n_files_hashed == 1
+    assert cache.statistics.n_compiled == 0
+
+    # A change in a namespace invalidates the namespaces that depend on it, but not the independent ones.
+    (src / "vendor_base" / "Value.1.0.dsdl").write_text("float64 value\n@sealed\n")
+    second = cache.get(roots)
+    assert cache.statistics.n_compiled == 2
+    assert second[0] != first[0] and second[1] != first[1] and second[2] == first[2]
+
+    # The old entries are the least recently used ones, so they are evicted first.
+    assert cache.statistics.n_evicted == 1
+    assert not first[0].exists() or not first[1].exists()
+    assert sum(1 for x in cache.directory.iterdir() if x.is_dir() and not x.name.startswith(".")) == 4
@@ -0,0 +1,484 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+"""
+Performance benchmarks of the IO worker components running over the loopback transport,
+so that the numbers depend only on the host and the code under test.
+The results are written as JSON for comparison between runs::
+
+    python -m tests.io._benchmark --output new.json --baseline old.json
+
+When a baseline is given, the metrics that have regressed beyond the tolerance are reported
+and the exit code is non-zero. The metrics are named by convention: those ending with ``_per_s``
+are better when higher; the others (durations) are better when lower.
+"""
+
+from __future__ import annotations
+import sys
+import json
+import time
+import typing
+import asyncio
+import logging
+import platform
+import argparse
+import threading
+import dataclasses
+from pathlib import Path
+import pytest
+import pyuavcan
+from pyuavcan.transport import AlienTransfer, AlienTransferMetadata, AlienSessionSpecifier, Priority, Timestamp
+from pyuavcan.transport import MessageDataSpecifier, ServiceDataSpecifier
+from pyuavcan.transport.loopback import LoopbackTransport
+from pyuavcan.transport.can import CANTransport, CANCapture
+from pyuavcan.transport.can.media import DataFrame, FrameFormat
+from pyuavcan.transport.can.media.pythoncan import PythonCANMedia
+from pyuavcan.presentation import Presentation
+import uavcan.si.unit.duration
+import uavcan.metatransport.serial
+from org_uavcan_yukon.io import Status_0_1 as IOStatus, Config_0_1 as IOConfig
+from org_uavcan_yukon.io.transfer import Spoof_0_1 as DCSSpoof, Priority_1_0 as DCSPriority
+from org_uavcan_yukon.io.transfer import Payload_1_0 as DCSPayload
+from yukon.io import session_to_dcs, session_from_dcs
+from yukon.io.iface import Iface, IfaceCapture, IfaceStatistics, CapturePredicate, DCSFrame
+from yukon.io.iface.can import CANIface
+from yukon.io._captor import CaptureSettings, CaptureStatistics, DCSCapture, DCSCaptureBatch, setup_capture_forwarding
+from yukon.io._capture_batch import decode_capture_batch
+from yukon.io._spoofer import Spoofer, SpoofSettings, SpoofStatus
+from yukon.io._snooper import SnoopStatistics
+from yukon.io._status import StatusReporter, StatusSettings, update_operational_info
+from yukon.io._latency import LatencyHistogram
+
+
+_logger = logging.getLogger(__name__)
+
+_SUBJECT_CAPTURE = 100
+_SUBJECT_SPOOF = 101
+_SUBJECT_STATUS = 102
+_SUBJECT_CAPTURE_BATCH = 103
+
+
+@dataclasses.dataclass(frozen=True)
+class BenchmarkSettings:
+    capture_rates: typing.Sequence[float] = (1_000, 10_000, 50_000)  # Frames per second.
+    capture_duration: float = 3.0  # Seconds per rate.
+    spoof_count: int = 20_000
+    spoof_window_count: int = 1000
+    session_conversion_count: int = 100_000
+    can_capture_count: int = 10_000
+    status_cycles: int = 1000
+
+    @staticmethod
+    def quick() -> BenchmarkSettings:
+        """
+        Enough to check that everything works but the numbers are noisy.
+        """
+        return BenchmarkSettings(
+            capture_rates=(1_000,),
+            capture_duration=0.3,
+            spoof_count=300,
+            spoof_window_count=100,
+            session_conversion_count=1000,
+            can_capture_count=1000,
+            status_cycles=30,
+        )
+
+
+class SyntheticIface(Iface):
+    """
+    Generates frames of the specified size at a controlled rate from its own thread, like a real transport does.
+    The spoofed transfers are sent into a loopback transport, optionally after a delay emulating a slow transport.
+    """
+
+    TRANSPORT_NAME = "synthetic"
+
+    def __init__(self, frame_size: int = 64, spoof_delay: float = 0.0) -> None:
+        self._frame = DCSFrame(serial=uavcan.metatransport.serial.Fragment_0_2(bytes(frame_size)))
+        self._spoof_delay = spoof_delay
+        self._handlers: typing.List[typing.Callable[[IfaceCapture], None]] = []
+        self._transport = LoopbackTransport(None)
+        self._thread: typing.Optional[threading.Thread] = None
+        self.generated_at: typing.List[int] = []
+        """
+        The monotonic timestamp of each generated frame in nanoseconds, indexed by the sequence number.
+        """
+
+    def generate(self, rate: float, count: int) -> None:
+        """
+        Starts generating the frames in the background. The frames are emitted in bursts every half-millisecond
+        because the sleep resolution of the OS is too coarse for the higher rates.
+        """
+        if self._thread is not None:
+            raise RuntimeError("Generation is already running")
+
+        def thread_fn() -> None:
+            handler = pyuavcan.util.broadcast(self._handlers)
+            started_at = time.monotonic()
+            while len(self.generated_at) < count:
+                due = min(count, int((time.monotonic() - started_at) * rate) + 1)
+                while len(self.generated_at) < due:
+                    ts = Timestamp.now()
+                    self.generated_at.append(ts.monotonic_ns)
+                    handler(IfaceCapture(ts, self._frame))
+                time.sleep(0.0005)
+
+        self._thread = threading.Thread(target=thread_fn, name="synthetic_iface", daemon=True)
+        self._thread.start()
+
+    def join(self) -> None:
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @staticmethod
+    def new(cfg: typing.Any) -> SyntheticIface:
+        raise NotImplementedError
+
+    @staticmethod
+    def capture_from_dcs(ts: Timestamp, fr: DCSFrame) -> pyuavcan.transport.Capture:
+        raise NotImplementedError
+
+    def begin_capture(self, handler: typing.Callable[[IfaceCapture], None]) -> None:
+        self._handlers.append(handler)
+
+    def set_capture_filter(self, predicate: typing.Optional[CapturePredicate]) -> None:
+        pass
+
+    async def spoof(self, transfer: AlienTransfer, monotonic_deadline: float) -> bool:
+        if self._spoof_delay > 0:
+            await asyncio.sleep(self._spoof_delay)
+        return await self._transport.spoof(transfer, monotonic_deadline)
+
+    def sample_statistics(self, monotonic_ns: typing.Optional[int] = None) -> IfaceStatistics:
+        return IfaceStatistics(n_frames=len(self.generated_at))
+
+    def close(self) -> None:
+        self.join()
+        self._transport.close()
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, n_frames=len(self.generated_at))
+
+
+async def bench_capture(
+    pres: Presentation, rate: float, duration: float, columnar: bool = False
+) -> typing.Dict[str, float]:
+    """
+    From the frame generation until the reception of the published capture message by a local subscriber.
+    The columnar batches are decoded into columns by the subscriber.
+    """
+    count = max(1, round(rate * duration))
+    iface = SyntheticIface()
+    latency = LatencyHistogram()
+    received = 0
+
+    async def on_capture(msg: DCSCapture, _meta: pyuavcan.transport.TransferFrom) -> None:
+        nonlocal received
+        latency.add(time.monotonic_ns() - iface.generated_at[msg.sequence_number])
+        received += 1
+
+    async def on_capture_batch(msg: DCSCaptureBatch, _meta: pyuavcan.transport.TransferFrom) -> None:
+        nonlocal received
+        now = time.monotonic_ns()
+        for seq in decode_capture_batch(msg).sequence_number.tolist():
+            latency.add(now - iface.generated_at[seq])
+            received += 1
+
+    dtype, subject = (DCSCaptureBatch, _SUBJECT_CAPTURE_BATCH) if columnar else (DCSCapture, _SUBJECT_CAPTURE)
+    sub = pres.make_subscriber(dtype, subject)
+    sub.receive_in_background(on_capture_batch if columnar else on_capture)  # type: ignore
+    fwd = setup_capture_forwarding([pres.make_publisher(dtype, subject)], 0, iface, CaptureSettings(columnar=columnar))
+    started_at = time.monotonic()
+    iface.generate(rate, count)
+    deadline = started_at + duration * 2 + 10.0
+    while received + fwd.statistics.n_dropped < count and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.monotonic() - started_at
+    fwd.close()
+    sub.close()
+    iface.close()
+    summary = latency.summarize()
+    return {
+        "frames": count,
+        "dropped": fwd.statistics.n_dropped,
+        "frames_per_s": received / elapsed,
+        "latency_p50_us": summary.p50 * 1e6,
+        "latency_p99_us": summary.p99 * 1e6,
+        "latency_max_us": summary.max * 1e6,
+    }
+
+
+async def bench_spoof(pres: Presentation, count: int) -> typing.Dict[str, float]:
+    """
+    The DCS variant goes through the serialization, the loopback transport, and the subscription;
+    the direct variant shows the cost of the spoofer alone.
+    """
+    ss = AlienSessionSpecifier(42, None, MessageDataSpecifier(1234))
+    settings = SpoofSettings(queue_capacity=count)
+    loop = asyncio.get_event_loop()
+
+    async def run(spoofer: Spoofer, feed: typing.Callable[[], typing.Awaitable[None]]) -> float:
+        iface = SyntheticIface()
+        spoofer.add_iface(0, iface)
+        started_at = time.monotonic()
+        await feed()
+        while spoofer.status[0].n_transfers < count:
+            await asyncio.sleep(0.001)
+            if time.monotonic() - started_at > 60.0:
+                raise TimeoutError(f"Spoofed {spoofer.status[0]} of {count}")
+        elapsed = time.monotonic() - started_at
+        spoofer.close()
+        iface.close()
+        return count / elapsed
+
+    pub = pres.make_publisher(DCSSpoof, _SUBJECT_SPOOF)
+    pub.send_timeout = 10.0
+    msg = DCSSpoof(
+        timeout=uavcan.si.unit.duration.Scalar_1_0(60.0),
+        priority=DCSPriority(DCSPriority.NOMINAL),
+        session=session_to_dcs(ss),
+        payload=DCSPayload(bytes(64)),
+    )
+
+    async def feed_dcs() -> None:
+        for _ in range(count):
+            await pub.publish(msg)
+
+    sub = pres.make_subscriber(DCSSpoof, _SUBJECT_SPOOF)
+    dcs = await run(Spoofer(sub, settings), feed_dcs)
+    sub.close()
+    pub.close()
+
+    spoofer = Spoofer(pres.make_subscriber(DCSSpoof, _SUBJECT_SPOOF + 1), settings)
+
+    async def feed_direct() -> None:
+        deadline = loop.time() + 60.0
+        for i in range(count):
+            spoofer.push(
+                AlienTransfer(AlienTransferMetadata(Priority.NOMINAL, i, ss), [memoryview(bytes(64))]), deadline
+            )
+
+    direct = await run(spoofer, feed_direct)
+    return {"dcs_per_s": dcs, "direct_per_s": direct}
+
+
+async def bench_spoof_window(pres: Presentation, count: int, delay: float = 0.005) -> typing.Dict[str, float]:
+    """
+    The iface takes a fixed time to emit each transfer but can work on several at once, like a UDP socket;
+    the throughput is expected to scale with the window until the host becomes the bottleneck.
+    The transfers are spread over several sessions because the transfers of one session are never reordered.
+    """
+    sessions = 10
+    loop = asyncio.get_event_loop()
+    out: typing.Dict[str, float] = {}
+    for index, window in enumerate([1, 8]):
+        iface = SyntheticIface(spoof_delay=delay)
+        settings = SpoofSettings(queue_capacity=count, window=window)
+        spoofer = Spoofer(pres.make_subscriber(DCSSpoof, _SUBJECT_SPOOF + 2 + index), settings)
+        spoofer.add_iface(0, iface)
+        deadline = loop.time() + 60.0
+        started_at = time.monotonic()
+        for i in range(count):
+            ss = AlienSessionSpecifier(i % sessions, None, MessageDataSpecifier(1234))
+            spoofer.push(AlienTransfer(AlienTransferMetadata(Priority.NOMINAL, i // sessions, ss), []), deadline)
+        while spoofer.status[0].n_transfers < count:
+            await asyncio.sleep(0.001)
+            if time.monotonic() - started_at > 60.0:
+                raise TimeoutError(f"Spoofed {spoofer.status[0]} of {count}")
+        out[f"window_{window}_per_s"] = count / (time.monotonic() - started_at)
+        spoofer.close()
+        iface.close()
+    return out
+
+
+def bench_session_conversion(count: int) -> typing.Dict[str, float]:
+    sessions = {
+        "message": AlienSessionSpecifier(42, None, MessageDataSpecifier(1234)),
+        "service": AlienSessionSpecifier(42, 43, ServiceDataSpecifier(300, ServiceDataSpecifier.Role.REQUEST)),
+    }
+    out: typing.Dict[str, float] = {}
+    for name, ss in sessions.items():
+        started_at = time.perf_counter()
+        for _ in range(count):
+            session_to_dcs(ss)
+        out[f"{name}_to_dcs_ns"] = (time.perf_counter() - started_at) / count * 1e9
+        dcs = session_to_dcs(ss)
+        started_at = time.perf_counter()
+        for _ in range(count):
+            session_from_dcs(dcs)
+        out[f"{name}_from_dcs_ns"] = (time.perf_counter() - started_at) / count * 1e9
+    return out
+
+
+async def bench_can_capture(count: int) -> typing.Dict[str, float]:
+    """
+    The conversion must keep up with a saturated bus: at 1 Mbit/s, an extended Classic CAN frame takes 75..131 us
+    to transmit (excluding bit stuffing); at 1/5 Mbit/s, a CAN FD frame takes no less than about 60 us.
+    """
+    bitrate = 1_000_000, 5_000_000
+    iface = CANIface(CANTransport(PythonCANMedia("virtual:", bitrate), None), bitrate)
+    sink: typing.List[IfaceCapture] = []
+    iface.begin_capture(sink.append)
+    ts = Timestamp.now()
+    frames = [
+        CANCapture(ts, DataFrame(FrameFormat.EXTENDED, 0x1060642A + i % 8, bytearray(64)), own=False)
+        for i in range(count)
+    ]
+    logger = logging.getLogger(CANIface.__module__)
+    level = logger.level
+    logger.setLevel(logging.INFO)  # The test suite enables debug logging which is not representative.
+    try:
+        started_at = time.perf_counter()
+        for fr in frames:
+            iface._process_capture(fr)  # pylint: disable=protected-access
+        elapsed = (time.perf_counter() - started_at) / count
+    finally:
+        logger.setLevel(level)
+        iface.close()
+    return {"frames": len(sink), "conversion_us": elapsed * 1e6}
+
+
+async def bench_status(pres: Presentation, cycles: int) -> typing.Dict[str, float]:
+    """
+    A cycle updates every iface of a fully populated redundant group and publishes the status;
+    an unchanged cycle only detects that there is nothing to publish.
+    """
+    iface_ids = list(range(IOConfig.MAX_REDUNDANCY_FACTOR))
+    rep = StatusReporter(
+        pres.make_publisher(IOStatus, _SUBJECT_STATUS), StatusSettings(interval_min=1e-9, interval_max=3600.0)
+    )
+    started_at = time.perf_counter()
+    for i in range(cycles):
+        for iface_id in iface_ids:
+            update_operational_info(
+                rep.get_operational(iface_id),
+                IfaceStatistics(n_frames=i, n_media_layer_bytes=i * 8, media_utilization_pct=i % 100),
+                SpoofStatus(n_transfers=i),
+                CaptureStatistics(n_frames=i),
+                SnoopStatistics(n_completed=i),
+            )
+        await rep.publish()
+    changed = (time.perf_counter() - started_at) / cycles
+    started_at = time.perf_counter()
+    for _ in range(cycles):
+        await rep.publish()
+    unchanged = (time.perf_counter() - started_at) / cycles
+    return {"cycle_us": changed * 1e6, "unchanged_cycle_us": unchanged * 1e6}
+
+
+async def run(settings: BenchmarkSettings) -> typing.Dict[str, typing.Any]:
+    pres = Presentation(LoopbackTransport(None))
+    results: typing.Dict[str, typing.Dict[str, float]] = {}
+    try:
+        for rate in settings.capture_rates:
+            results[f"capture_{rate:.0f}"] = await bench_capture(pres, rate, settings.capture_duration)
+            results[f"capture_columnar_{rate:.0f}"] = await bench_capture(
+                pres, rate, settings.capture_duration, columnar=True
+            )
+        results["spoof"] = await bench_spoof(pres, settings.spoof_count)
+        results["spoof_window"] = await bench_spoof_window(pres, settings.spoof_window_count)
+        results["session_conversion"] = bench_session_conversion(settings.session_conversion_count)
+        results["can_capture"] = await bench_can_capture(settings.can_capture_count)
+        results["status"] = await bench_status(pres, settings.status_cycles)
+    finally:
+        pres.close()
+    for name, metrics in results.items():
+        _logger.info("%s: %s", name, ", ".join(f"{k}={v:.1f}" for k, v in metrics.items()))
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "pyuavcan": pyuavcan.__version__,
+            "settings": dataclasses.asdict(settings),
+        },
+        "results": results,
+    }
+
+
+def compare(
+    baseline: typing.Dict[str, typing.Any], current: typing.Dict[str, typing.Any], tolerance: float
+) -> typing.List[str]:
+    """
+    :returns: Descriptions of the metrics that are worse than the baseline by more than the tolerance (relative).
+        The metrics that are missing from either side are not compared.
+
+    >>> base = {"results": {"spoof": {"dcs_per_s": 1000.0, "cost_us": 10.0}}}
+    >>> compare(base, {"results": {"spoof": {"dcs_per_s": 950.0, "cost_us": 10.5}}}, 0.1)
+    []
+    >>> compare(base, {"results": {"spoof": {"dcs_per_s": 800.0, "cost_us": 12.0}}}, 0.1)
+    ['spoof.dcs_per_s: 1000 -> 800 (-20%)', 'spoof.cost_us: 10 -> 12 (+20%)']
+    """
+    out = []
+    for name, metrics in current["results"].items():
+        for key, value in metrics.items():
+            try:
+                ref = baseline["results"][name][key]
+            except LookupError:
+                continue
+            if ref == 0:
+                continue
+            change = (value - ref) / ref
+            if (-change if key.endswith("_per_s") else change) > tolerance:
+                out.append(f"{name}.{key}: {ref:.0f} -> {value:.0f} ({change * 100:+.0f}%)")
+    return out
+
+
+@pytest.mark.asyncio
+async def _unittest_benchmark(tmp_path: Path) -> None:
+    result = await run(BenchmarkSettings.quick())
+    assert set(result["results"]) == {
+        "capture_1000",
+        "capture_columnar_1000",
+        "spoof",
+        "spoof_window",
+        "session_conversion",
+        "can_capture",
+        "status",
+    }
+    for capture in [result["results"]["capture_1000"], result["results"]["capture_columnar_1000"]]:
+        assert capture["frames"] == 300
+        assert capture["dropped"] == 0
+        assert 0 < capture["latency_p50_us"] <= capture["latency_max_us"]
+    assert result["results"]["spoof"]["dcs_per_s"] > 0
+    assert result["results"]["spoof_window"]["window_8_per_s"] > 0
+    assert result["results"]["can_capture"]["frames"] == 1000
+    assert result["results"]["can_capture"]["conversion_us"] > 0
+    assert result["results"]["status"]["cycle_us"] > 0
+    assert result["results"]["status"]["unchanged_cycle_us"] > 0
+
+    # The output survives the round trip through JSON and is comparable with itself.
+    path = tmp_path / "benchmark.json"
+    path.write_text(json.dumps(result))
+    assert not compare(json.loads(path.read_text()), result, 0.0)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", type=Path, help="Write the results into this JSON file.")
+    parser.add_argument("--baseline", type=Path, help="Compare the results against this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative regression threshold. Default: 0.1")
+    parser.add_argument("--quick", action="store_true", help="Run a shortened version to check the setup.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    result = asyncio.get_event_loop().run_until_complete(
+        run(BenchmarkSettings.quick() if args.quick else BenchmarkSettings())
+    )
+    text = json.dumps(result, indent=2)
+    if args.output is not None:
+        args.output.write_text(text)
+    else:
+        print(text)
+    if args.baseline is not None:
+        regressions = compare(json.loads(args.baseline.read_text()), result, args.tolerance)
+        for x in regressions:
+            print("REGRESSION:", x, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+# pylint: disable=protected-access
+
+import typing
+import asyncio
+import dataclasses
+import threading
+import numpy
+import pytest
+import pyuavcan
+from pyuavcan.transport import Priority
+from pyuavcan.transport.can._identifier import MessageCANID
+from pyuavcan.transport.can import CANTransport, CANCapture
+from pyuavcan.transport.can.media import DataFrame, FrameFormat
+from pyuavcan.transport.can.media.pythoncan import PythonCANMedia
+from yukon.io._captor import CaptureForwarder, CaptureSettings, DCSCapture, DCSCaptureBatch, setup_capture_forwarding
+from yukon.io._capture_batch import decode_capture_batch
+from yukon.io._filter import CaptureFilter, FilterRule
+from yukon.io.iface import IfaceCapture
+from yukon.io.iface.can import CANIface
+from org_uavcan_yukon.io.frame import Frame_0_1 as DCSFrame
+import uavcan.metatransport.can
+import uavcan.metatransport.serial
+
+
+class _MockPublisher:
+    def __init__(self) -> None:
+        self.messages: typing.List[DCSCapture] = []
+
+    async def publish(self, message: DCSCapture) -> bool:
+        self.messages.append(message)
+        return True
+
+
+@pytest.mark.asyncio
+async def _unittest_capture_forwarder() -> None:
+    pub = _MockPublisher()
+    settings = CaptureSettings(batch_size_max=100, linger_max=0.1, buffer_capacity=1000)
+    fwd = CaptureForwarder([pub], 7, settings)  # type: ignore
+    cap = IfaceCapture(
+        timestamp=pyuavcan.transport.Timestamp.now(),
+        frame=DCSFrame(serial=uavcan.metatransport.serial.Fragment_0_2(b"abc")),
+    )
+
+    def produce(count: int) -> None:
+        for _ in range(count):
+            fwd.push(cap)
+
+    # A few frames are lingering until the timeout expires, then they are published in one batch.
+    thread = threading.Thread(target=produce, args=(10,))
+    thread.start()
+    thread.join()
+    await asyncio.sleep(0.05)
+    assert not pub.messages
+    await asyncio.sleep(0.2)
+    assert [m.sequence_number for m in pub.messages] == list(range(10))
+    assert all(m.iface_id == 7 for m in pub.messages)
+    assert fwd.statistics.n_batches == 1
+    assert fwd.statistics.n_frames == 10
+    assert fwd.statistics.batch_size_peak == 10
+    latency = fwd.statistics.latency_handoff
+    assert latency is not None
+    assert latency.count == 10
+    assert 0.08 < latency.p50 <= latency.p99 <= latency.max < 1.0  # Includes the lingering.
+    assert fwd.statistics.latency_publish is not None and fwd.statistics.latency_publish.count == 10
+    pub.messages.clear()
+
+    # A full batch does not linger. The excess is dropped but the sequence numbers are consumed.
+    thread = threading.Thread(target=produce, args=(1500,))
+    thread.start()
+    thread.join()
+    await asyncio.sleep(0.05)
+    assert [m.sequence_number for m in pub.messages] == list(range(10, 1010))
+    stats = fwd.statistics
+    assert stats.n_frames == 1010
+    assert stats.n_dropped == 500
+    assert stats.n_batches == 11
+    assert stats.batch_size_peak == 100
+
+    fwd.close()
+    await asyncio.sleep(0.1)
+
+
+def _make_can_frame(can_id: int) -> DCSFrame:
+    return DCSFrame(
+        can=uavcan.metatransport.can.Frame_0_2(
+            data_classic=uavcan.metatransport.can.DataClassic_0_1(
+                uavcan.metatransport.can.ArbitrationID_0_1(
+                    extended=uavcan.metatransport.can.ExtendedArbitrationID_0_1(can_id)
+                ),
+                b"\xE0",
+            )
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def _unittest_capture_forwarder_shards() -> None:
+    pubs = [_MockPublisher() for _ in range(3)]
+    settings = CaptureSettings(linger_max=0, buffer_capacity=4, shard_count=3, shard_map={10: 2, 11: 2})
+    observed: typing.List[typing.Tuple[int, int]] = []
+    fwd = CaptureForwarder(
+        pubs, 4, settings, lambda _iface_id, shard, seq, _cap: observed.append((shard, seq))  # type: ignore
+    )
+    ts = pyuavcan.transport.Timestamp.now()
+    frame = DCSFrame(serial=uavcan.metatransport.serial.Fragment_0_2(b"abc"))
+    for src in [10, 11, None, 10, 11, None, 11]:
+        fwd.push(IfaceCapture(ts, frame, src))  # The last three are dropped due to buffer overflow.
+    await asyncio.sleep(0.1)
+    assert not pubs[0].messages
+    assert [m.sequence_number for m in pubs[1].messages] == [0]  # The default shard is 4 % 3.
+    assert [m.sequence_number for m in pubs[2].messages] == [0, 1, 2]
+    for src in [None, 10]:
+        fwd.push(IfaceCapture(ts, frame, src))
+    await asyncio.sleep(0.1)
+    assert [m.sequence_number for m in pubs[1].messages] == [0, 2]  # The gap reveals the loss.
+    assert [m.sequence_number for m in pubs[2].messages] == [0, 1, 2, 5]
+    assert observed == [(2, 0), (2, 1), (1, 0), (2, 2), (1, 2), (2, 5)]  # As published.
+    fwd.close()
+
+    # The measurement can be disabled.
+    fwd = CaptureForwarder(pubs, 4, dataclasses.replace(settings, measure_latency=False))  # type: ignore
+    fwd.push(IfaceCapture(ts, frame, 10))
+    await asyncio.sleep(0.1)
+    assert fwd.statistics.n_frames == 1
+    assert fwd.statistics.latency_handoff is None
+    assert fwd.statistics.latency_publish is None
+    fwd.close()
+    await asyncio.sleep(0.1)
+
+
+@pytest.mark.asyncio
+async def _unittest_capture_forwarder_filtered() -> None:
+    pubs = [_MockPublisher() for _ in range(2)]
+    settings = CaptureSettings(linger_max=0, buffer_capacity=3, shard_count=2, shard_map={3: 1, 4: 1})
+    observed: typing.List[typing.Tuple[int, int]] = []
+    iface = CANIface(CANTransport(PythonCANMedia("virtual:", 1_000_000), None), (1_000_000, 1_000_000))
+    iface.set_capture_filter(CaptureFilter([FilterRule(source_node_id=3, drop=True)]).accept)
+    fwd = setup_capture_forwarding(
+        pubs, 0, iface, settings, lambda _iface_id, shard, seq, _cap: observed.append((shard, seq))  # type: ignore
+    )
+    ts = pyuavcan.transport.Timestamp.now()
+
+    def feed(*sources: int) -> None:
+        for src in sources:
+            can_id = MessageCANID(Priority.NOMINAL, src, 1000).compile([])
+            iface._process_capture(CANCapture(ts, DataFrame(FrameFormat.EXTENDED, can_id, bytearray(b"\xE0")), False))
+
+    # The frames rejected by the filter do not consume sequence numbers, so they leave no gaps.
+    feed(3, 4, 3, 4, 4)
+    await asyncio.sleep(0.1)
+    assert [m.sequence_number for m in pubs[1].messages] == [0, 1, 2]
+    # The frames lost due to buffer overflow do, so the gap reveals the loss.
+    feed(4, 3, 4, 4, 4, 4)
+    await asyncio.sleep(0.1)
+    feed(4)
+    await asyncio.sleep(0.1)
+    assert [m.sequence_number for m in pubs[1].messages] == [0, 1, 2, 3, 4, 5, 8]
+    assert observed == [(1, x) for x in [0, 1, 2, 3, 4, 5, 8]]
+    assert not pubs[0].messages
+    assert fwd.statistics.n_dropped == 2
+    assert iface.sample_statistics().n_filtered == 3
+    fwd.close()
+    iface.close()
+    await asyncio.sleep(0.1)
+
+
+@pytest.mark.asyncio
+async def _unittest_capture_forwarder_columnar() -> None:
+    pub = _MockPublisher()
+    fwd = CaptureForwarder([pub], 9, CaptureSettings(linger_max=0.05, columnar=True))  # type: ignore
+    frames = [_make_can_frame(MessageCANID(Priority.NOMINAL, 3 + i % 2, 1000 + i).compile([])) for i in range(5)]
+    started_at = pyuavcan.transport.Timestamp.now()
+    for fr in frames:
+        fwd.push(IfaceCapture(started_at, fr))
+    await asyncio.sleep(0.1)
+    assert len(pub.messages) == 1  # All frames in one message.
+    assert fwd.statistics.n_frames == 5
+    assert fwd.statistics.n_messages == 1
+    assert fwd.statistics.latency_publish is not None and fwd.statistics.latency_publish.count == 5
+
+    # The columns of the received message are views of the transfer payload.
+    image = b"".join(pyuavcan.dsdl.serialize(pub.messages[0]))
+    cols = decode_capture_batch(pyuavcan.dsdl.deserialize(DCSCaptureBatch, [memoryview(image)]))
+    assert cols.iface_id == 9
+    assert cols.sequence_number.tolist() == [0, 1, 2, 3, 4]
+    assert cols.timestamp.tolist() == [started_at.system_ns // 1000] * 5
+    assert cols.kind.tolist() == [DCSCaptureBatch.KIND_CAN_DATA_CLASSIC_EXTENDED] * 5
+    assert cols.length.tolist() == [5] * 5
+    assert numpy.shares_memory(cols.payload, numpy.frombuffer(image, numpy.uint8))
+    assert numpy.shares_memory(cols.kind, numpy.frombuffer(image, numpy.uint8))
+    for i, seq in enumerate(cols.sequence_number.tolist()):
+        assert list(pyuavcan.dsdl.serialize(cols.frame(i))) == list(pyuavcan.dsdl.serialize(frames[seq]))
+    fwd.close()
+    await asyncio.sleep(0.1)
@@ -0,0 +1,112 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+import typing
+import asyncio
+import pytest
+import pyuavcan
+from pyuavcan.transport import Timestamp
+from yukon.io._captor import CaptureForwarder, CaptureSettings
+from yukon.io._dedup import Deduplicator, DedupSettings, DedupForwarder, DCSDedupCapture
+from yukon.io.iface import IfaceCapture
+from org_uavcan_yukon.io.frame import Frame_0_1 as DCSFrame
+import uavcan.metatransport.can
+import uavcan.metatransport.serial
+
+
+def _make_capture(identifier: int, data: bytes, monotonic_ns: int = 0) -> IfaceCapture:
+    mc = uavcan.metatransport.can
+    frame = mc.Frame_0_2(
+        data_classic=mc.DataClassic_0_1(mc.ArbitrationID_0_1(extended=mc.ExtendedArbitrationID_0_1(identifier)), data)
+    )
+    return IfaceCapture(Timestamp(system_ns=monotonic_ns, monotonic_ns=monotonic_ns), DCSFrame(can=frame))
+
+
+def _unittest_deduplicator() -> None:
+    dd = Deduplicator(DedupSettings(window=1.0, capacity=3))
+    for iface_id in range(3):
+        dd.add_iface(iface_id)
+
+    # The order of arrival is determined by the timestamps rather than by the order in which the frames are pushed.
+    dd.push(0, _make_capture(1, b"a", 5_000_000), 0)
+    dd.push(1, _make_capture(1, b"a", 2_000_000), 0)
+    dd.push(0, _make_capture(2, b"a", 6_000_000), 0)  # Different identifier, different frame.
+    assert dd.pop(0) == []
+    dd.push(2, _make_capture(1, b"a", 9_000_000), 0)
+    (msg,) = dd.pop(0)
+    assert msg.sequence_number == 0
+    assert msg.iface_id.tolist() == [1, 0, 2]
+    assert msg.arrival_skew.tolist() == [0, 3000, 7000]
+    assert msg.timestamp.microsecond == 2000
+
+    # The same content from the same iface is a new frame even if the previous one is still pending.
+    dd.push(0, _make_capture(2, b"a", 7_000_000), 0)
+    dd.push(1, _make_capture(2, b"a", 7_000_000), 0)
+    assert dd.pop(0) == []  # Both wait for the other ifaces.
+
+    # Once an iface is removed, its copies are no longer awaited, but the older frame still lacks the copy from iface 1.
+    dd.remove_iface(2)
+    assert dd.pop(0) == []
+    assert dd.deadline == 1_000_000_000
+    assert [m.iface_id.tolist() for m in dd.pop(1_000_000_000)] == [[0], [0, 1]]
+    assert dd.deadline is None
+
+    # The capacity is exceeded, so the oldest frames are published before their window has expired.
+    for i in range(5):
+        dd.push(0, _make_capture(10 + i, b""), 0)
+    assert [m.sequence_number for m in dd.pop(0)] == [3, 4]
+    stats = dd.statistics
+    assert stats.n_input == 11
+    assert stats.n_output == 5
+    assert stats.n_evicted == 2
+
+    iface_stats = dd.iface_statistics
+    assert set(iface_stats) == {0, 1}
+    assert iface_stats[1].n_first == 1
+    assert iface_stats[0].n_first == 4
+    assert iface_stats[1].n_missed == 3
+    skew = iface_stats[0].skew
+    assert skew is not None
+    assert skew.count == 1
+    assert skew.max == pytest.approx(3e-3)
+
+
+class _MockPublisher:
+    def __init__(self) -> None:
+        self.messages: typing.List[DCSDedupCapture] = []
+
+    async def publish(self, message: DCSDedupCapture) -> bool:
+        self.messages.append(message)
+        return True
+
+
+@pytest.mark.asyncio
+async def _unittest_dedup_forwarder() -> None:
+    pub = _MockPublisher()
+    dedup = DedupForwarder(pub, DedupSettings(window=0.2))  # type: ignore
+    settings = CaptureSettings(batch_size_max=100, linger_max=0.01)
+    fwds = [CaptureForwarder([], i, settings, dedup=dedup) for i in range(2)]
+    for i in range(2):
+        dedup.add_iface(i)
+
+    now = pyuavcan.transport.Timestamp.now().monotonic_ns
+    for i in range(10):
+        fwds[0].push(_make_capture(i, b"x", now + i))
+        if i % 2 == 0:
+            fwds[1].push(_make_capture(i, b"x", now + i + 1000))
+    await asyncio.sleep(0.1)
+    assert [m.sequence_number for m in pub.messages] == [0]  # Frame 1 is missed by iface 1, so it holds back.
+    await asyncio.sleep(0.3)
+    assert [m.iface_id.tolist() for m in pub.messages] == [[0, 1], [0]] * 5
+    assert [m.arrival_skew.tolist() for m in pub.messages][:2] == [[0, 1], [0]]
+    assert fwds[0].statistics.n_frames == 10
+    assert fwds[0].statistics.n_messages == 0
+    stats = dedup.statistics
+    assert stats.n_input == 15
+    assert stats.n_output == 10
+    assert dedup.iface_statistics[1].n_missed == 5
+
+    for f in fwds:
+        f.close()
+    dedup.close()
@@ -0,0 +1,145 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+import time
+import typing
+import asyncio
+import threading
+import pytest
+from yukon.io.iface import Iface
+from yukon.io._iface_manager import IfaceManager, IfaceManagerSettings
+
+
+class _FakeIface:
+    def __init__(self, attempt: int) -> None:
+        self.attempt = attempt
+        self.closed = False
+
+    def close(self) -> None:
+        time.sleep(0.01)
+        self.closed = True
+
+
+class _Factory:
+    """
+    Stands in for both the iface type and its configuration.
+    The attempts listed in ``stuck`` block until the gate is opened; those listed in ``failing`` raise.
+    """
+
+    TRANSPORT_NAME = "fake"
+
+    def __init__(self, stuck: typing.Collection[int] = (), failing: typing.Collection[int] = ()) -> None:
+        self.stuck = stuck
+        self.failing = failing
+        self.gate = threading.Event()
+        self.n_calls = 0
+        self.created: typing.List[_FakeIface] = []
+
+    def new(self, _cfg: typing.Any) -> _FakeIface:
+        self.n_calls += 1
+        attempt = self.n_calls
+        asyncio.get_event_loop()  # Transports do this during construction; it must work in the pool threads.
+        if attempt in self.stuck:
+            self.gate.wait()
+        if attempt in self.failing:
+            raise RuntimeError(f"Attempt {attempt} failed")
+        out = _FakeIface(attempt)
+        self.created.append(out)
+        return out
+
+
+def _make_manager(
+    monkeypatch: pytest.MonkeyPatch, **kwargs: typing.Any
+) -> typing.Tuple[IfaceManager, typing.Dict[int, _FakeIface]]:
+    monkeypatch.setattr(Iface, "resolve", staticmethod(lambda cfg: cfg))
+    ready: typing.Dict[int, _FakeIface] = {}
+    settings = IfaceManagerSettings(
+        init_timeout={"fake": 0.2},
+        retry_interval_min=0.05,
+        retry_interval_max=0.1,
+        **kwargs,
+    )
+    return IfaceManager(settings, ready.__setitem__), ready  # type: ignore
+
+
+@pytest.mark.asyncio
+async def _unittest_iface_manager_retry(monkeypatch: pytest.MonkeyPatch) -> None:
+    man, ready = _make_manager(monkeypatch)
+    fac = _Factory(failing=(1, 2, 3))
+    started_at = time.monotonic()
+    man.add(7, fac)  # type: ignore
+    await asyncio.sleep(0.02)
+    assert man.entries[7].failure == "Init failed: RuntimeError: Attempt 1 failed"
+    while 7 not in ready:
+        await asyncio.sleep(0.01)
+    assert time.monotonic() - started_at >= 0.05 + 0.1 + 0.1  # Backoff up to the limit.
+    entry = man.entries[7]
+    assert entry.iface is ready[7] is fac.created[0]
+    assert entry.failure is None
+    assert entry.n_attempts == 4
+
+    man.remove(7)
+    await asyncio.sleep(0.1)
+    assert fac.created[0].closed
+    stats = man.statistics
+    assert stats.n_threads_busy == stats.n_threads_queued == 0
+    assert stats.close_duration_max >= 0.01
+    man.close()
+
+
+@pytest.mark.asyncio
+async def _unittest_iface_manager_abandon(monkeypatch: pytest.MonkeyPatch) -> None:
+    man, ready = _make_manager(monkeypatch, thread_count=2)
+    stuck, waiting, never = _Factory(stuck=(1,)), _Factory(stuck=(1,)), _Factory()
+    man.add(0, stuck)  # type: ignore
+    await asyncio.sleep(0.3)  # The first attempt times out, the second one succeeds.
+    assert man.statistics.n_init_timeouts == 1
+    assert [x.attempt for x in ready.values()] == [2]
+    assert man.statistics.n_threads_busy == 1  # Still stuck.
+
+    # The first attempt of this one gets stuck as well, so both threads are occupied and the retry has to wait.
+    man.add(1, waiting)  # type: ignore
+    await asyncio.sleep(0.3)
+    assert man.statistics.n_init_timeouts == 2
+    assert man.statistics.n_threads_busy == 2
+    man.add(2, never)  # type: ignore
+    await asyncio.sleep(0.3)  # The deadline does not run while waiting for a thread.
+    assert man.statistics.n_init_timeouts == 2
+    assert man.statistics.n_threads_queued == 2
+    man.remove(2)  # Abandoned before it could start.
+    man.remove(1)  # Abandoned while stuck.
+
+    stuck.gate.set()
+    waiting.gate.set()
+    await asyncio.sleep(0.1)
+    assert [x.closed for x in stuck.created] == [False, True]  # The late one is closed, the good one is kept.
+    assert [x.closed for x in waiting.created] == [True]
+    assert waiting.n_calls == 1  # The retry was abandoned before it could start.
+    assert never.n_calls == 0
+    stats = man.statistics
+    assert stats.n_late_closures == 2
+    assert stats.n_threads_busy == stats.n_threads_queued == 0
+    assert set(man.entries) == {0}
+    man.close()
+
+
+@pytest.mark.asyncio
+async def _unittest_iface_manager_setup_failure(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(Iface, "resolve", staticmethod(lambda cfg: cfg))
+    rejected: typing.List[_FakeIface] = []
+
+    def on_ready(_iface_id: int, iface: _FakeIface) -> None:
+        if not rejected:
+            rejected.append(iface)
+            raise ValueError("Not now")
+
+    man = IfaceManager(IfaceManagerSettings(retry_interval_min=0.05), on_ready)  # type: ignore
+    fac = _Factory()
+    man.add(0, fac)  # type: ignore
+    await asyncio.sleep(0.02)
+    assert man.entries[0].failure == "Setup failed: ValueError: Not now"
+    await asyncio.sleep(0.1)
+    assert rejected[0].closed
+    assert man.entries[0].iface is fac.created[1]
+    man.close()
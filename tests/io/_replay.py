@@ -0,0 +1,113 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+import time
+import typing
+import asyncio
+from pathlib import Path
+import pytest
+from pyuavcan.transport import AlienTransfer, AlienTransferMetadata, AlienSessionSpecifier, MessageDataSpecifier
+from pyuavcan.transport import Priority
+from pyuavcan.transport.can import CANTransport
+from pyuavcan.transport.can.media.pythoncan import PythonCANMedia
+from yukon.io._replay import ReplayItem, Replayer, ReplaySettings, CaptureLogTransfers
+from yukon.io.iface import IfaceCapture
+from yukon.io.iface.can import CANIface
+from yukon.io.record import Recorder, RecorderSettings, CaptureLog
+
+
+class _MockSpoofer:
+    def __init__(self, backlog: int = 0) -> None:
+        self.backlog = backlog
+        self.pushed: typing.List[typing.Tuple[float, AlienTransfer, float, typing.Optional[int]]] = []
+
+    def push(self, transfer: AlienTransfer, monotonic_deadline: float, iface_id: typing.Optional[int] = None) -> None:
+        self.pushed.append((asyncio.get_event_loop().time(), transfer, monotonic_deadline, iface_id))
+
+
+def _make_transfer(source_node_id: int, transfer_id: int, payload: bytes) -> AlienTransfer:
+    return AlienTransfer(
+        AlienTransferMetadata(
+            Priority.HIGH,
+            transfer_id,
+            AlienSessionSpecifier(source_node_id, None, MessageDataSpecifier(100)),
+        ),
+        [memoryview(payload)],
+    )
+
+
+def _make_items(count: int, interval: float) -> typing.List[ReplayItem]:
+    return [ReplayItem(1000.0 + i * interval, i % 2, _make_transfer(1, i, b"")) for i in range(count)]
+
+
+@pytest.mark.asyncio
+async def _unittest_replayer_timing() -> None:
+    spoofer = _MockSpoofer()
+    rep = await Replayer(spoofer, ReplaySettings(speed=2.0, timeout=0.5)).run(_make_items(11, 0.1))  # type: ignore
+    assert rep.n_transfers == 11
+    assert rep.elapsed == pytest.approx(0.5, abs=0.05)
+    assert rep.target_rate == pytest.approx(20.0)
+    assert rep.achieved_rate == pytest.approx(20.0, rel=0.1)
+    assert 0 <= rep.jitter_mean <= rep.jitter_max < 0.05
+    times = [x[0] for x in spoofer.pushed]
+    assert all(0.04 < b - a < 0.07 for a, b in zip(times, times[1:]))
+    assert all(deadline == pytest.approx(t + 0.5) for t, _, deadline, _ in spoofer.pushed)
+    assert [x[3] for x in spoofer.pushed] == [i % 2 for i in range(11)]
+
+
+@pytest.mark.asyncio
+async def _unittest_replayer_unlimited() -> None:
+    spoofer = _MockSpoofer()
+    rep = await Replayer(spoofer, ReplaySettings(speed=0)).run(_make_items(1000, 1.0))  # type: ignore
+    assert rep.n_transfers == 1000
+    assert rep.elapsed < 1.0
+    assert rep.target_rate == 0
+    assert rep.jitter_max == 0
+
+    # The replay is paused until the backlog is worked off.
+    spoofer = _MockSpoofer(backlog=10)
+    replayer = Replayer(spoofer, ReplaySettings(speed=0, backlog_max=10))  # type: ignore
+    task = asyncio.get_event_loop().create_task(replayer.run(_make_items(10, 1.0)))
+    await asyncio.sleep(0.1)
+    assert not spoofer.pushed and replayer.report.n_transfers == 0
+    spoofer.backlog = 0
+    assert (await task).n_transfers == 10
+
+
+@pytest.mark.asyncio
+async def _unittest_replay_capture_log(tmp_path: Path) -> None:
+    iface = CANIface(CANTransport(PythonCANMedia("virtual:", 1_000_000), None), (1_000_000, 1_000_000))
+    captured: typing.List[IfaceCapture] = []
+    iface.begin_capture(captured.append)
+    peer = CANTransport(PythonCANMedia("virtual:", 1_000_000), None)
+    deadline = asyncio.get_event_loop().time() + 1.0
+    assert await peer.spoof(_make_transfer(42, 5, b"Hello world! 12345"), deadline)  # Three frames.
+    assert await peer.spoof(_make_transfer(43, 0, bytes(range(30))), deadline)  # Five frames.
+    await asyncio.sleep(0.5)
+    assert len(captured) == 8
+    iface.close()
+    peer.close()
+
+    rec = Recorder(tmp_path, RecorderSettings(flush_interval=0.01))
+    for i, cap in enumerate(captured):
+        rec.feed(0, 0, i, cap)
+        rec.feed(1, 0, i, cap)  # Redundant iface.
+    rec.feed(1, 0, 8, captured[0])  # Duplicate frame.
+    time.sleep(0.1)
+    rec.close()
+
+    log = CaptureLog(tmp_path)
+    source = CaptureLogTransfers(log, iface_id=1)
+    items = list(source)
+    assert [(x.iface_id, x.transfer.metadata.transfer_id) for x in items] == [(1, 5), (1, 0)]
+    assert items[0].transfer.metadata.session_specifier.source_node_id == 42
+    assert b"".join(items[0].transfer.fragmented_payload)[:18] == b"Hello world! 12345"
+    assert items[0].timestamp == pytest.approx(float(captured[0].timestamp.system), abs=1e-5)
+    assert source.n_skipped == 1  # The duplicate is rejected by the reassembler.
+
+    spoofer = _MockSpoofer()
+    rep = await Replayer(spoofer, ReplaySettings(speed=0)).run(CaptureLogTransfers(log))  # type: ignore
+    assert rep.n_transfers == 4
+    assert [x[3] for x in spoofer.pushed] == [0, 1, 0, 1]
+    log.close()
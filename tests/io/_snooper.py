@@ -0,0 +1,176 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+# pylint: disable=protected-access
+
+import typing
+import asyncio
+import pytest
+from pyuavcan.transport import AlienTransfer, AlienTransferMetadata, AlienSessionSpecifier, MessageDataSpecifier
+from pyuavcan.transport import Priority, Timestamp
+from pyuavcan.transport.can import CANTransport
+from pyuavcan.transport.can.media.pythoncan import PythonCANMedia
+from org_uavcan_yukon.io.iface.transport import Config_0_1 as DCSTransportConfig, Serial_0_1 as DCSSerialConfig
+from org_uavcan_yukon.io.transfer import Payload_1_0 as DCSPayload
+import uavcan.primitive
+import uavcan.metatransport.serial
+from yukon.io._snooper import Snooper, SnoopSettings, DCSSnoop
+from yukon.io.iface import IfaceCapture, DCSFrame
+from yukon.io.iface.can import CANIface
+from yukon.io.iface.serial import SerialIface
+
+
+class _MockPublisher:
+    def __init__(self) -> None:
+        self.messages: typing.List[DCSSnoop] = []
+
+    async def publish(self, message: DCSSnoop) -> bool:
+        self.messages.append(message)
+        return True
+
+
+def _make_transfer(source_node_id: typing.Optional[int], transfer_id: int, payload: bytes) -> AlienTransfer:
+    return AlienTransfer(
+        AlienTransferMetadata(
+            Priority.HIGH,
+            transfer_id,
+            AlienSessionSpecifier(source_node_id, None, MessageDataSpecifier(100)),
+        ),
+        [memoryview(payload)],
+    )
+
+
+@pytest.mark.asyncio
+async def _unittest_snooper_can() -> None:
+    bitrate = 1_000_000, 1_000_000
+    iface = CANIface(CANTransport(PythonCANMedia("virtual:", 1_000_000), None), bitrate)
+    captured: typing.List[IfaceCapture] = []
+    iface.begin_capture(captured.append)
+    peer = CANTransport(PythonCANMedia("virtual:", 1_000_000), None)
+
+    pub = _MockPublisher()
+    snooper = Snooper(pub, SnoopSettings(transfer_id_timeout=1.0, buffered_bytes_max=20))  # type: ignore
+    snooper.add_iface(3, iface)
+
+    deadline = asyncio.get_event_loop().time() + 1.0
+    assert await peer.spoof(_make_transfer(42, 5, b"Hello world! 12345"), deadline)  # Three frames.
+    assert await peer.spoof(_make_transfer(None, 0, b"anon"), deadline)
+    assert await peer.spoof(_make_transfer(43, 0, bytes(range(30))), deadline)  # Five frames.
+    await asyncio.sleep(0.5)
+    assert len(captured) == 9
+
+    for seq, cap in enumerate(captured[:4]):
+        snooper.feed(3, 1, seq, cap)
+    snooper.feed(3, 1, 4, captured[4])  # The start of the long transfer.
+    await asyncio.sleep(0.1)
+    assert [m.payload.payload.tobytes() for m in pub.messages] == [b"Hello world! 12345", b"anon"]
+    assert [m.frame_sequence_number_min_max.tolist() for m in pub.messages] == [[0, 2], [3, 3]]
+    assert pub.messages[0].session.subject.subject_id.value == 100
+    assert pub.messages[0].session.subject.source[0].value == 42
+    assert len(pub.messages[1].session.subject.source) == 0
+    assert pub.messages[0].transfer_id == 5
+    assert pub.messages[0].priority.value == Priority.HIGH
+    assert pub.messages[0].iface_id == 3
+    assert [m.shard for m in pub.messages] == [1, 1]  # The sequence numbers refer to this shard.
+    assert snooper.buffered_bytes == 7  # The tail byte is not counted.
+    stats = snooper.statistics[3]
+    assert (stats.n_completed, stats.n_evicted, stats.n_malformed, stats.n_truncated) == (2, 0, 0, 0)
+
+    # The partial transfer exceeds the memory limit, so it is evicted; the remaining frames are then unexpected.
+    for seq, cap in enumerate(captured[5:], start=5):
+        snooper.feed(3, 0, seq, cap)
+    stats = snooper.statistics[3]
+    assert stats.n_completed == 2
+    assert stats.n_evicted == 1
+    assert stats.n_malformed >= 1
+    assert snooper.buffered_bytes <= 20
+
+    # A stale partial transfer is evicted when its session times out.
+    pub.messages.clear()
+    snooper.feed(3, 0, 100, captured[0])
+    assert snooper.buffered_bytes == 7  # The tail byte is not counted.
+    late = captured[3]._replace(timestamp=Timestamp(0, captured[3].timestamp.monotonic_ns + 2_000_000_000))
+    snooper.feed(3, 0, 101, late)
+    assert snooper.buffered_bytes == 0
+    assert snooper.statistics[3].n_evicted == 2
+    await asyncio.sleep(0.1)
+    assert [m.payload.payload.tobytes() for m in pub.messages] == [b"anon"]
+
+    snooper.remove_iface(3)
+    snooper.feed(3, 0, 102, captured[3])  # Ignored.
+    assert 3 not in snooper.statistics
+
+    snooper.close()
+    iface.close()
+    peer.close()
+    await asyncio.sleep(0.1)
+
+
+@pytest.mark.asyncio
+async def _unittest_snooper_serial() -> None:
+    cfg = DCSTransportConfig(
+        serial=DCSSerialConfig(
+            port_name=uavcan.primitive.String_1_0(""),  # Loopback.
+            baudrate=10_000_000,
+            duplicate_service_transfers=False,
+        )
+    )
+    iface = SerialIface.new(cfg)
+    captured: typing.List[IfaceCapture] = []
+    iface.begin_capture(captured.append)
+    pub = _MockPublisher()
+    snooper = Snooper(pub, SnoopSettings())  # type: ignore
+    snooper.add_iface(0, iface)
+
+    payload = bytes(range(256)) * 20  # Spans several capture fragments.
+    deadline = asyncio.get_event_loop().time() + 1.0
+    assert await iface.spoof(_make_transfer(42, 1, payload), deadline)
+    assert await iface.spoof(_make_transfer(42, 2, b"abc"), deadline)
+    await asyncio.sleep(0.5)
+    assert len(captured) > 2
+    for seq, cap in enumerate(captured):
+        snooper.feed(0, 0, seq, cap)
+    await asyncio.sleep(0.1)
+
+    assert [m.payload.payload.tobytes() for m in pub.messages] == [payload, b"abc"]
+    assert [m.transfer_id for m in pub.messages] == [1, 2]
+    assert pub.messages[0].frame_sequence_number_min_max[0] == 0
+    assert pub.messages[1].frame_sequence_number_min_max[1] == len(captured) - 1
+    stats = snooper.statistics[0]
+    assert (stats.n_completed, stats.n_evicted, stats.n_malformed, stats.n_truncated) == (2, 0, 0, 0)
+
+    # A damaged frame is reported alone; the other frames of the same chunk are still reassembled.
+    pub.messages.clear()
+    images: typing.List[bytearray] = []
+    for transfer_id, data in [(3, b"def"), (4, b"ghi"), (5, b"jkl")]:
+        del captured[:]
+        assert await iface.spoof(_make_transfer(42, transfer_id, data), asyncio.get_event_loop().time() + 1.0)
+        await asyncio.sleep(0.1)
+        images.append(bytearray(b"".join(x.frame.serial.data.tobytes() for x in captured)))
+    middle = len(images[1]) // 2
+    images[1][middle] = 0x55 if images[1][middle] != 0x55 else 0xAA
+    fragment = uavcan.metatransport.serial.Fragment_0_2(b"".join(images))  # All three frames in one chunk.
+    snooper.feed(0, 0, 1000, IfaceCapture(captured[0].timestamp, DCSFrame(serial=fragment)))
+    await asyncio.sleep(0.1)
+    assert [m.payload.payload.tobytes() for m in pub.messages] == [b"def", b"jkl"]
+    stats = snooper.statistics[0]
+    assert (stats.n_completed, stats.n_malformed) == (4, 1)
+
+    # The transfers that do not fit into the DCS message are truncated and counted.
+    pub.messages.clear()
+    del captured[:]
+    payload = bytes(range(256)) * (DCSPayload.CAPACITY_BYTES // 256 + 1)
+    assert await iface.spoof(_make_transfer(42, 6, payload), asyncio.get_event_loop().time() + 1.0)
+    await asyncio.sleep(0.5)
+    for seq, cap in enumerate(captured, start=2000):
+        snooper.feed(0, 0, seq, cap)
+    await asyncio.sleep(0.1)
+    assert [m.payload.payload.tobytes() for m in pub.messages] == [payload[: DCSPayload.CAPACITY_BYTES]]
+    stats = snooper.statistics[0]
+    assert (stats.n_completed, stats.n_malformed, stats.n_truncated) == (5, 1, 1)
+
+    snooper.close()
+    iface.close()
+    await asyncio.sleep(0.1)
+
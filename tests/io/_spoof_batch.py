@@ -0,0 +1,65 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+# pylint: disable=protected-access
+
+import typing
+import pytest
+import pyuavcan
+from pyuavcan.transport import AlienTransfer, AlienSessionSpecifier, MessageDataSpecifier, ServiceDataSpecifier
+import uavcan.si.unit.duration
+from org_uavcan_yukon.io.transfer import SpoofBatch_0_1 as SpoofBatch, SpoofBatchEntry_0_1 as SpoofBatchEntry
+from org_uavcan_yukon.io.transfer import Priority_1_0 as Priority
+from yukon.io import session_to_dcs
+from yukon.io._spoofer import Spoofer
+
+
+class _MockSubscriber:
+    def __init__(self) -> None:
+        self.handler: typing.Optional[typing.Callable[..., typing.Any]] = None
+
+    def receive_in_background(self, handler: typing.Callable[..., typing.Any]) -> None:
+        self.handler = handler
+
+
+@pytest.mark.asyncio
+async def _unittest_spoof_batch() -> None:
+    sub_batch = _MockSubscriber()
+    spoofer = Spoofer(_MockSubscriber(), dcs_sub_spoof_batch=sub_batch)  # type: ignore
+    pushed: typing.List[typing.Tuple[AlienTransfer, typing.Optional[int]]] = []
+    spoofer.push = lambda tr, _, iface_id=None: pushed.append((tr, iface_id))  # type: ignore
+    assert sub_batch.handler is not None
+
+    msg_ss = AlienSessionSpecifier(5, None, MessageDataSpecifier(1234))
+    srv_ss = AlienSessionSpecifier(5, 6, ServiceDataSpecifier(300, ServiceDataSpecifier.Role.REQUEST))
+    msg = SpoofBatch(
+        timeout=uavcan.si.unit.duration.Scalar_1_0(1.0),
+        priority=Priority(Priority.FAST),
+        iface_id=[3],
+        entry=[
+            SpoofBatchEntry(session=session_to_dcs(msg_ss), payload_offset=0),
+            SpoofBatchEntry(session=session_to_dcs(srv_ss), transfer_id=[77], payload_offset=3),
+            SpoofBatchEntry(session=session_to_dcs(msg_ss), payload_offset=3),
+            SpoofBatchEntry(session=session_to_dcs(msg_ss), payload_offset=5),
+        ],
+        payload=b"abcdefgh",
+    )
+    # Pass the message through the serialization to make sure the payloads are views of the received buffer.
+    msg = pyuavcan.dsdl.deserialize(SpoofBatch, [memoryview(b"".join(pyuavcan.dsdl.serialize(msg)))])
+    assert msg is not None
+    await sub_batch.handler(msg, None)
+
+    assert [tr.metadata.session_specifier for tr, _ in pushed] == [msg_ss, srv_ss, msg_ss, msg_ss]
+    assert [tr.metadata.transfer_id for tr, _ in pushed] == [0, 77, 1, 2]
+    assert all(tr.metadata.priority == pyuavcan.transport.Priority.FAST for tr, _ in pushed)
+    assert all(iface_id == 3 for _, iface_id in pushed)
+    assert [b"".join(tr.fragmented_payload) for tr, _ in pushed] == [b"abc", b"", b"de", b"fgh"]
+    assert all(tr.fragmented_payload[0].obj is msg.payload for tr, _ in pushed)  # Not copied.
+
+    # Invalid offsets cause the entire batch to be discarded.
+    pushed.clear()
+    msg.entry[1].payload_offset = 6
+    await sub_batch.handler(msg, None)
+    assert not pushed
+    spoofer.close()
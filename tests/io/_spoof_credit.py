@@ -0,0 +1,90 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+# pylint: disable=protected-access
+
+import typing
+import asyncio
+import pytest
+from pyuavcan.transport import AlienTransfer, AlienTransferMetadata, AlienSessionSpecifier, MessageDataSpecifier
+from pyuavcan.transport import Priority
+from org_uavcan_yukon.io.transfer import SpoofCredit_0_1 as SpoofCredit
+from yukon.io._spoofer import Spoofer, SpoofSettings
+from yukon.dcs import SpoofFlowControl
+
+
+class _Channel:
+    """
+    Connects the credit publisher of the spoofer directly to the subscriber of the producer.
+    """
+
+    def __init__(self) -> None:
+        self.handler: typing.Optional[typing.Callable[..., typing.Awaitable[None]]] = None
+        self.published: typing.List[SpoofCredit] = []
+
+    def receive_in_background(self, handler: typing.Callable[..., typing.Awaitable[None]]) -> None:
+        self.handler = handler
+
+    async def publish(self, msg: SpoofCredit) -> bool:
+        self.published.append(msg)
+        if self.handler:
+            await self.handler(msg, None)
+        return True
+
+    def close(self) -> None:
+        self.handler = None
+
+
+class _StuckIface:
+    def __init__(self) -> None:
+        self.release = asyncio.Event()
+
+    async def spoof(self, _transfer: AlienTransfer, _monotonic_deadline: float) -> bool:
+        await self.release.wait()
+        return True
+
+
+@pytest.mark.asyncio
+async def _unittest_spoof_credit() -> None:
+    chan = _Channel()
+    settings = SpoofSettings(credit_target=10, credit_period=0.01, window=1)
+    spoofer = Spoofer(_Channel(), settings, dcs_pub_spoof_credit=chan)  # type: ignore
+    flow = SpoofFlowControl(chan)  # type: ignore
+    assert not await flow.acquire(timeout=0.1)  # No ifaces yet.
+
+    iface = _StuckIface()
+    spoofer.add_iface(3, iface)  # type: ignore
+    await asyncio.sleep(0.05)
+    assert flow.iface_ids == {3}
+    assert flow.credit(3) == 10
+
+    loop = asyncio.get_event_loop()
+    ss = AlienSessionSpecifier(1, None, MessageDataSpecifier(100))
+    n_sent = 0
+    while await flow.acquire(2, iface_id=3, timeout=0.2):
+        for _ in range(2):
+            tr = AlienTransfer(AlienTransferMetadata(Priority.NOMINAL, n_sent, ss), [memoryview(b"")])
+            spoofer.push(tr, loop.time() + 10.0, 3)
+            n_sent += 1
+        assert flow.credit(3) <= 10 - spoofer.status[3].backlog  # The producer is never too optimistic.
+    # One transfer is stuck in the iface, the rest are queued up to the target. The backlog stays bounded.
+    assert n_sent == 10
+    assert spoofer.status[3].backlog == 9
+    assert flow.credit() == flow.credit(3) == 1
+    assert chan.published[-1].iface[0].received == 10
+
+    # Once the iface is unblocked, the credit is restored.
+    iface.release.set()
+    await asyncio.sleep(0.1)
+    assert spoofer.status[3].backlog == 0
+    assert flow.credit(3) == 10
+    n_published = len(chan.published)
+    await asyncio.sleep(0.1)
+    assert len(chan.published) == n_published  # Not republished until something changes.
+
+    spoofer.remove_iface(3)
+    await asyncio.sleep(0.05)
+    assert flow.iface_ids == set()
+    spoofer.close()
+    flow.close()
@@ -0,0 +1,127 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+# pylint: disable=protected-access
+
+import typing
+import asyncio
+import pytest
+import pyuavcan
+from pyuavcan.transport import AlienTransfer, AlienTransferMetadata, AlienSessionSpecifier, MessageDataSpecifier
+from pyuavcan.transport import Priority
+from pyuavcan.transport.loopback import LoopbackTransport
+from yukon.io._spoofer import _Inferior, SpoofSettings
+from yukon.io._spoof_queue import SpoofQueue, OverflowPolicy
+
+
+class _SlowIface:
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.spoofed: typing.List[int] = []
+
+    async def spoof(self, transfer: AlienTransfer, monotonic_deadline: float) -> bool:
+        await asyncio.sleep(self.delay)
+        self.spoofed.append(transfer.metadata.transfer_id)
+        return asyncio.get_event_loop().time() < monotonic_deadline
+
+
+class _SlowLoopbackIface:
+    """
+    Emulates a transport that takes a while to emit a transfer but can work on several transfers at once,
+    like a multi-frame CAN transfer waiting for the bus or a UDP socket.
+    """
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.transport = LoopbackTransport(None)
+        self.captured: typing.List[AlienTransfer] = []
+        self.transport.begin_capture(self._on_capture)
+
+    async def spoof(self, transfer: AlienTransfer, monotonic_deadline: float) -> bool:
+        await asyncio.sleep(self.delay)
+        return await self.transport.spoof(transfer, monotonic_deadline)
+
+    def _on_capture(self, cap: pyuavcan.transport.Capture) -> None:
+        assert isinstance(cap, pyuavcan.transport.loopback.LoopbackCapture)
+        self.captured.append(cap.transfer)
+
+
+def _make_transfer(priority: Priority, transfer_id: int, source_node_id: int = 1) -> AlienTransfer:
+    spec = AlienSessionSpecifier(source_node_id, None, MessageDataSpecifier(100))
+    return AlienTransfer(AlienTransferMetadata(priority, transfer_id, spec), [memoryview(b"abc")])
+
+
+def _unittest_spoof_queue_overflow() -> None:
+    q = SpoofQueue(2, OverflowPolicy.REJECT_NEW)
+    assert q.push(_make_transfer(Priority.LOW, 0), 1.0) is None
+    assert q.push(_make_transfer(Priority.LOW, 1), 1.0) is None
+    assert q.push(_make_transfer(Priority.EXCEPTIONAL, 2), 1.0).metadata.transfer_id == 2  # type: ignore
+
+    q = SpoofQueue(2, OverflowPolicy.EVICT_LOWER_PRIORITY)
+    assert q.push(_make_transfer(Priority.LOW, 0), 1.0) is None
+    assert q.push(_make_transfer(Priority.HIGH, 1), 1.0) is None
+    assert q.push(_make_transfer(Priority.LOW, 2), 1.0).metadata.transfer_id == 2  # type: ignore  # Not lower.
+    assert q.push(_make_transfer(Priority.HIGH, 3), 1.0).metadata.transfer_id == 0  # type: ignore
+    assert q.push(_make_transfer(Priority.HIGH, 4), 1.0).metadata.transfer_id == 4  # type: ignore
+    assert q.n_dropped == 3
+
+    q = SpoofQueue(2, OverflowPolicy.EVICT_EARLIEST_DEADLINE)
+    assert q.push(_make_transfer(Priority.HIGH, 0), 1.0) is None
+    assert q.push(_make_transfer(Priority.LOW, 1), 3.0) is None
+    assert q.push(_make_transfer(Priority.LOW, 2), 2.0).metadata.transfer_id == 0  # type: ignore
+    assert q.push(_make_transfer(Priority.LOW, 3), 1.5).metadata.transfer_id == 3  # type: ignore
+    assert [q.pop(0.0)[0].metadata.transfer_id for _ in range(len(q))] == [2, 1]  # type: ignore
+
+
+@pytest.mark.asyncio
+async def _unittest_spoof_inferior_scheduling() -> None:
+    iface = _SlowIface(0.05)
+    inf = _Inferior(iface, SpoofSettings(queue_capacity=10, window=1))  # type: ignore
+    now = asyncio.get_event_loop().time()
+    for i in range(4):
+        inf.push(_make_transfer(Priority.OPTIONAL, i), now + 1.0)
+    inf.push(_make_transfer(Priority.LOW, 10), now + 0.01)  # Expires while the others are being sent.
+    inf.push(_make_transfer(Priority.EXCEPTIONAL, 20), now + 1.0)
+    inf.push(_make_transfer(Priority.EXCEPTIONAL, 21), now + 0.5)  # Earlier deadline goes first.
+    status = inf.status
+    assert status.backlog == 7
+    assert status.backlog_per_priority == [2, 0, 0, 0, 0, 1, 0, 4]
+    await asyncio.sleep(0.5)
+    assert iface.spoofed == [21, 20, 0, 1, 2, 3]
+    status = inf.status
+    assert status.n_expired == 1
+    assert status.backlog == 0
+    assert status.backlog_peak == 7
+    assert status.n_transfers == 6
+    # The last one has waited for five others, each taking 50 ms to spoof. Only the lower bounds are checked
+    # because a busy host may delay the loop arbitrarily; see the benchmark suite for the actual numbers.
+    assert status.latency_queue is not None and status.latency_spoof is not None
+    assert status.latency_queue.count == 6
+    assert status.latency_queue.max > 0.1
+    assert status.latency_spoof.count == 6
+    assert status.latency_spoof.p50 > 0.02
+    assert status.latency_queue.max > status.latency_spoof.p50
+    inf.close()
+
+
+@pytest.mark.asyncio
+async def _unittest_spoof_window() -> None:
+    """
+    The throughput gained from the window is measured by the benchmark suite.
+    """
+    count, sessions, delay = 200, 10, 0.005
+    for window in [1, 8]:
+        iface = _SlowLoopbackIface(delay)
+        inf = _Inferior(iface, SpoofSettings(queue_capacity=count, window=window))  # type: ignore
+        deadline = asyncio.get_event_loop().time() + 10.0
+        for i in range(count):
+            inf.push(_make_transfer(Priority.NOMINAL, i // sessions, i % sessions), deadline)
+        while inf.status.n_transfers < count:
+            await asyncio.sleep(0.01)
+        inf.close()
+        assert len(iface.captured) == count
+        # The transfer-ID order is preserved within each session.
+        for ss in range(sessions):
+            tids = [x.metadata.transfer_id for x in iface.captured if x.metadata.session_specifier.source_node_id == ss]
+            assert tids == list(range(count // sessions))
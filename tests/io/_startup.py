@@ -0,0 +1,42 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+import sys
+import json
+import typing
+import subprocess
+from yukon.io._startup import StartupTiming
+
+
+def _run_isolated(code: str) -> typing.Any:
+    """
+    The modules imported by the test session would mask the effect, so the check is done in a new interpreter.
+    """
+    out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _unittest_lazy_imports() -> None:
+    loaded = _run_isolated(
+        """
+import sys, json
+import yukon.io
+before = sorted(x for x in sys.modules if x.startswith(("org_uavcan_yukon", "yukon.io.")))
+from yukon.io.iface import Iface
+from org_uavcan_yukon.io.iface.transport import Config_0_1, UDP_0_1
+Iface.resolve(Config_0_1(udp=UDP_0_1()))
+after = sorted(x for x in sys.modules if x.startswith("yukon.io.iface."))
+print(json.dumps([before, after]))
+"""
+    )
+    assert loaded[0] == []  # Nothing is imported with the package until needed.
+    assert "yukon.io.iface.udp" in loaded[1]  # Only the selected backend is imported.
+    assert "yukon.io.iface.can" not in loaded[1]
+    assert "yukon.io.iface.serial" not in loaded[1]
+
+
+def _unittest_startup_timing() -> None:
+    timing = StartupTiming(imports=0.25, node=0.125, first_heartbeat=0.0625, worker=0.0625)
+    assert timing.total == 0.5
+    assert str(timing) == "0.500 s total: imports 0.250 s, node 0.125 s, first heartbeat 0.062 s, worker 0.062 s"
@@ -0,0 +1,114 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+import time
+import typing
+import asyncio
+import logging
+import pytest
+from org_uavcan_yukon.io import Status_0_1 as IOStatus, Config_0_1 as IOConfig
+from yukon.io.iface import IfaceStatistics
+from yukon.io._status import StatusReporter, StatusSettings, update_operational_info, HIGH_RATE_INTERVAL
+from yukon.io._spoofer import SpoofStatus
+from yukon.io._captor import CaptureStatistics
+from yukon.io._snooper import SnoopStatistics
+
+
+_logger = logging.getLogger(__name__)
+
+
+class _MockPublisher:
+    def __init__(self) -> None:
+        self.published: typing.List[IOStatus] = []
+        self.exported: typing.List[typing.Tuple[int, int]] = []
+
+    async def publish(self, msg: IOStatus) -> bool:
+        self.published.append(msg)
+        self.exported.append((msg.status_published, msg.status_unchanged))
+        return True
+
+
+@pytest.mark.asyncio
+async def _unittest_status_reporter() -> None:
+    pub = _MockPublisher()
+    rep = StatusReporter(pub, StatusSettings(interval_min=0.05, interval_max=0.3))  # type: ignore
+    assert await rep.publish()  # The first one is always published.
+    assert not await rep.publish()  # Too early.
+    await asyncio.sleep(0.06)
+    assert not await rep.publish()  # Nothing has changed.
+
+    rep.set_initializing(3)
+    rep.set_initializing(1)
+    assert await rep.publish()
+    assert [x.iface_id for x in rep.message.iface_status] == [1, 3]
+    assert rep.message.iface_status[0].state.initialization is not None
+
+    info = rep.get_operational(1)
+    info.media_frames = 100
+    assert not await rep.publish()  # Changed but the minimum interval has not passed yet.
+    assert await rep.publish(force=True)
+    assert rep.get_operational(1) is info  # Updated in place.
+    assert rep.message.iface_status[0].state.operational.media_frames == 100
+
+    rep.set_failure(3, "Boom")
+    rep.remove(1)
+    assert [x.iface_id for x in rep.message.iface_status] == [3]
+    await asyncio.sleep(0.06)
+    assert await rep.publish()
+    assert rep.message.iface_status[0].state.failure.value.tobytes() == b"Boom"
+
+    await asyncio.sleep(0.06)
+    assert not await rep.publish()
+    await asyncio.sleep(0.3)
+    assert await rep.publish()  # Unchanged but the maximum interval has passed.
+    stats = rep.statistics
+    assert stats.n_published == len(pub.published) == 5
+    assert stats.n_unchanged == 2
+    assert pub.exported[0] == (1, 0)
+    assert pub.exported[-1] == (5, 2)  # The statistics are exported only in the published messages.
+    assert (rep.message.status_published, rep.message.status_unchanged) == (0, 0)
+
+    with pytest.raises(ValueError):
+        StatusReporter(pub, StatusSettings(interval_min=1.0, interval_max=0.5))  # type: ignore
+
+
+@pytest.mark.asyncio
+async def _unittest_status_reporter_default() -> None:
+    pub = _MockPublisher()
+    rep = StatusReporter(pub, StatusSettings())  # type: ignore
+    assert await rep.publish()
+    for _ in range(3):  # The time is shifted instead of sleeping for the default intervals.
+        rep._last_published_at -= StatusSettings().interval_min  # pylint: disable=protected-access
+        assert not await rep.publish()  # An unchanged status is not republished every cycle.
+    assert rep.statistics.n_unchanged == 3
+    rep._last_published_at -= StatusSettings().interval_max  # pylint: disable=protected-access
+    assert await rep.publish()
+    assert pub.exported == [(1, 0), (2, 3)]
+
+
+@pytest.mark.asyncio
+async def _unittest_status_reporter_cpu_cost() -> None:
+    """
+    Every cycle of the high-rate mode updates all ifaces and publishes the status because the counters change.
+    """
+    pub = _MockPublisher()
+    rep = StatusReporter(pub, StatusSettings(interval_min=1e-9, interval_max=1e-9))  # type: ignore
+    iface_ids = list(range(IOConfig.MAX_REDUNDANCY_FACTOR))
+    count = 1000
+    started_at = time.process_time()
+    for i in range(count):
+        for iface_id in iface_ids:
+            update_operational_info(
+                rep.get_operational(iface_id),
+                IfaceStatistics(n_frames=i, n_media_layer_bytes=i * 8, n_errors=0, media_utilization_pct=i % 100),
+                SpoofStatus(n_transfers=i, backlog=i % 10),
+                CaptureStatistics(n_frames=i, n_batches=i // 10),
+                SnoopStatistics(n_completed=i),
+            )
+        await rep.publish()
+    cycle = (time.process_time() - started_at) / count
+    load = cycle / HIGH_RATE_INTERVAL
+    _logger.info("Status cycle: %.0f us; CPU load at %.0f Hz: %.2f%%", cycle * 1e6, 1 / HIGH_RATE_INTERVAL, load * 100)
+    assert len(pub.published) == count
+    assert load < 0.05
@@ -0,0 +1,72 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+import os
+import sys
+import asyncio
+import pytest
+from org_uavcan_yukon.io import Config_0_1 as IOConfig
+from org_uavcan_yukon.io.iface import Config_0_1 as IOIfaceConfig
+from org_uavcan_yukon.io.frame import Filter_0_1 as DCSFilter
+from yukon.io._supervisor import ChildProcess, SupervisorSettings
+
+
+_FAKE_CHILD = """
+import sys
+import struct
+import pyuavcan
+from org_uavcan_yukon.io import Config_0_1, Status_0_1
+from org_uavcan_yukon.io.iface import Status_0_1 as IfaceStatus
+
+while True:
+    header = sys.stdin.buffer.read(4)
+    if len(header) < 4:
+        sys.exit(0)
+    cfg = pyuavcan.dsdl.deserialize(Config_0_1, [memoryview(sys.stdin.buffer.read(struct.unpack("<I", header)[0]))])
+    iface_id = int(cfg.iface_config[0].iface_id)
+    status = Status_0_1(iface_status=[IfaceStatus(iface_id=iface_id)], record_frames=iface_id)
+    payload = b"".join(pyuavcan.dsdl.serialize(status))
+    sys.stdout.buffer.write(struct.pack("<I", len(payload)) + payload)
+    sys.stdout.buffer.flush()
+    if len(cfg.capture_filter) > 0:
+        sys.exit(3)  # Crash on request.
+"""
+"""
+Speaks the protocol of the real child without depending on the DCS node.
+"""
+
+
+@pytest.mark.asyncio
+async def _unittest_child_process() -> None:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    settings = SupervisorSettings(child_node_ids=[], restart_interval_min=0.2, restart_interval_max=1.0)
+    child = ChildProcess(5, [sys.executable, "-c", _FAKE_CHILD], env, settings)
+    cfg = IOConfig(iface_config=[IOIfaceConfig(iface_id=5)])
+    child.configure(cfg)  # Delivered once the process is started.
+    for _ in range(100):
+        await asyncio.sleep(0.1)
+        if child.status is not None:
+            break
+    assert child.status is not None
+    assert child.status.record_frames == 5
+    assert child.failure is None
+    assert child.n_restarts == 0
+    pid = child.pid
+    assert pid is not None
+
+    # A crash does not go unnoticed; the child is restarted with the last configuration, which crashes it again.
+    child.configure(IOConfig(iface_config=cfg.iface_config, capture_filter=[DCSFilter()]))
+    for _ in range(100):
+        await asyncio.sleep(0.1)
+        if child.n_restarts >= 1:
+            break
+    assert child.n_restarts >= 1
+    assert child.failure == "Exited with code 3"
+    assert child.pid != pid
+
+    # The child exits when its standard input is closed.
+    child.configure(cfg)
+    child.close()
+    await asyncio.sleep(1.0)
+    assert child.pid is None
@@ -0,0 +1,133 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+# pylint: disable=protected-access
+
+import typing
+import asyncio
+import pytest
+import pyuavcan
+from pyuavcan.transport import AlienTransfer, AlienTransferMetadata, AlienSessionSpecifier, MessageDataSpecifier
+from pyuavcan.transport.can import CANTransport, CANCapture
+from pyuavcan.transport.can._identifier import MessageCANID, ServiceCANID
+from pyuavcan.transport.can.media import DataFrame, FrameFormat
+from pyuavcan.transport.can.media.pythoncan import PythonCANMedia
+from org_uavcan_yukon.io.iface.transport import Config_0_1 as DCSTransportConfig, CAN_0_1 as DCSCANConfig
+import uavcan.primitive
+from yukon.io.iface import Iface, IfaceCapture
+from yukon.io.iface.can import CANIface
+from yukon.io._filter import CaptureFilter, FilterRule
+
+
+@pytest.mark.asyncio
+async def _unittest_can_iface() -> None:
+    cfg = DCSTransportConfig(
+        can=DCSCANConfig(
+            driver=DCSCANConfig.DRIVER_NULL,
+            iface_name=uavcan.primitive.String_1_0("ignored"),
+            bitrate_arbitration=1_000_000,
+            bitrate_data=0,
+        )
+    )
+    assert Iface.resolve(cfg) is CANIface
+    iface = CANIface.new(cfg)
+    captured: typing.List[IfaceCapture] = []
+    iface.begin_capture(captured.append)
+
+    # Another node on the same virtual bus.
+    peer = CANTransport(PythonCANMedia("virtual:", 1_000_000), None)
+    transfer = AlienTransfer(
+        AlienTransferMetadata(
+            pyuavcan.transport.Priority.NOMINAL,
+            5,
+            AlienSessionSpecifier(42, None, MessageDataSpecifier(100)),
+        ),
+        [memoryview(b"Hello world! 12345")],
+    )
+    assert await peer.spoof(transfer, asyncio.get_event_loop().time() + 1.0)
+    await asyncio.sleep(0.5)
+
+    assert len(captured) == 3
+    for cap in captured:
+        fr = cap.frame.can.data_classic
+        assert fr
+        assert fr.arbitration_id.extended.value == 0x1060642A
+        assert cap.source_node_id == 42
+    assert captured[0].frame.can.data_classic.data.tobytes() == b"Hello w\xa5"
+    assert captured[0].frame.can.data_classic.arbitration_id is captured[1].frame.can.data_classic.arbitration_id
+
+    # The DCS representation is convertible back into the native capture.
+    native = CANIface.capture_from_dcs(captured[0].timestamp, captured[0].frame)
+    assert isinstance(native, CANCapture)
+    assert native.frame == DataFrame(FrameFormat.EXTENDED, 0x1060642A, bytearray(b"Hello w\xa5"))
+
+    stats = iface.sample_statistics()
+    assert stats.n_frames == 3
+    assert stats.n_media_layer_bytes == 8 + 8 + 7
+    assert stats.n_errors == 0
+    assert stats.media_utilization_pct is not None and 0 <= stats.media_utilization_pct <= 100
+
+    iface.close()
+    peer.close()
+    await asyncio.sleep(0.1)
+
+
+@pytest.mark.asyncio
+async def _unittest_can_iface_filter() -> None:
+    iface = CANIface(CANTransport(PythonCANMedia("virtual:", 1_000_000), None), (1_000_000, 1_000_000))
+    captured: typing.List[IfaceCapture] = []
+    iface.begin_capture(captured.append)
+    flt = CaptureFilter(
+        [
+            FilterRule(subject_id_range=(1000, 1009), source_node_id=3, drop=True),
+            FilterRule(subject_id_range=(1000, 1099)),
+            FilterRule(service_id=430),
+        ]
+    )
+    iface.set_capture_filter(flt.accept)
+    ts = pyuavcan.transport.Timestamp.now()
+    can_ids = [
+        MessageCANID(pyuavcan.transport.Priority.NOMINAL, 3, 1005).compile([]),  # Dropped by the first rule.
+        MessageCANID(pyuavcan.transport.Priority.NOMINAL, 4, 1005).compile([]),  # Accepted by the second rule.
+        MessageCANID(pyuavcan.transport.Priority.NOMINAL, 3, 1100).compile([]),  # No match, dropped by default.
+        ServiceCANID(pyuavcan.transport.Priority.HIGH, 1, 2, 430, True).compile([]),  # Accepted by the third rule.
+        0x1FFF_FFFF,  # Not a UAVCAN frame, accepted.
+    ]
+    for can_id in can_ids:
+        iface._process_capture(CANCapture(ts, DataFrame(FrameFormat.EXTENDED, can_id, bytearray(b"\xE0")), False))
+    assert [x.frame.can.data_classic.arbitration_id.extended.value for x in captured] == [can_ids[i] for i in (1, 3, 4)]
+    stats = iface.sample_statistics()
+    assert stats.n_frames == 5  # The rejected frames are still accounted for in the media layer statistics.
+    assert stats.n_filtered == 2
+    assert flt.hits == [1, 1, 1]
+    assert flt.drops == [1, 0, 0]
+
+    iface.set_capture_filter(None)
+    iface._process_capture(CANCapture(ts, DataFrame(FrameFormat.EXTENDED, can_ids[0], bytearray(b"\xE0")), False))
+    assert len(captured) == 4
+    assert iface.sample_statistics().n_filtered == 2
+    iface.close()
+    await asyncio.sleep(0.1)
+
+
+@pytest.mark.asyncio
+async def _unittest_can_iface_capture_fd() -> None:
+    """
+    The conversion cost is measured by ``tests.io._benchmark``.
+    """
+    count = 100
+    bitrate = 1_000_000, 5_000_000
+    iface = CANIface(CANTransport(PythonCANMedia("virtual:", bitrate), None), bitrate)
+    sink: typing.List[IfaceCapture] = []
+    iface.begin_capture(sink.append)
+    ts = pyuavcan.transport.Timestamp.now()
+    frames = [
+        CANCapture(ts, DataFrame(FrameFormat.EXTENDED, 0x1060642A + i % 8, bytearray(64)), own=False)
+        for i in range(count)
+    ]
+    for fr in frames:
+        iface._process_capture(fr)
+    iface.close()
+    assert len(sink) == count
+    assert sink[0].frame.can.data_fd
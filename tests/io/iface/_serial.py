@@ -0,0 +1,64 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+import typing
+import asyncio
+import pytest
+import pyuavcan
+from pyuavcan.transport import AlienTransfer, AlienTransferMetadata, AlienSessionSpecifier, MessageDataSpecifier
+from pyuavcan.transport.serial import SerialCapture
+from org_uavcan_yukon.io.iface.transport import Config_0_1 as DCSTransportConfig, Serial_0_1 as DCSSerialConfig
+import uavcan.primitive
+from uavcan.metatransport.serial import Fragment_0_2 as Fragment
+from yukon.io.iface import Iface, IfaceCapture
+from yukon.io.iface.serial import SerialIface
+
+
+@pytest.mark.asyncio
+async def _unittest_serial_iface_loopback() -> None:
+    cfg = DCSTransportConfig(
+        serial=DCSSerialConfig(
+            port_name=uavcan.primitive.String_1_0(""),  # Loopback.
+            baudrate=10_000_000,  # The loopback emulates the transmission delay.
+            duplicate_service_transfers=False,
+        )
+    )
+    assert Iface.resolve(cfg) is SerialIface
+    iface = SerialIface.new(cfg)
+    captured: typing.List[IfaceCapture] = []
+    iface.begin_capture(captured.append)
+
+    # The payload is large enough to span several fragments.
+    payload = bytes(range(256)) * 20
+    transfer = AlienTransfer(
+        AlienTransferMetadata(
+            pyuavcan.transport.Priority.NOMINAL,
+            5,
+            AlienSessionSpecifier(42, None, MessageDataSpecifier(100)),
+        ),
+        [memoryview(payload)],
+    )
+    for _ in range(3):
+        assert await iface.spoof(transfer, asyncio.get_event_loop().time() + 1.0)
+    await asyncio.sleep(1.0)
+
+    # The stream is captured once (on read) and it contains all three frames. Every fragment is zero-copy.
+    assert captured
+    assert all(len(x.frame.serial.data) <= Fragment.CAPACITY_BYTES for x in captured)
+    stream = b"".join(x.frame.serial.data.tobytes() for x in captured)
+    assert stream.count(b"\x00") == 3 * 2  # Each frame is delimited on both ends.
+    assert len(stream) > len(payload) * 3
+
+    stats = iface.sample_statistics()
+    assert stats.n_media_layer_bytes == len(stream)
+    assert stats.n_frames == 3 + 3  # Each frame is counted when it is sent and when it is received back.
+    assert stats.n_errors == 0
+    assert stats.media_utilization_pct is None  # Unknown for the loopback.
+
+    native = SerialIface.capture_from_dcs(captured[0].timestamp, captured[0].frame)
+    assert isinstance(native, SerialCapture)
+    assert native.fragment.tobytes() == captured[0].frame.serial.data.tobytes()
+
+    iface.close()
+    await asyncio.sleep(0.1)
@@ -0,0 +1,154 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+# pylint: disable=protected-access
+
+import time
+import socket
+import typing
+import logging
+import tracemalloc
+import numpy
+import pytest
+import pyuavcan
+from pyuavcan.transport.udp import UDPCapture, LinkLayerPacket
+from pyuavcan.transport.loopback import LoopbackTransport
+import uavcan.metatransport.ethernet
+from uavcan.metatransport.ethernet import EtherType_0_1 as EtherType
+from yukon.io.iface import IfaceCapture, DCSFrame
+from yukon.io.iface.udp import UDPIface, _get_link_speed
+
+
+_logger = logging.getLogger(__name__)
+
+
+def _make_capture() -> UDPCapture:
+    packet = memoryview(bytes(range(6)) + bytes(range(6, 12)) + b"\x08\x00" + bytes(1000))
+    return UDPCapture(
+        timestamp=pyuavcan.transport.Timestamp.now(),
+        link_layer_packet=LinkLayerPacket(
+            protocol=socket.AF_INET,
+            source=packet[6:12],
+            destination=packet[:6],
+            payload=packet[14:],
+        ),
+    )
+
+
+def _process_capture_reference(cap: UDPCapture, sink: typing.Callable[[IfaceCapture], None]) -> None:
+    """
+    The original implementation of :meth:`UDPIface._process_capture` kept for comparison.
+    """
+
+    def mk_addr(x: memoryview) -> bytes:
+        return x.tobytes().ljust(6, b"\x00")[:6]
+
+    llp = cap.link_layer_packet
+    dcs = DCSFrame(
+        udp=uavcan.metatransport.ethernet.Frame_0_1(
+            destination=mk_addr(llp.destination),
+            source=mk_addr(llp.source),
+            ethertype=EtherType(EtherType.IP_V4),
+            payload=numpy.asarray(llp.payload, dtype=numpy.uint8),
+        ),
+    )
+    iface_cap = IfaceCapture(timestamp=cap.timestamp, frame=dcs)
+    _logger.debug("Captured %r", iface_cap)
+    pyuavcan.util.broadcast([sink])(iface_cap)
+
+
+def _measure(fun: typing.Callable[[UDPCapture], None], count: int) -> typing.Tuple[float, float, float]:
+    """
+    :returns: (allocated blocks per frame, allocated bytes per frame, seconds per frame).
+    The results are retained by the sink until the measurement is finished, as they would be in the capture buffer.
+    """
+    cap = _make_capture()
+    fun(cap)  # Warm up the caches.
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for _ in range(count):
+            fun(cap)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+    blocks = sum(x.count_diff for x in diff) / count
+    size = sum(x.size_diff for x in diff) / count
+
+    started_at = time.perf_counter()
+    for _ in range(count):
+        fun(cap)
+    elapsed = (time.perf_counter() - started_at) / count
+    return blocks, size, elapsed
+
+
+@pytest.mark.asyncio
+async def _unittest_udp_capture_allocations() -> None:  # Async because the transport requires an event loop.
+    """
+    A microbenchmark comparing the per-frame cost of the capture conversion against the original implementation.
+    """
+    count = 3000
+    sink: typing.List[IfaceCapture] = []
+
+    # The test suite runs with debug logging enabled; the cost of the log formatting would dominate the result.
+    loggers = [_logger, logging.getLogger(UDPIface.__module__)]
+    levels = [x.level for x in loggers]
+    for lg in loggers:
+        lg.setLevel(logging.INFO)
+    try:
+        ref = _measure(lambda c: _process_capture_reference(c, sink.append), count)
+        sink.clear()
+
+        iface = UDPIface(LoopbackTransport(None))
+        iface.begin_capture(sink.append)
+        new = _measure(iface._process_capture, count)
+        sink.clear()
+        iface.close()
+    finally:
+        for lg, lv in zip(loggers, levels):
+            lg.setLevel(lv)
+
+    for name, (blocks, size, elapsed) in [("reference", ref), ("current", new)]:
+        _logger.info("%-10s: %5.1f blocks/frame, %7.1f bytes/frame, %6.2f us/frame", name, blocks, size, elapsed * 1e6)
+
+    assert new[0] < ref[0]
+    assert new[1] < ref[1]
+    assert new[1] < 1000  # The payload is not copied.
+
+
+@pytest.mark.asyncio
+async def _unittest_udp_media_utilization() -> None:
+    def feed(it: UDPIface, count: int, period_ns: int, start_ns: int) -> None:
+        base = _make_capture()
+        for i in range(count):
+            ts = pyuavcan.transport.Timestamp(system_ns=0, monotonic_ns=start_ns + i * period_ns)
+            it._process_capture(UDPCapture(ts, base.link_layer_packet))
+
+    # The timestamps are synthetic and the sampling time is specified explicitly, so the outcome does not depend
+    # on how long the feeding takes.
+    now = 1_000_000_000_000
+
+    # One second worth of 1000-byte packets at 1 kHz, which occupies 1038 bytes per packet on the wire: 8.3 Mbit/s.
+    iface = UDPIface(LoopbackTransport(None), link_speed=10e6)
+    feed(iface, 1000, 1_000_000, now - 1_000_000_000)
+    stats = iface.sample_statistics(now)
+    assert stats.n_frames == 1000
+    assert stats.media_utilization_pct is not None and 70 <= stats.media_utilization_pct <= 85
+    assert stats.media_utilization_peak_pct == 83
+
+    # A short burst is reflected in the peak while the mean stays moderate.
+    iface = UDPIface(LoopbackTransport(None), link_speed=100e6)
+    feed(iface, 2000, 100_000, now - 500_000_000)
+    stats = iface.sample_statistics(now)
+    assert stats.media_utilization_pct is not None and 15 <= stats.media_utilization_pct <= 18
+    assert stats.media_utilization_peak_pct == 83
+
+    # The link speed is unknown.
+    iface = UDPIface(LoopbackTransport(None))
+    feed(iface, 10, 1_000_000, now - 100_000_000)
+    stats = iface.sample_statistics(now)
+    assert stats.media_utilization_pct is None
+    assert stats.media_utilization_peak_pct is None
+    assert _get_link_speed("127.0.0.1") is None  # Virtual NICs do not report the speed.
@@ -0,0 +1,124 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+# pylint: disable=protected-access
+
+import time
+import typing
+from pathlib import Path
+import pytest
+from pyuavcan.transport import Priority, Timestamp
+from pyuavcan.transport.can._identifier import MessageCANID
+import uavcan.metatransport.can
+from yukon.io.iface import IfaceCapture, DCSFrame
+from yukon.io.record import Recorder, RecorderSettings, CaptureLog
+from yukon.io.record import _reader
+
+
+def _make_capture(i: int) -> IfaceCapture:
+    """
+    Frame i is published on subject 1000 + i % 10 by node i % 7, timestamped at i milliseconds past 1000 s.
+    """
+    can_id = MessageCANID(Priority.NOMINAL, i % 7, 1000 + i % 10).compile([])
+    frame = DCSFrame(
+        can=uavcan.metatransport.can.Frame_0_2(
+            data_classic=uavcan.metatransport.can.DataClassic_0_1(
+                uavcan.metatransport.can.ArbitrationID_0_1(
+                    extended=uavcan.metatransport.can.ExtendedArbitrationID_0_1(can_id)
+                ),
+                bytes([i % 256, 0xE0]),
+            )
+        )
+    )
+    return IfaceCapture(Timestamp(system_ns=1_000_000_000_000 + i * 1_000_000, monotonic_ns=0), frame)
+
+
+def _record(rec: Recorder, indexes: typing.Iterable[int]) -> None:
+    for i in indexes:
+        rec.feed(i % 2, 0, i // 2, _make_capture(i))
+
+
+def _unittest_capture_log(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(_reader, "INDEX_BLOCK_SIZE", 100)
+    count = 2000
+    rec = Recorder(tmp_path, RecorderSettings(segment_size_max=32 * 1024, flush_interval=0.01, write_block_size=4096))
+    _record(rec, range(count))
+    rec.close()
+    assert rec.statistics.n_segments > 1
+
+    log = CaptureLog(tmp_path)
+    assert log.time_range == pytest.approx((1000.0, 1000.0 + (count - 1) * 1e-3))
+    everything = list(log.query())
+    assert len(everything) == count
+    assert [(r.iface_id, r.sequence_number) for r in everything] == [(i % 2, i // 2) for i in range(count)]
+    assert everything[123].capture.frame.can.data_classic.data.tobytes() == bytes([123, 0xE0])
+    assert everything[123].to_dcs().sequence_number == 61
+
+    # Time range. Only the blocks that intersect the range are visited.
+    out = list(log.query(time_range=(1000.5, 1000.6)))
+    assert [r.capture.timestamp.system_ns for r in out] == [1_000_000_000_000 + i * 1_000_000 for i in range(500, 601)]
+    n_selected = 0
+    for seg in log._segments.values():
+        expected = [b for b in seg._indexed if b.ts_max >= 1000_500_000 and b.ts_min <= 1000_600_000]
+        assert seg.select(1000_500_000, 1000_600_000) == expected + ([seg._tail] if seg._tail else [])
+        n_selected += len(expected)
+    assert 0 < n_selected < sum(len(seg._indexed) for seg in log._segments.values())
+
+    # Sequence numbers are per iface.
+    out = list(log.query(iface_id=1, sequence_number_range=(10, 12)))
+    assert [(r.iface_id, r.sequence_number) for r in out] == [(1, 10), (1, 11), (1, 12)]
+
+    # Subject and source.
+    out = list(log.query(subject_id=1003, source_node_id=5))
+    assert [r.capture.timestamp.system_ns // 1_000_000 - 1_000_000 for r in out] == [
+        i for i in range(count) if i % 10 == 3 and i % 7 == 5
+    ]
+    assert not list(log.query(subject_id=1010))
+    log.close()
+
+    # The index is persisted; reopening does not rebuild it.
+    index_files = sorted(tmp_path.glob("*.idx"))
+    assert len(index_files) == rec.statistics.n_segments
+    seg = _reader._Segment(sorted(tmp_path.glob("*.ycap"))[0])
+    assert len(seg._indexed) > 1
+    seg.close()
+    log = CaptureLog(tmp_path)
+    assert len(list(log.query(source_node_id=3))) == len([i for i in range(count) if i % 7 == 3])
+    log.close()
+
+
+def _unittest_capture_log_shards(tmp_path: Path) -> None:
+    rec = Recorder(tmp_path, RecorderSettings(flush_interval=0.01))
+    for i in range(30):
+        rec.feed(0, i % 3, i // 3, _make_capture(i))  # Each shard is numbered separately.
+    rec.close()
+
+    log = CaptureLog(tmp_path)
+    assert [(r.shard, r.sequence_number) for r in log.query()][:4] == [(0, 0), (1, 0), (2, 0), (0, 1)]
+    out = list(log.query(iface_id=0, shard=2, sequence_number_range=(3, 4)))
+    assert [(r.shard, r.sequence_number) for r in out] == [(2, 3), (2, 4)]
+    assert [r.capture.timestamp.system_ns // 1_000_000 - 1_000_000 for r in out] == [11, 14]
+    log.close()
+
+
+def _unittest_capture_log_live(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(_reader, "INDEX_BLOCK_SIZE", 100)
+    rec = Recorder(tmp_path, RecorderSettings(flush_interval=0.01))
+    _record(rec, range(250))
+    time.sleep(0.2)
+
+    log = CaptureLog(tmp_path)
+    assert len(list(log.query())) == 250
+    (seg,) = log._segments.values()
+    assert len(seg._indexed) == 2  # The incomplete tail block is not persisted.
+
+    _record(rec, range(250, 420))
+    time.sleep(0.2)
+    assert len(list(log.query())) == 420  # The new records are picked up incrementally.
+    assert len(seg._indexed) == 4
+    assert [r.sequence_number for r in log.query(iface_id=0, sequence_number_range=(200, 300))] == list(
+        range(200, 210)
+    )
+    rec.close()
+    log.close()
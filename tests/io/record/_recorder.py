@@ -0,0 +1,86 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+import time
+import typing
+from pathlib import Path
+import pyuavcan
+import uavcan.metatransport.serial
+from org_uavcan_yukon.io.frame import Frame_0_1 as DCSFrame
+from yukon.io.iface import IfaceCapture
+from yukon.io.record import Recorder, RecorderSettings
+from yukon.io.record._format import SEGMENT_HEADER, SEGMENT_MAGIC, FORMAT_VERSION, RECORD_HEADER, RECORD_MARKER
+
+
+def _parse_segment(path: Path) -> typing.List[typing.Tuple[int, int, int, DCSFrame]]:
+    data = memoryview(path.read_bytes())
+    magic, version, _ = SEGMENT_HEADER.unpack_from(data)
+    assert magic == SEGMENT_MAGIC
+    assert version == FORMAT_VERSION
+    offset = SEGMENT_HEADER.size
+    out = []
+    while offset < len(data):
+        marker, iface_id, _, size, ts, seq = RECORD_HEADER.unpack_from(data, offset)
+        assert marker == RECORD_MARKER
+        offset += RECORD_HEADER.size
+        frame = pyuavcan.dsdl.deserialize(DCSFrame, [data[offset : offset + size]])
+        assert frame is not None
+        offset += size
+        out.append((iface_id, seq, ts, frame))
+    assert offset == len(data)
+    return out
+
+
+def _unittest_recorder(tmp_path: Path) -> None:
+    settings = RecorderSettings(
+        segment_size_max=64 * 1024,
+        flush_interval=0.01,
+        fsync_interval=0.05,
+        write_block_size=4096,
+    )
+    rec = Recorder(tmp_path / "log", settings)
+    ts = pyuavcan.transport.Timestamp(system_ns=1_000_000_000, monotonic_ns=0)
+    count = 2000
+    for i in range(count):
+        frame = DCSFrame(serial=uavcan.metatransport.serial.Fragment_0_2(bytes([i % 256]) * 100))
+        rec.feed(i % 2, 0, i, IfaceCapture(ts, frame))
+    time.sleep(0.5)
+    stats = rec.statistics
+    assert stats.n_frames == count
+    assert stats.n_dropped == 0
+    assert stats.n_errors == 0
+    rec.close()
+
+    segments = sorted((tmp_path / "log").iterdir())
+    assert [x.name for x in segments] == [f"{i:06d}.ycap" for i in range(stats.n_segments)]
+    assert stats.n_segments > 2  # Rotated by size.
+    assert sum(x.stat().st_size for x in segments) == stats.n_bytes + SEGMENT_HEADER.size * stats.n_segments
+    assert all(x.stat().st_size <= settings.segment_size_max + settings.write_block_size for x in segments)
+
+    records = [r for s in segments for r in _parse_segment(s)]
+    assert [r[1] for r in records] == list(range(count))
+    assert [r[0] for r in records] == [i % 2 for i in range(count)]
+    assert all(r[2] == 1_000_000 for r in records)
+    assert records[300][3].serial.data.tobytes() == bytes([300 % 256]) * 100
+
+
+def _unittest_recorder_overflow(tmp_path: Path) -> None:
+    rec = Recorder(tmp_path, RecorderSettings(flush_interval=0.5, buffer_capacity=100, segment_duration_max=0.1))
+    cap = IfaceCapture(
+        pyuavcan.transport.Timestamp.now(),
+        DCSFrame(serial=uavcan.metatransport.serial.Fragment_0_2(b"abc")),
+    )
+    for i in range(150):
+        rec.feed(0, 0, i, cap)
+    assert rec.statistics.n_dropped == 50  # The writer thread is asleep, so the excess is dropped immediately.
+    time.sleep(0.7)
+    for i in range(150, 160):
+        rec.feed(0, 0, i, cap)
+    rec.close()  # Remaining frames are written out before closing.
+    stats = rec.statistics
+    assert stats.n_frames == 110
+    assert stats.n_segments == 2  # Rotated by time.
+    assert [r[1] for s in sorted(tmp_path.iterdir()) for r in _parse_segment(s)] == list(range(100)) + list(
+        range(150, 160)
+    )
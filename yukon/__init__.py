@@ -4,10 +4,16 @@
 
 import os
 import sys
+import time
 import typing
 import logging
 from pathlib import Path
 
+IMPORTED_AT = time.monotonic()
+"""
+When the import of the package has started; used for reporting the startup time of the processes.
+"""
+
 __version__: str = (Path(__file__).parent / "VERSION").read_text().strip()
 __version_info__: typing.Tuple[int, ...] = tuple(map(int, __version__.split(".")[:3]))
 __author__ = "UAVCAN Consortium"
@@ -20,11 +26,17 @@ if sys.version_info < (3, 9):  # pragma: no cover
     raise RuntimeError("A newer version of Python is required")
 
 
-logging.basicConfig(
-    stream=sys.stderr,
-    level=os.getenv("YUKON_LOGLEVEL", "WARNING"),
-    format="%(asctime)s %(process)07d %(levelname)-3.3s: %(name)s: %(message)s",
-)
+def configure_logging() -> None:
+    """
+    To be invoked by the entry points of the processes. Importing the package does not alter the logging configuration
+    so that it does not interfere with the application that uses it as a library (e.g., the tests).
+    """
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=os.getenv("YUKON_LOGLEVEL", "WARNING"),
+        format="%(asctime)s %(process)07d %(levelname)-3.3s: %(name)s: %(message)s",
+    )
+
 
 # DSDL packages are pre-compiled when the package is built, so we do not need to compile our dependencies at runtime.
 sys.path.insert(0, str(Path(__file__).resolve().parent / ".compiled"))
@@ -4,3 +4,4 @@
 
 from __future__ import annotations
 from ._node import Node as Node
+from ._spoof_flow import SpoofFlowControl as SpoofFlowControl
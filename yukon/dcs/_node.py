@@ -5,7 +5,7 @@
 from __future__ import annotations
 import os
 import time
-from typing import TypeVar, Type
+from typing import TypeVar, Type, Callable
 import asyncio
 import logging
 import pyuavcan
@@ -46,6 +46,12 @@ class Node:
         assert isinstance(out, asyncio.AbstractEventLoop)
         return out
 
+    @property
+    def id(self) -> int:
+        out = self._node.id
+        assert out is not None
+        return out
+
     @property
     def shutdown(self) -> bool:
         """
@@ -57,6 +63,16 @@ class Node:
     def health(self) -> Health:
         return self._node.heartbeat_publisher.health
 
+    @property
+    def registry(self) -> register.Registry:
+        return self._node.registry
+
+    def add_pre_heartbeat_handler(self, handler: Callable[[], None]) -> None:
+        """
+        The handler is invoked from the event loop right before each heartbeat is published.
+        """
+        self._node.heartbeat_publisher.add_pre_heartbeat_handler(handler)
+
     def make_publisher(self, dtype: Type[MessageClass], port_name: str) -> Publisher[MessageClass]:
         return self._node.make_publisher(dtype, port_name)
 
@@ -0,0 +1,96 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import typing
+import asyncio
+import logging
+import pyuavcan
+from pyuavcan.presentation import Subscriber
+
+if typing.TYPE_CHECKING:  # Not imported at runtime to keep the DSDL namespace out of the startup path of the nodes.
+    from org_uavcan_yukon.io.transfer import SpoofCredit_0_1 as SpoofCredit
+
+
+class SpoofFlowControl:
+    """
+    Helps the producers of spoofed transfers to respect the spoof credit published by the IO worker
+    (see ``org_uavcan_yukon.io.transfer.SpoofCredit``).
+    Before sending a Spoof or a SpoofBatch message, the producer acquires the credit for the transfers it contains::
+
+        flow = SpoofFlowControl(node.make_subscriber(SpoofCredit_0_1, "spoof_credit"))
+        if await flow.acquire(len(batch.entry), iface_id=0):
+            await pub_spoof_batch.publish(batch)
+
+    The number of transfers acquired at once should not exceed the credit target configured in the IO worker,
+    otherwise the credit will never be sufficient.
+    """
+
+    def __init__(self, sub_credit: Subscriber[SpoofCredit]) -> None:
+        self._sub = sub_credit
+        self._credit: typing.Dict[int, int] = {}
+        self._received: typing.Dict[int, int] = {}
+        self._sent: typing.Dict[int, int] = {}
+        self._event_update = asyncio.Event()
+        self._sub.receive_in_background(self._on_credit)
+
+    @property
+    def iface_ids(self) -> typing.Set[int]:
+        return set(self._credit.keys())
+
+    def credit(self, iface_id: typing.Optional[int] = None) -> int:
+        """
+        The number of transfers that can be sent to the specified iface now.
+        If no iface is specified, the result is for a transfer that is emitted over all ifaces.
+        Unknown ifaces have no credit.
+        """
+        if iface_id is None:
+            return min((self.credit(x) for x in self._credit), default=0)
+        try:
+            credit = self._credit[iface_id]
+        except LookupError:
+            return 0
+        return max(0, credit - (self._sent[iface_id] - self._received[iface_id]))
+
+    async def acquire(self, count: int = 1, iface_id: typing.Optional[int] = None, timeout: float = 1.0) -> bool:
+        """
+        Waits until the credit is sufficient to send the specified number of transfers and consumes it.
+        Returns False if the credit could not be acquired in the specified time; in that case nothing is consumed.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while self.credit(iface_id) < count:
+            self._event_update.clear()
+            try:
+                await asyncio.wait_for(self._event_update.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                return False
+        for x in self._credit if iface_id is None else (iface_id,):
+            self._sent[x] += count
+        return True
+
+    def close(self) -> None:
+        self._sub.close()
+
+    async def _on_credit(self, msg: SpoofCredit, _meta: pyuavcan.transport.TransferFrom) -> None:
+        credit = {}
+        for e in msg.iface:
+            iface_id, received = int(e.iface_id), int(e.received)
+            credit[iface_id] = int(e.credit)
+            if received < self._received.get(iface_id, 0):
+                _logger.info("Spoof counters of iface %d have been reset (likely reinitialized)", iface_id)
+                self._sent[iface_id] = received
+            # The transfers sent by other producers are accounted for here, too.
+            self._sent[iface_id] = max(self._sent.get(iface_id, 0), received)
+            self._received[iface_id] = received
+        self._credit = credit
+        for x in set(self._received) - set(credit):
+            del self._received[x], self._sent[x]
+        self._event_update.set()
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, {k: self.credit(k) for k in self._credit})
+
+
+_logger = logging.getLogger(__name__)
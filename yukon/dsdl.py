@@ -0,0 +1,329 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+"""
+Runtime compilation of the DSDL namespaces that are not bundled with the package (e.g., vendor-specific ones).
+
+The generated packages are kept in a content-addressed cache under :attr:`yukon.filesystem.AppDirs.compiled_dsdl`:
+each namespace is stored in a directory named after the hash of its definitions and of the definitions
+of the namespaces it depends on, so an entry is never updated in place -- a change in the sources yields a new key
+and the old entry is eventually evicted as the least recently used one.
+"""
+
+from __future__ import annotations
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import typing
+import hashlib
+import logging
+import dataclasses
+import multiprocessing
+import concurrent.futures
+from pathlib import Path
+from .filesystem import AnyPath
+
+
+_logger = logging.getLogger(__name__)
+
+
+DSDL_FILE_SUFFIXES = ".dsdl", ".uavcan"
+
+BUNDLED_SOURCE_ROOTS = [
+    Path(__file__).resolve().parent / "dsdl_src" / "public_regulated_data_types" / "uavcan",
+    Path(__file__).resolve().parent / "dsdl_src" / "public_unregulated_data_types" / "org_uavcan_yukon",
+]
+"""
+These are pre-compiled when the package is built; their sources are only used for looking up the dependencies.
+"""
+
+_INDEX_FILE_NAME = "sources.json"
+_STAGING_PREFIX = ".staging-"
+_TRASH_PREFIX = ".trash-"
+_STAGING_MAX_AGE = 3600.0
+"""
+A staging directory older than this (seconds) is assumed to be left over by a process that died while compiling.
+"""
+
+_REFERENCE_PATTERN = re.compile(rb"\b([A-Za-z_][A-Za-z0-9_]*)\s*\.\s*[A-Za-z_]")
+"""
+Matches the first component of a dotted name. It also matches words in the comments,
+which may only add spurious dependencies, which in turn may only cause unnecessary recompilation.
+"""
+
+
+@dataclasses.dataclass
+class CacheStatistics:
+    n_hits: int = 0
+    n_compiled: int = 0
+    n_files_hashed: int = 0  # Files whose size or modification time did not match the index.
+    n_evicted: int = 0
+
+
+class CompilationCache:
+    """
+    Compiles the DSDL root namespaces into Python packages unless they are found in the cache.
+
+    Each namespace is compiled separately with the other ones used as lookup directories,
+    so all namespaces that are missing from the cache are independent of each other and are compiled concurrently
+    in a process pool (the compiler is pure Python, so threads would not help).
+    An entry is compiled into a staging directory and then renamed into place, which is atomic,
+    so a concurrently running process either finds the complete entry or does not find it at all.
+
+    To avoid hashing the sources on every launch, the modification time and the size of each source file
+    are stored in an index along with its hash; the file is only read again if either of them has changed.
+    """
+
+    def __init__(self, directory: AnyPath, max_entries: int = 64) -> None:
+        """
+        :param directory: Where the entries are stored. Shared by all processes of the same version of the package.
+        :param max_entries: The least recently used entries in excess of this are removed after each lookup.
+            The entries that have just been looked up are never removed.
+        """
+        if max_entries < 1:
+            raise ValueError(f"Invalid cache capacity: {max_entries}")
+        self._directory = Path(directory).resolve()
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._max_entries = max_entries
+        self._stats = CacheStatistics()
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    @property
+    def statistics(self) -> CacheStatistics:
+        return dataclasses.replace(self._stats)
+
+    def get(self, roots: typing.Sequence[AnyPath], lookup_roots: typing.Sequence[AnyPath] = ()) -> typing.List[Path]:
+        """
+        :param roots: The DSDL root namespace directories to compile.
+        :param lookup_roots: The root namespace directories that the former may depend on
+            but that should not be compiled (e.g., because they are bundled with the package).
+            Those whose name matches one of the roots are ignored.
+        :returns: One directory per root, in the same order, to be added to :data:`sys.path`.
+        :raises: :class:`OSError` if the sources cannot be read;
+            the exceptions raised by the DSDL compiler if the definitions are invalid.
+        """
+        roots = [Path(x).resolve() for x in roots]
+        if len(set(x.name for x in roots)) != len(roots):
+            raise ValueError(f"Root namespace names are not unique: {roots}")
+        names = set(x.name for x in roots)
+        lookup_roots = [y for y in (Path(x).resolve() for x in lookup_roots) if y.is_dir() and y.name not in names]
+        all_roots = roots + lookup_roots
+
+        index = self._load_index()
+        sources = {x.name: self._scan(x, index) for x in all_roots}
+        self._store_index(index)
+
+        keys = {x.name: _compute_key(x.name, sources) for x in roots}
+        misses: typing.Dict[str, Path] = {}
+        for r in roots:
+            entry = self._directory / keys[r.name]
+            if (entry / r.name).is_dir():
+                self._stats.n_hits += 1
+                _touch(entry)
+            else:
+                misses[r.name] = r
+        if misses:
+            self._compile(misses, keys, all_roots)
+        self._evict(set(keys.values()))
+        return [self._directory / keys[x.name] for x in roots]
+
+    def _scan(self, root: Path, index: typing.Dict[str, typing.Any]) -> _NamespaceSources:
+        files: typing.Dict[str, str] = {}
+        references: typing.Set[str] = set()
+        for path in sorted(root.rglob("*")):
+            if path.suffix not in DSDL_FILE_SUFFIXES or not path.is_file():
+                continue
+            st = path.stat()
+            record = index.get(str(path))
+            if record is None or record[0] != st.st_mtime_ns or record[1] != st.st_size:
+                data = path.read_bytes()
+                refs = sorted(set(m.decode() for m in _REFERENCE_PATTERN.findall(data)))
+                record = [st.st_mtime_ns, st.st_size, hashlib.sha256(data).hexdigest(), refs]
+                index[str(path)] = record
+                self._stats.n_files_hashed += 1
+            files[path.relative_to(root).as_posix()] = record[2]
+            references.update(record[3])
+        references.discard(root.name)
+        return _NamespaceSources(files=files, references=references)
+
+    def _compile(
+        self, misses: typing.Dict[str, Path], keys: typing.Dict[str, str], all_roots: typing.List[Path]
+    ) -> None:
+        started_at = time.monotonic()
+        jobs = []
+        for name, root in misses.items():
+            staging = self._directory / f"{_STAGING_PREFIX}{keys[name]}-{os.getpid()}"
+            shutil.rmtree(staging, ignore_errors=True)
+            lookups = [x for x in all_roots if x != root]
+            jobs.append((root, lookups, staging, self._directory / keys[name]))
+        _logger.info("Compiling %d DSDL namespace(s): %s", len(jobs), ", ".join(misses))
+        try:
+            if len(jobs) == 1:  # Starting a process pool would take longer than this.
+                _compile_into(*jobs[0][:3])
+            else:
+                # The workers are spawned rather than forked because the caller may have threads running
+                # and import hooks installed that should not leak into the compiler.
+                with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=min(len(jobs), os.cpu_count() or 1),
+                    mp_context=multiprocessing.get_context("spawn"),
+                ) as pool:
+                    for fut in [pool.submit(_compile_into, *j[:3]) for j in jobs]:
+                        fut.result()
+            for _, _, staging, entry in jobs:
+                _publish(staging, entry)
+                self._stats.n_compiled += 1
+        finally:
+            for _, _, staging, _ in jobs:
+                shutil.rmtree(staging, ignore_errors=True)
+        _logger.info("DSDL compilation completed in %.1f s", time.monotonic() - started_at)
+
+    def _evict(self, keep: typing.Set[str]) -> None:
+        now = time.time()
+        entries = []
+        for path in self._directory.iterdir():
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:  # Removed concurrently.
+                continue
+            if path.name.startswith(_STAGING_PREFIX):
+                if now - mtime > _STAGING_MAX_AGE:
+                    _remove(path)
+            elif path.name.startswith(_TRASH_PREFIX):
+                _remove(path)
+            elif path.is_dir() and path.name not in keep:
+                entries.append((mtime, path))
+        entries.sort()
+        for _, path in entries[: max(0, len(entries) + len(keep) - self._max_entries)]:
+            _logger.info("Evicting the least recently used DSDL cache entry %s", path)
+            _remove(path)
+            self._stats.n_evicted += 1
+
+    def _load_index(self) -> typing.Dict[str, typing.Any]:
+        try:
+            out = json.loads((self._directory / _INDEX_FILE_NAME).read_text())
+            if isinstance(out, dict):
+                return out
+        except (OSError, ValueError) as ex:
+            _logger.debug("DSDL source index not loaded: %s", ex)
+        return {}
+
+    def _store_index(self, index: typing.Dict[str, typing.Any]) -> None:
+        # The index is only an optimization, so a concurrent update by another process may be safely lost.
+        tmp = self._directory / f"{_INDEX_FILE_NAME}.{os.getpid()}.tmp"
+        try:
+            tmp.write_text(json.dumps(index))
+            os.replace(tmp, self._directory / _INDEX_FILE_NAME)
+        except OSError as ex:
+            _logger.warning("Could not update the DSDL source index: %s", ex)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({str(self._directory)!r}, max_entries={self._max_entries}, {self._stats})"
+
+
+@dataclasses.dataclass(frozen=True)
+class _NamespaceSources:
+    files: typing.Mapping[str, str]  # Relative path to its hash.
+    references: typing.AbstractSet[str]  # Names that may refer to other root namespaces.
+
+
+def load(roots: typing.Sequence[AnyPath], cache: typing.Optional[CompilationCache] = None) -> typing.List[Path]:
+    """
+    Makes the specified DSDL root namespaces importable, compiling them if necessary.
+    The bundled namespaces are available for lookup, so they need not be listed.
+
+    :returns: The directories that have been added to :data:`sys.path`.
+    """
+    if not roots:
+        return []
+    if cache is None:
+        from .filesystem import APP_DIRS
+
+        cache = CompilationCache(APP_DIRS.compiled_dsdl)
+    out = cache.get(roots, lookup_roots=BUNDLED_SOURCE_ROOTS)
+    for path in out:
+        if str(path) not in sys.path:
+            sys.path.insert(0, str(path))
+    return out
+
+
+def parse_path(text: str) -> typing.List[Path]:
+    """
+    Parses a list of directories separated like in the PATH environment variable.
+
+    >>> [x.name for x in parse_path(os.pathsep.join(["a/b", "", "c"]))]
+    ['b', 'c']
+    """
+    return [Path(x) for x in text.split(os.pathsep) if x.strip()]
+
+
+def _compute_key(name: str, sources: typing.Mapping[str, _NamespaceSources]) -> str:
+    """
+    The key covers the namespace and all namespaces reachable from it via the references,
+    including those that cannot be resolved yet, so that adding a missing dependency later changes the key.
+    """
+    import pyuavcan
+
+    h = hashlib.sha256()
+    h.update(f"pyuavcan {pyuavcan.__version__}\n".encode())
+    pending, seen = [name], set()
+    while pending:
+        ns = pending.pop()
+        if ns in seen:
+            continue
+        seen.add(ns)
+        src = sources.get(ns)
+        if src is not None:
+            pending.extend(src.references)
+    for ns in sorted(seen):
+        src = sources.get(ns)
+        if src is None:
+            continue  # Not a namespace, just a dotted word in a comment or a name that cannot be resolved.
+        h.update(f"namespace {ns} {'root' if ns == name else 'dependency'}\n".encode())
+        for rel, digest in sorted(src.files.items()):
+            h.update(f"{rel} {digest}\n".encode())
+    return h.hexdigest()[:32]
+
+
+def _compile_into(root: Path, lookups: typing.List[Path], output: Path) -> None:
+    """
+    Executed in a worker process.
+    """
+    import pyuavcan.dsdl
+
+    pyuavcan.dsdl.compile(root, lookups, output, allow_unregulated_fixed_port_id=True)
+
+
+def _publish(staging: Path, entry: Path) -> None:
+    try:
+        os.rename(staging, entry)
+    except OSError:
+        if not entry.is_dir():
+            raise
+        # Another process has published the same entry first. Being content-addressed, it is identical to ours.
+        _logger.debug("DSDL cache entry %s has been published concurrently", entry)
+
+
+def _touch(entry: Path) -> None:
+    try:
+        os.utime(entry)
+    except OSError as ex:  # Evicted concurrently; the caller is going to get an import error.
+        _logger.warning("Could not mark DSDL cache entry %s as used: %s", entry, ex)
+
+
+def _remove(path: Path) -> None:
+    """
+    The entry is renamed first so that it disappears atomically and a partially removed one is never looked up.
+    """
+    trash = path.with_name(f"{_TRASH_PREFIX}{path.name}-{os.getpid()}")
+    try:
+        os.rename(path, trash)
+    except OSError:
+        return
+    shutil.rmtree(trash, ignore_errors=True)
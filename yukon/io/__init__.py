@@ -2,10 +2,38 @@
 # This software is distributed under the terms of the MIT License.
 # Author: Pavel Kirienko <pavel@uavcan.org>
 
-from . import iface
+import typing
+import importlib
 
-from ._session import session_to_dcs as session_to_dcs
-from ._session import session_from_dcs as session_from_dcs
+if typing.TYPE_CHECKING:
+    from . import iface as iface
 
-from ._time import timestamp_to_dcs as timestamp_to_dcs
-from ._time import timestamp_from_dcs as timestamp_from_dcs
+    from ._session import session_to_dcs as session_to_dcs
+    from ._session import session_from_dcs as session_from_dcs
+
+    from ._time import timestamp_to_dcs as timestamp_to_dcs
+    from ._time import timestamp_from_dcs as timestamp_from_dcs
+
+
+_LAZY: typing.Dict[str, typing.Tuple[str, typing.Optional[str]]] = {
+    "iface": (".iface", None),
+    "session_to_dcs": ("._session", "session_to_dcs"),
+    "session_from_dcs": ("._session", "session_from_dcs"),
+    "timestamp_to_dcs": ("._time", "timestamp_to_dcs"),
+    "timestamp_from_dcs": ("._time", "timestamp_from_dcs"),
+}
+
+
+def __getattr__(name: str) -> typing.Any:
+    """
+    The contents are imported upon first access rather than with the package, so that the worker process
+    can bring its node online before importing the DSDL namespaces that are not needed for that (see ``__main__``).
+    """
+    try:
+        module_name, attribute = _LAZY[name]
+    except LookupError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    module = importlib.import_module(module_name, __name__)
+    out = getattr(module, attribute) if attribute is not None else module
+    globals()[name] = out
+    return out
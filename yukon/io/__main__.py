@@ -2,22 +2,91 @@
 # This software is distributed under the terms of the MIT License.
 # Author: Pavel Kirienko <pavel@uavcan.org>
 
+"""
+The worker is imported only after the node has published its first heartbeat,
+because the worker pulls in most of the package and the DSDL namespaces, which takes a while.
+
+If the register ``yukon.io.supervisor.enable`` is set, the process becomes the supervisor that serves every iface
+in a dedicated child process (see :mod:`yukon.io._supervisor`); the children are instances of this entry point
+invoked with ``--child``.
+
+The DSDL root namespaces listed in the environment variable ``YUKON_DSDL_PATH`` (separated like in ``PATH``)
+are compiled at startup unless they are found in the cache; see :mod:`yukon.dsdl`.
+"""
+
+import os
 import sys
+import time
 import asyncio
 import logging
-from ._worker import IOWorker
+import typing
+import argparse
+import yukon
+import yukon.dcs
+import yukon.dsdl
+from ._startup import StartupTiming
 
 
-if __name__ == "__main__":
-    wrk = IOWorker()
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m yukon.io", description="Yukon network IO worker.")
+    parser.add_argument(
+        "--child",
+        type=int,
+        metavar="IFACE_ID",
+        help="Run as a child of the supervisor serving the specified iface. Not intended for manual use.",
+    )
+    args = parser.parse_args()
+    yukon.configure_logging()
+    loop = asyncio.get_event_loop()
+    yukon.dsdl.load(yukon.dsdl.parse_path(os.getenv("YUKON_DSDL_PATH", "")))  # Counted as part of the imports.
+    timing = StartupTiming(imports=time.monotonic() - yukon.IMPORTED_AT)
+
+    started_at = time.monotonic()
+    node = yukon.dcs.Node("io" if args.child is None else f"io.child{args.child}")
+    timing.node = time.monotonic() - started_at
+
+    started_at = time.monotonic()
+    heartbeat = asyncio.Event()
+    node.add_pre_heartbeat_handler(heartbeat.set)
+    loop.run_until_complete(heartbeat.wait())
+    timing.first_heartbeat = time.monotonic() - started_at
+
+    started_at = time.monotonic()
+    try:
+        wrk = _construct(node, timing, args.child)
+    except Exception:
+        node.close()
+        raise
+    timing.worker = time.monotonic() - started_at
+    logging.info("%s started in %s", type(wrk).__name__, timing)
+
     try:
-        logging.info("IO worker started")
-        result = asyncio.get_event_loop().run_until_complete(wrk.run())
+        return loop.run_until_complete(wrk.run())
     except KeyboardInterrupt:
-        result = 0
+        return 0
     except Exception as ex:
         logging.critical("Process failed: %s", ex, exc_info=True)
-        result = -1
+        return -1
     finally:
         wrk.close()
-    sys.exit(result)
+
+
+def _construct(node: yukon.dcs.Node, timing: StartupTiming, child: typing.Optional[int]) -> typing.Any:
+    from pyuavcan.application import register
+
+    if child is not None:
+        from ._supervisor import ChildChannel
+        from ._worker import IOWorker
+
+        return IOWorker(node, timing, ChildChannel(child))
+    if node.registry.setdefault("yukon.io.supervisor.enable", register.Bit([False])):
+        from ._supervisor import IOSupervisor
+
+        return IOSupervisor(node, timing)
+    from ._worker import IOWorker
+
+    return IOWorker(node, timing)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,30 +2,284 @@
 # This software is distributed under the terms of the MIT License.
 # Author: Pavel Kirienko <pavel@uavcan.org>
 
+from __future__ import annotations
+import time
+import typing
 import asyncio
 import logging
+import collections
+import dataclasses
 from pyuavcan.presentation import Publisher
-from org_uavcan_yukon.io.frame import Capture_0_1 as DCSCapture
+from org_uavcan_yukon.io.frame import Capture_0_1 as DCSCapture, CaptureBatch_0_1 as DCSCaptureBatch
 from . import timestamp_to_dcs
 from .iface import IfaceCapture, Iface
+from ._latency import LatencyHistogram, LatencySummary
+from ._capture_batch import make_capture_batches
+from ._dedup import DedupForwarder
 
 
 _logger = logging.getLogger(__name__)
 
 
-def setup_capture_forwarding(dcs_pub_capture: Publisher[DCSCapture], iface_id: int, iface: Iface) -> None:
-    sequence_number = 0
+CaptureObserver = typing.Callable[[int, int, int, IfaceCapture], None]
+"""
+Accepts (iface_id, shard, sequence_number, capture).
+The sequence number is the one the frame has been published with, so it is counted per shard.
+"""
 
-    def handle_capture(cap: IfaceCapture) -> None:
-        nonlocal sequence_number
-        msg = DCSCapture(
-            timestamp=timestamp_to_dcs(cap.timestamp),
-            iface_id=iface_id,
-            sequence_number=sequence_number,
-            frame=cap.frame,
-        )
-        sequence_number += 1
-        asyncio.get_event_loop().call_soon_threadsafe(dcs_pub_capture.publish_soon, msg)
 
-    iface.begin_capture(handle_capture)
+@dataclasses.dataclass(frozen=True)
+class CaptureSettings:
+    batch_size_max: int = 256
+    """
+    The publisher will not handle more than this many frames at once; the remaining frames are left for the next batch.
+    Once the buffer contains this many frames, the linger interval is cut short.
+    """
+
+    linger_max: float = 0.01
+    """
+    How long to wait for more frames to arrive after the first frame of a new batch is captured, in seconds.
+    Larger values reduce the number of event loop wakeups at the expense of latency.
+    """
+
+    buffer_capacity: int = 65536
+    """
+    Frames captured while the buffer is full are dropped, which is visible as a sequence number gap downstream.
+    """
+
+    shard_count: int = 1
+    """
+    The captures are distributed over this many subjects by the source node-ID so that the downstream processing
+    can be spread over several processes. Each shard has its own sequence numbering per iface so that the losses
+    remain detectable by the consumers of the shard.
+    The frames whose source node-ID is unknown (e.g., anonymous or serial) go to the shard ``iface_id % shard_count``,
+    so that the serial byte stream of an iface is never split between different shards.
+    """
+
+    shard_map: typing.Mapping[int, int] = dataclasses.field(default_factory=dict)
+    """
+    Explicit node-ID to shard index assignment. The node-IDs that are not listed are assigned by hashing.
+    """
+
+    columnar: bool = False
+    """
+    Publish the frames in the columnar :class:`DCSCaptureBatch` format instead of one :class:`DCSCapture` per frame,
+    which is much cheaper at high frame rates. The publishers shall be of the matching type.
+    Each batch published from the buffer results in at most one message per shard unless it exceeds the capacity
+    of the message.
+    """
+
+    measure_latency: bool = True
+    """
+    Maintain the histograms of the handoff latency (from the capture timestamp until the frame is taken
+    from the buffer by the publisher, lingering included) and of the publication time per frame.
+    The capture thread is not affected because the measurement is done in the event loop.
+    """
+
+
+@dataclasses.dataclass
+class CaptureStatistics:
+    n_frames: int = 0  # Forwarded frames.
+    n_dropped: int = 0  # Dropped due to buffer overflow.
+    n_batches: int = 0
+    batch_size_peak: int = 0
+    n_messages: int = 0  # Equals the number of frames unless the format is columnar.
+    latency_handoff: typing.Optional[LatencySummary] = None  # None if the latency is not measured.
+    latency_publish: typing.Optional[LatencySummary] = None
+
+
+class CaptureForwarder:
+    """
+    Captures are reported by the transport from its own thread. Handing over every frame to the event loop separately
+    is expensive because each handover wakes up the loop, so instead the frames are accumulated in a buffer
+    that is drained by the publisher task in batches.
+    The buffer is a deque, whose appends and pops are atomic, so no locking is required.
+    """
+
+    def __init__(
+        self,
+        dcs_pub_capture: typing.Sequence[Publisher[typing.Any]],
+        iface_id: int,
+        settings: CaptureSettings,
+        observer: typing.Optional[CaptureObserver] = None,
+        dedup: typing.Optional[DedupForwarder] = None,
+    ) -> None:
+        """
+        :param dcs_pub_capture: One publisher per shard, of :class:`DCSCaptureBatch` if the format is columnar,
+            otherwise of :class:`DCSCapture`. Not used with the deduplication.
+        :param observer: If provided, invoked from the event loop with every captured frame after it is published.
+        :param dedup: If provided, the frames are handed over to it instead of being published.
+            The caller is responsible for adding the iface to it.
+        """
+        if dedup is None and len(dcs_pub_capture) != settings.shard_count:
+            raise ValueError(f"Expected {settings.shard_count} publishers, got {len(dcs_pub_capture)}")
+        self._pubs = list(dcs_pub_capture)
+        self._iface_id = int(iface_id)
+        self._settings = settings
+        self._observer = observer
+        self._dedup = dedup
+        self._loop = asyncio.get_event_loop()
+        self._stats = CaptureStatistics()
+        self._buffer: typing.Deque[typing.Tuple[int, int, int, IfaceCapture]] = collections.deque()
+        self._sequence_number = 0
+        self._shard_of_node: typing.Optional[typing.List[int]] = None
+        if settings.shard_count > 1:
+            self._shard_of_node = compute_shard_table(settings.shard_count, settings.shard_map)
+        self._shard_default = self._iface_id % settings.shard_count
+        self._shard_sequence_numbers = [0] * settings.shard_count
+        self._latency_handoff = LatencyHistogram() if settings.measure_latency else None
+        self._latency_publish = LatencyHistogram() if settings.measure_latency else None
+        self._armed = False
+        self._event_arrived = asyncio.Event()
+        self._event_full = asyncio.Event()
+        self._task = self._loop.create_task(self._task_fn())
+
+    @property
+    def statistics(self) -> CaptureStatistics:
+        from copy import copy
+
+        out = copy(self._stats)
+        if self._latency_handoff is not None and self._latency_publish is not None:
+            out.latency_handoff = self._latency_handoff.summarize()
+            out.latency_publish = self._latency_publish.summarize()
+        return out
+
+    def push(self, cap: IfaceCapture) -> None:
+        """
+        This is the capture handler. It is invoked from the transport thread, so it must be as cheap as possible.
+        The frames rejected by the capture filter are discarded by the iface before reaching this point,
+        so they consume no sequence numbers.
+        """
+        seq = self._sequence_number
+        self._sequence_number = seq + 1  # Overflow drops consume sequence numbers to make the loss detectable.
+        shard_of_node = self._shard_of_node
+        if shard_of_node is None:
+            shard, shard_seq = 0, seq
+        else:
+            src = cap.source_node_id
+            shard = shard_of_node[src] if src is not None else self._shard_default
+            shard_seq = self._shard_sequence_numbers[shard]
+            self._shard_sequence_numbers[shard] = shard_seq + 1
+        buf = self._buffer
+        depth = len(buf)
+        if depth >= self._settings.buffer_capacity:
+            self._stats.n_dropped += 1
+            return
+        buf.append((seq, shard, shard_seq, cap))
+        if not self._armed:
+            self._armed = True
+            self._loop.call_soon_threadsafe(self._event_arrived.set)
+        elif depth + 1 == self._settings.batch_size_max:
+            self._loop.call_soon_threadsafe(self._event_full.set)
+
+    def close(self) -> None:
+        self._task.cancel()
+
+    async def _task_fn(self) -> None:
+        try:
+            while True:
+                await self._event_arrived.wait()
+                self._event_arrived.clear()
+                if len(self._buffer) < self._settings.batch_size_max and self._settings.linger_max > 0:
+                    try:
+                        await asyncio.wait_for(self._event_full.wait(), self._settings.linger_max)
+                    except asyncio.TimeoutError:
+                        pass
+                self._event_full.clear()
+                self._armed = False  # Frames that arrive after this point will arm the next wakeup.
+                while self._buffer:
+                    await self._publish_batch()
+        except asyncio.CancelledError:
+            pass
+        except Exception as ex:
+            _logger.critical("Capture forwarder for iface_id=%r has failed: %s", self._iface_id, ex, exc_info=True)
+
+    async def _publish_batch(self) -> None:
+        pop = self._buffer.popleft
+        items = [pop() for _ in range(min(len(self._buffer), self._settings.batch_size_max))]
+        if self._latency_handoff is not None:
+            now, add = time.monotonic_ns(), self._latency_handoff.add
+            for item in items:
+                add(now - item[3].timestamp.monotonic_ns)
+        batch: typing.List[typing.Tuple[int, typing.Any, int]] = []  # Shard, message, number of frames.
+        if self._dedup is not None:
+            await self._dedup.feed(self._iface_id, [x[3] for x in items])
+        elif self._settings.columnar:
+            per_shard: typing.Dict[int, typing.List[typing.Tuple[int, IfaceCapture]]] = {}
+            for _, shard, shard_seq, cap in items:
+                per_shard.setdefault(shard, []).append((shard_seq, cap))
+            for shard, group in per_shard.items():
+                batch.extend((shard, msg, len(msg.kind)) for msg in make_capture_batches(self._iface_id, group))
+        else:
+            for _, shard, shard_seq, cap in items:
+                msg = DCSCapture(
+                    timestamp=timestamp_to_dcs(cap.timestamp),
+                    iface_id=self._iface_id,
+                    sequence_number=shard_seq,
+                    frame=cap.frame,
+                )
+                batch.append((shard, msg, 1))
+        self._stats.n_batches += 1
+        self._stats.n_frames += len(items)
+        self._stats.n_messages += len(batch)
+        self._stats.batch_size_peak = max(self._stats.batch_size_peak, len(items))
+        latency = self._latency_publish
+        for shard, msg, n_frames in batch:
+            pub = self._pubs[shard]
+            started_at = time.monotonic_ns() if latency is not None else 0
+            if not await pub.publish(msg):
+                _logger.info("%s send timeout", pub)
+            if latency is not None:
+                per_frame = (time.monotonic_ns() - started_at) // n_frames
+                for _ in range(n_frames):
+                    latency.add(per_frame)
+        if self._observer is not None:
+            for _, shard, shard_seq, cap in items:
+                self._observer(self._iface_id, shard, shard_seq, cap)
+
+    def __repr__(self) -> str:
+        import pyuavcan.util
+
+        return pyuavcan.util.repr_attributes(self, iface_id=self._iface_id, settings=self._settings)
+
+
+def compute_shard_table(shard_count: int, shard_map: typing.Mapping[int, int]) -> typing.List[int]:
+    """
+    Returns the shard index for every possible node-ID.
+    The hash is multiplicative because node-IDs are often allocated in regular patterns (e.g., all even).
+
+    >>> table = compute_shard_table(4, {10: 3})
+    >>> len(table), table[10], max(table)
+    (65536, 3, 3)
+    >>> sorted(table[:128].count(i) for i in range(4))  # Evenly distributed.
+    [32, 32, 32, 32]
+    """
+    if shard_count < 1 or not all(0 <= x < shard_count for x in shard_map.values()):
+        raise ValueError(f"Invalid shard configuration: {shard_count} shards, map {shard_map}")
+    table = [((node_id * _HASH_MULTIPLIER) & 0xFFFF_FFFF) * shard_count >> 32 for node_id in range(_NODE_ID_COUNT)]
+    for node_id, shard in shard_map.items():
+        table[node_id] = shard
+    return table
+
+
+_NODE_ID_COUNT = 2 ** 16  # Enough for all transports.
+
+_HASH_MULTIPLIER = 2654435769  # Knuth's multiplicative hash, 2^32 divided by the golden ratio.
+
+
+def setup_capture_forwarding(
+    dcs_pub_capture: typing.Sequence[Publisher[typing.Any]],
+    iface_id: int,
+    iface: Iface,
+    settings: CaptureSettings,
+    observer: typing.Optional[CaptureObserver] = None,
+    dedup: typing.Optional[DedupForwarder] = None,
+) -> CaptureForwarder:
+    """
+    Must be invoked from the event loop thread.
+    The returned forwarder shall be closed when the iface is removed.
+    """
+    fwd = CaptureForwarder(dcs_pub_capture, iface_id, settings, observer, dedup)
+    iface.begin_capture(fwd.push)
     _logger.info("Set up capture on iface_id=%r: %r", iface_id, iface)
+    return fwd
@@ -0,0 +1,250 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import typing
+import dataclasses
+import numpy
+import pyuavcan
+from org_uavcan_yukon.io.frame import CaptureBatch_0_1 as DCSCaptureBatch
+import uavcan.time
+import uavcan.metatransport.can
+import uavcan.metatransport.serial
+import uavcan.metatransport.ethernet
+from .iface import IfaceCapture, DCSFrame
+
+
+_INT32_MIN, _INT32_MAX = -(2 ** 31), 2 ** 31 - 1
+_UINT32_MAX = 2 ** 32 - 1
+
+_ETHERNET_HEADER_SIZE = 14
+
+
+def make_capture_batches(
+    iface_id: int, items: typing.Sequence[typing.Tuple[int, IfaceCapture]]
+) -> typing.List[DCSCaptureBatch]:
+    """
+    Packs the captured frames with their sequence numbers into as few batches as possible, preserving the order.
+    A new batch is started when the current one is full or when the deltas of the next frame would not fit.
+
+    >>> from pyuavcan.transport import Timestamp
+    >>> frames = [DCSFrame(serial=uavcan.metatransport.serial.Fragment_0_2(b"x" * 1000)) for _ in range(100)]
+    >>> items = [(i + 10, IfaceCapture(Timestamp(system_ns=i * 1000, monotonic_ns=0), f)) for i, f in enumerate(frames)]
+    >>> batches = make_capture_batches(3, items)
+    >>> [len(x.kind) for x in batches]  # Split by the capacity of the payload.
+    [65, 35]
+    >>> batches[1].sequence_number_base, batches[1].timestamp_base.microsecond, batches[1].timestamp_delta[:3].tolist()
+    (75, 65, [0, 1, 2])
+    >>> len(batches[1].sequence_number_delta)  # Consecutive.
+    0
+    """
+    out: typing.List[DCSCaptureBatch] = []
+    max_frames, capacity = DCSCaptureBatch.MAX_FRAMES, DCSCaptureBatch.CAPACITY_BYTES
+    i = 0
+    while i < len(items):
+        first_seq, first_cap = items[i]
+        ts_base = first_cap.timestamp.system_ns // 1000
+        ts_delta: typing.List[int] = []
+        seq_delta: typing.List[int] = []
+        kinds: typing.List[int] = []
+        lengths: typing.List[int] = []
+        chunks: typing.List[bytes] = []
+        size = 0
+        while i < len(items) and len(kinds) < max_frames:
+            seq, cap = items[i]
+            kind, data = flatten_frame(cap.frame)
+            dt, ds = cap.timestamp.system_ns // 1000 - ts_base, seq - first_seq
+            if kinds and (size + len(data) > capacity or not _INT32_MIN <= dt <= _INT32_MAX or ds > _UINT32_MAX):
+                break
+            ts_delta.append(dt)
+            seq_delta.append(ds)
+            kinds.append(kind)
+            lengths.append(len(data))
+            chunks.append(data)
+            size += len(data)
+            i += 1
+        consecutive = seq_delta[-1] == len(seq_delta) - 1  # The sequence numbers are strictly increasing.
+        out.append(
+            DCSCaptureBatch(
+                timestamp_base=uavcan.time.SynchronizedTimestamp_1_0(microsecond=ts_base),
+                iface_id=iface_id,
+                sequence_number_base=first_seq,
+                timestamp_delta=numpy.array(ts_delta, numpy.int32),
+                sequence_number_delta=numpy.array([] if consecutive else seq_delta, numpy.uint32),
+                kind=numpy.array(kinds, numpy.uint8),
+                length=numpy.array(lengths, numpy.uint16),
+                payload=numpy.frombuffer(b"".join(chunks), numpy.uint8),
+            )
+        )
+    return out
+
+
+@dataclasses.dataclass(frozen=True)
+class CaptureColumns:
+    """
+    The contents of a :class:`DCSCaptureBatch` as NumPy arrays with one element per frame.
+    The kinds, the lengths, and the payload are views of the arrays of the message
+    (which in turn are views of the received transfer payload), so they are not copied.
+    The absolute timestamps, sequence numbers, and payload offsets are computed with one vectorized operation each.
+    """
+
+    iface_id: int
+    timestamp: numpy.ndarray  # uint64, microseconds.
+    sequence_number: numpy.ndarray  # uint64.
+    kind: numpy.ndarray  # uint8, see the KIND_* constants of DCSCaptureBatch.
+    length: numpy.ndarray  # uint16.
+    offset: numpy.ndarray  # int64, where the payload of each frame begins.
+    payload: numpy.ndarray  # uint8.
+
+    def __len__(self) -> int:
+        return len(self.kind)
+
+    def frame_payload(self, index: int) -> numpy.ndarray:
+        """
+        A view of the payload of the specified frame; see :class:`DCSCaptureBatch` for its layout per kind.
+        """
+        start = int(self.offset[index])
+        return self.payload[start : start + int(self.length[index])]
+
+    def frame(self, index: int) -> DCSFrame:
+        """
+        Converts the specified frame back into the representation used by :class:`DCSCapture`.
+        """
+        return unflatten_frame(int(self.kind[index]), self.frame_payload(index).tobytes())
+
+
+def decode_capture_batch(msg: DCSCaptureBatch) -> CaptureColumns:
+    """
+    :raises: :class:`ValueError` if the columns are inconsistent.
+
+    >>> from pyuavcan.transport import Timestamp
+    >>> frames = [
+    ...     DCSFrame(serial=uavcan.metatransport.serial.Fragment_0_2(b"abc")),
+    ...     DCSFrame(can=uavcan.metatransport.can.Frame_0_2(error=uavcan.metatransport.can.Error_0_1())),
+    ... ]
+    >>> items = [
+    ...     (5, IfaceCapture(Timestamp(system_ns=1_000_000, monotonic_ns=0), frames[0])),
+    ...     (8, IfaceCapture(Timestamp(system_ns=3_000_000, monotonic_ns=0), frames[1])),
+    ... ]
+    >>> batch, = make_capture_batches(3, items)
+    >>> batch = pyuavcan.dsdl.deserialize(DCSCaptureBatch, list(pyuavcan.dsdl.serialize(batch)))
+    >>> cols = decode_capture_batch(batch)
+    >>> len(cols), cols.timestamp.tolist(), cols.sequence_number.tolist(), cols.offset.tolist()
+    (2, [1000, 3000], [5, 8], [0, 3])
+    >>> cols.frame_payload(0).tobytes(), cols.frame(1).can.error is not None
+    (b'abc', True)
+    """
+    count = len(msg.kind)
+    seq_delta = msg.sequence_number_delta
+    if (
+        len(msg.timestamp_delta) != count
+        or len(msg.length) != count
+        or len(seq_delta) not in (0, count)
+        or int(msg.length.sum(dtype=numpy.int64)) != len(msg.payload)
+    ):
+        raise ValueError(f"Malformed capture batch: {count} frames, {len(msg.payload)} bytes of payload")
+    offset = numpy.zeros(count, numpy.int64)
+    numpy.cumsum(msg.length[:-1], out=offset[1:])
+    if len(seq_delta) == 0:
+        seq_delta = numpy.arange(count, dtype=numpy.uint64)
+    return CaptureColumns(
+        iface_id=int(msg.iface_id),
+        timestamp=(msg.timestamp_delta.astype(numpy.int64) + int(msg.timestamp_base.microsecond)).astype(numpy.uint64),
+        sequence_number=numpy.uint64(msg.sequence_number_base) + seq_delta.astype(numpy.uint64),
+        kind=msg.kind,
+        length=msg.length,
+        offset=offset,
+        payload=msg.payload,
+    )
+
+
+def flatten_frame(fr: DCSFrame) -> typing.Tuple[int, bytes]:
+    """
+    Returns the kind of the frame and its payload as defined in :class:`DCSCaptureBatch`.
+    """
+    can = fr.can
+    if can is not None:
+        for data, base_kind in (
+            (can.data_classic, DCSCaptureBatch.KIND_CAN_DATA_CLASSIC_BASE),
+            (can.data_fd, DCSCaptureBatch.KIND_CAN_DATA_FD_BASE),
+            (can.remote_transmission_request, DCSCaptureBatch.KIND_CAN_RTR_BASE),
+        ):
+            if data is not None:
+                aid = data.arbitration_id
+                if aid.base is not None:
+                    kind, identifier = base_kind, int(aid.base.value)
+                else:
+                    kind, identifier = base_kind + 1, int(aid.extended.value)
+                body = data.data.tobytes() if base_kind != DCSCaptureBatch.KIND_CAN_RTR_BASE else b""
+                return kind, identifier.to_bytes(4, "little") + body
+        return DCSCaptureBatch.KIND_CAN_ERROR, b""
+    if fr.serial is not None:
+        return DCSCaptureBatch.KIND_SERIAL, fr.serial.data.tobytes()
+    if fr.udp is not None:
+        eth = fr.udp
+        return (
+            DCSCaptureBatch.KIND_ETHERNET,
+            b"".join(
+                (
+                    eth.destination.tobytes(),
+                    eth.source.tobytes(),
+                    int(eth.ethertype.value).to_bytes(2, "big"),
+                    eth.payload.tobytes(),
+                )
+            ),
+        )
+    raise ValueError(f"Unsupported frame: {fr}")
+
+
+def unflatten_frame(kind: int, data: bytes) -> DCSFrame:
+    """
+    The inverse of :func:`flatten_frame`.
+
+    >>> kind, data = flatten_frame(DCSFrame(can=uavcan.metatransport.can.Frame_0_2(
+    ...     data_fd=uavcan.metatransport.can.DataFD_0_1(
+    ...         uavcan.metatransport.can.ArbitrationID_0_1(
+    ...             extended=uavcan.metatransport.can.ExtendedArbitrationID_0_1(0x1234567)
+    ...         ),
+    ...         b"hello",
+    ...     )
+    ... )))
+    >>> kind == DCSCaptureBatch.KIND_CAN_DATA_FD_EXTENDED, data.hex()
+    (True, '6745230168656c6c6f')
+    >>> fd = unflatten_frame(kind, data).can.data_fd
+    >>> hex(fd.arbitration_id.extended.value), fd.data.tobytes()
+    ('0x1234567', b'hello')
+    """
+    mc = uavcan.metatransport.can
+    if kind == DCSCaptureBatch.KIND_CAN_ERROR:
+        return DCSFrame(can=mc.Frame_0_2(error=mc.Error_0_1()))
+    if DCSCaptureBatch.KIND_CAN_DATA_CLASSIC_BASE <= kind <= DCSCaptureBatch.KIND_CAN_RTR_EXTENDED:
+        if len(data) < 4:
+            raise ValueError(f"CAN frame payload is too short: {len(data)} bytes")
+        identifier = int.from_bytes(data[:4], "little")
+        extended = (kind - DCSCaptureBatch.KIND_CAN_DATA_CLASSIC_BASE) % 2 == 1
+        aid = (
+            mc.ArbitrationID_0_1(extended=mc.ExtendedArbitrationID_0_1(identifier))
+            if extended
+            else mc.ArbitrationID_0_1(base=mc.BaseArbitrationID_0_1(identifier))
+        )
+        if kind <= DCSCaptureBatch.KIND_CAN_DATA_CLASSIC_EXTENDED:
+            return DCSFrame(can=mc.Frame_0_2(data_classic=mc.DataClassic_0_1(aid, data[4:])))
+        if kind <= DCSCaptureBatch.KIND_CAN_DATA_FD_EXTENDED:
+            return DCSFrame(can=mc.Frame_0_2(data_fd=mc.DataFD_0_1(aid, data[4:])))
+        return DCSFrame(can=mc.Frame_0_2(remote_transmission_request=mc.RTR_0_1(aid)))
+    if kind == DCSCaptureBatch.KIND_SERIAL:
+        return DCSFrame(serial=uavcan.metatransport.serial.Fragment_0_2(data))
+    if kind == DCSCaptureBatch.KIND_ETHERNET:
+        if len(data) < _ETHERNET_HEADER_SIZE:
+            raise ValueError(f"Ethernet frame is too short: {len(data)} bytes")
+        eth = uavcan.metatransport.ethernet
+        return DCSFrame(
+            udp=eth.Frame_0_1(
+                destination=data[0:6],
+                source=data[6:12],
+                ethertype=eth.EtherType_0_1(int.from_bytes(data[12:14], "big")),
+                payload=data[_ETHERNET_HEADER_SIZE:],
+            )
+        )
+    raise ValueError(f"Unknown frame kind: {kind}")
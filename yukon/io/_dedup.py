@@ -0,0 +1,298 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import time
+import typing
+import asyncio
+import logging
+import collections
+import dataclasses
+import pyuavcan
+from pyuavcan.presentation import Publisher
+from org_uavcan_yukon.io.frame import DedupCapture_0_1 as DCSDedupCapture
+from . import timestamp_to_dcs
+from .iface import IfaceCapture
+from ._latency import LatencyHistogram, LatencySummary
+from ._capture_batch import flatten_frame
+
+
+_logger = logging.getLogger(__name__)
+
+
+_UINT32_MAX = 2 ** 32 - 1
+
+
+@dataclasses.dataclass(frozen=True)
+class DedupSettings:
+    window: float = 0.05
+    """
+    How long to wait for the copies of a frame from the other ifaces of the group, in seconds, counting from
+    the moment the first copy is handed over by its capture forwarder. It should exceed the linger interval
+    of the capture forwarders plus the arrival skew between the ifaces; otherwise, the copies are published
+    separately. A frame is published before the window has expired as soon as every iface has delivered it.
+    The frames are published in the order of their first arrival, so a frame missed by one of the ifaces
+    holds back the following frames until its window expires.
+    """
+
+    capacity: int = 65536
+    """
+    The maximum number of frames awaiting their copies. When exceeded, the oldest frames are published early.
+    """
+
+
+@dataclasses.dataclass
+class DedupStatistics:
+    n_input: int = 0  # Frames fed by all ifaces.
+    n_output: int = 0  # Unique frames published.
+    n_evicted: int = 0  # Published before the window has expired because the capacity was exceeded.
+
+
+@dataclasses.dataclass
+class DedupIfaceStatistics:
+    n_first: int = 0  # Frames delivered by this iface earlier than by the others.
+    n_missed: int = 0  # Frames delivered by the other ifaces of the group but not by this one.
+    skew: typing.Optional[LatencySummary] = None  # How much later than the first iface, if not first.
+
+
+class _Entry:
+    __slots__ = ("key", "group", "deadline", "arrivals", "complete")
+
+    def __init__(self, key: typing.Tuple[int, bytes], group: typing.FrozenSet[int], deadline: int) -> None:
+        self.key = key
+        self.group = group  # The group at the moment of the first arrival.
+        self.deadline = deadline
+        self.arrivals: typing.List[typing.Tuple[int, IfaceCapture]] = []
+        self.complete = False
+
+
+class Deduplicator:
+    """
+    Merges the captures from a group of redundant ifaces into one stream of unique frames.
+    The frames awaiting their copies from the other ifaces are kept in a queue in the order of arrival,
+    and the ones that can still be matched are indexed by their content (the kind and the payload as defined
+    in :class:`DCSCaptureBatch`). Both are bounded by the capacity.
+    An iface cannot deliver the same frame twice, so identical content from the same iface within the window
+    is considered to be a new frame (e.g., a repeated serial fragment), which is published separately.
+
+    This class does not perform any IO and is not thread-safe; see :class:`DedupForwarder`.
+
+    >>> from pyuavcan.transport import Timestamp
+    >>> from .iface import DCSFrame
+    >>> import uavcan.metatransport.serial
+    >>> def cap(data: bytes, us: int) -> IfaceCapture:
+    ...     frame = DCSFrame(serial=uavcan.metatransport.serial.Fragment_0_2(data))
+    ...     return IfaceCapture(Timestamp(system_ns=us * 1000, monotonic_ns=us * 1000), frame)
+    >>> dd = Deduplicator(DedupSettings(window=1.0))
+    >>> dd.add_iface(0)
+    >>> dd.add_iface(1)
+    >>> dd.push(0, cap(b"a", 100), 0)
+    >>> dd.push(0, cap(b"b", 200), 0)
+    >>> dd.push(1, cap(b"a", 130), 0)  # Complete.
+    >>> [(m.frame.serial.data.tobytes(), m.iface_id.tolist(), m.arrival_skew.tolist()) for m in dd.pop(0)]
+    [(b'a', [0, 1], [0, 30])]
+    >>> dd.deadline
+    1000000000
+    >>> [(m.sequence_number, m.iface_id.tolist()) for m in dd.pop(dd.deadline)]  # The window has expired.
+    [(1, [0])]
+    >>> dd.statistics, dd.iface_statistics[1].n_missed
+    (DedupStatistics(n_input=3, n_output=2, n_evicted=0), 1)
+    """
+
+    def __init__(self, settings: DedupSettings) -> None:
+        self._settings = settings
+        self._window_ns = round(settings.window * 1e9)
+        self._group: typing.FrozenSet[int] = frozenset()
+        self._pending: typing.Deque[_Entry] = collections.deque()
+        self._index: typing.Dict[typing.Tuple[int, bytes], _Entry] = {}
+        self._sequence_number = 0
+        self._stats = DedupStatistics()
+        self._iface_stats: typing.Dict[int, typing.Tuple[DedupIfaceStatistics, LatencyHistogram]] = {}
+
+    @property
+    def settings(self) -> DedupSettings:
+        return self._settings
+
+    @property
+    def statistics(self) -> DedupStatistics:
+        return dataclasses.replace(self._stats)
+
+    @property
+    def iface_statistics(self) -> typing.Dict[int, DedupIfaceStatistics]:
+        return {k: dataclasses.replace(st, skew=hist.summarize()) for k, (st, hist) in self._iface_stats.items()}
+
+    @property
+    def deadline(self) -> typing.Optional[int]:
+        """
+        When the oldest pending frame will be published unless all of its copies arrive earlier;
+        monotonic nanoseconds. None if there are no pending frames.
+        """
+        return self._pending[0].deadline if self._pending else None
+
+    def add_iface(self, iface_id: int) -> None:
+        """
+        The frames that are already pending are not expected from the new iface.
+        """
+        self._group = self._group | {iface_id}
+        self._iface_stats[iface_id] = DedupIfaceStatistics(), LatencyHistogram()
+
+    def remove_iface(self, iface_id: int) -> None:
+        """
+        :raises: :class:`LookupError` if there is no such iface.
+        """
+        del self._iface_stats[iface_id]
+        self._group = self._group - {iface_id}
+        for entry in self._pending:  # The pending frames are no longer expected from this iface.
+            if not entry.complete and iface_id in entry.group:
+                entry.group = entry.group - {iface_id}
+                self._update_complete(entry)
+
+    def push(self, iface_id: int, cap: IfaceCapture, now: int) -> None:
+        """
+        :param now: Monotonic nanoseconds.
+        """
+        self._stats.n_input += 1
+        key = flatten_frame(cap.frame)
+        entry = self._index.get(key)
+        if entry is not None and any(x == iface_id for x, _ in entry.arrivals):
+            del self._index[key]  # The old one will not be matched anymore.
+            entry = None
+        if entry is None:
+            entry = _Entry(key, self._group, now + self._window_ns)
+            self._index[key] = entry
+            self._pending.append(entry)
+        entry.arrivals.append((iface_id, cap))
+        self._update_complete(entry)
+
+    def pop(self, now: int) -> typing.List[DCSDedupCapture]:
+        """
+        Returns the frames that are ready to be published in the order of their first arrival.
+        """
+        out: typing.List[DCSDedupCapture] = []
+        pending, capacity = self._pending, self._settings.capacity
+        while pending:
+            entry = pending[0]
+            if not entry.complete and entry.deadline > now:
+                if len(pending) <= capacity:
+                    break
+                self._stats.n_evicted += 1
+            pending.popleft()
+            if self._index.get(entry.key) is entry:
+                del self._index[entry.key]
+            out.append(self._finalize(entry))
+        return out
+
+    def _update_complete(self, entry: _Entry) -> None:
+        if len(entry.arrivals) >= len(entry.group) and entry.group.issubset(x for x, _ in entry.arrivals):
+            entry.complete = True
+            if self._index.get(entry.key) is entry:
+                del self._index[entry.key]
+
+    def _finalize(self, entry: _Entry) -> DCSDedupCapture:
+        # The forwarders of different ifaces hand over their frames at different moments, so the order of arrival
+        # is determined by the capture timestamps.
+        arrivals = sorted(entry.arrivals, key=lambda x: x[1].timestamp.monotonic_ns)
+        first_ns = arrivals[0][1].timestamp.monotonic_ns
+        skews = [x.timestamp.monotonic_ns - first_ns for _, x in arrivals]
+        iface_stats = self._iface_stats
+        for index, (iface_id, _) in enumerate(arrivals):
+            try:
+                st, hist = iface_stats[iface_id]
+            except LookupError:
+                continue  # Removed since.
+            if index == 0:
+                st.n_first += 1
+            else:
+                hist.add(skews[index])
+        if len(arrivals) < len(entry.group):
+            seen = {x for x, _ in arrivals}
+            for iface_id in entry.group - seen:
+                if iface_id in iface_stats:
+                    iface_stats[iface_id][0].n_missed += 1
+        msg = DCSDedupCapture(
+            timestamp=timestamp_to_dcs(arrivals[0][1].timestamp),
+            sequence_number=self._sequence_number,
+            iface_id=[x for x, _ in arrivals],
+            arrival_skew=[min(_UINT32_MAX, x // 1000) for x in skews],
+            frame=arrivals[0][1].frame,
+        )
+        self._sequence_number += 1
+        self._stats.n_output += 1
+        return msg
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, group=sorted(self._group), settings=self._settings)
+
+
+class DedupForwarder:
+    """
+    Publishes the deduplicated stream. The capture forwarders of the ifaces of the group feed it with their batches
+    from the event loop; the frames whose window expires without new frames arriving are published by a task.
+    Publication is serialized to keep the order of the frames, and the capture forwarders wait for it,
+    so if the publisher cannot keep up, the frames are dropped by the capture forwarders, which is visible
+    in their statistics.
+    """
+
+    def __init__(self, dcs_pub_dedup: Publisher[DCSDedupCapture], settings: DedupSettings) -> None:
+        self._pub = dcs_pub_dedup
+        self._dedup = Deduplicator(settings)
+        self._lock = asyncio.Lock()
+        self._event_pending = asyncio.Event()
+        self._task = asyncio.get_event_loop().create_task(self._task_fn())
+
+    @property
+    def statistics(self) -> DedupStatistics:
+        return self._dedup.statistics
+
+    @property
+    def iface_statistics(self) -> typing.Dict[int, DedupIfaceStatistics]:
+        return self._dedup.iface_statistics
+
+    def add_iface(self, iface_id: int) -> None:
+        self._dedup.add_iface(iface_id)
+
+    def remove_iface(self, iface_id: int) -> None:
+        """
+        :raises: :class:`LookupError` if there is no such iface.
+        """
+        self._dedup.remove_iface(iface_id)
+        self._event_pending.set()  # Some of the pending frames may have become complete.
+
+    async def feed(self, iface_id: int, captures: typing.Iterable[IfaceCapture]) -> None:
+        now = time.monotonic_ns()
+        push = self._dedup.push
+        for cap in captures:
+            push(iface_id, cap, now)
+        self._event_pending.set()
+        await self._publish()
+
+    def close(self) -> None:
+        self._task.cancel()
+
+    async def _publish(self) -> None:
+        async with self._lock:
+            for msg in self._dedup.pop(time.monotonic_ns()):
+                if not await self._pub.publish(msg):
+                    _logger.info("%s send timeout", self._pub)
+
+    async def _task_fn(self) -> None:
+        try:
+            while True:
+                deadline = self._dedup.deadline
+                if deadline is None:
+                    await self._event_pending.wait()
+                else:
+                    try:
+                        await asyncio.wait_for(self._event_pending.wait(), (deadline - time.monotonic_ns()) * 1e-9)
+                    except asyncio.TimeoutError:
+                        pass
+                self._event_pending.clear()
+                await self._publish()
+        except asyncio.CancelledError:
+            pass
+        except Exception as ex:
+            _logger.critical("Dedup forwarder has failed: %s", ex, exc_info=True)
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, self._dedup)
@@ -0,0 +1,169 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import copy
+import typing
+import dataclasses
+import pyuavcan
+from pyuavcan.transport import AlienSessionSpecifier, MessageDataSpecifier, ServiceDataSpecifier
+from org_uavcan_yukon.io.frame import Filter_0_1 as DCSFilter
+
+
+@dataclasses.dataclass(frozen=True)
+class FilterRule:
+    """
+    See the DSDL definition :class:`DCSFilter` for the semantics.
+    """
+
+    kind_mask: int = 0
+    subject_id_range: typing.Optional[typing.Tuple[int, int]] = None
+    service_id: typing.Optional[int] = None
+    source_node_id: typing.Optional[int] = None
+    destination_node_id: typing.Optional[int] = None
+    drop: bool = False
+
+    @staticmethod
+    def from_dcs(msg: DCSFilter) -> FilterRule:
+        return FilterRule(
+            kind_mask=int(msg.kind_mask),
+            subject_id_range=(int(msg.subject_id_range[0]), int(msg.subject_id_range[1]))
+            if len(msg.subject_id_range) == 2
+            else None,
+            service_id=int(msg.service_id[0]) if msg.service_id.size else None,
+            source_node_id=int(msg.source_node_id[0]) if msg.source_node_id.size else None,
+            destination_node_id=int(msg.destination_node_id[0]) if msg.destination_node_id.size else None,
+            drop=bool(msg.drop),
+        )
+
+    def matches_port(self, kind: int, port_id: int) -> bool:
+        """
+        :param kind: One of the ``KIND_*`` constants of :class:`DCSFilter`.
+        """
+        if self.kind_mask and not self.kind_mask & kind:
+            return False
+        if self.subject_id_range is not None:
+            lo, hi = self.subject_id_range
+            if kind != DCSFilter.KIND_MESSAGE or not lo <= port_id <= hi:
+                return False
+        if self.service_id is not None:
+            if kind == DCSFilter.KIND_MESSAGE or port_id != self.service_id:
+                return False
+        return True
+
+
+class CaptureFilter:
+    """
+    Decides which captured frames shall be published.
+    The rules are compiled into a table per transfer kind indexed by the port-ID that contains the rules that may
+    match the port, so the rules that cannot match are never looked at.
+    The remaining node-ID checks are trivial and there is usually at most one candidate anyway.
+
+    The filter is evaluated by the capture thread of the iface, so every iface shall have its own instance
+    to keep the counters consistent; see :meth:`clone`.
+
+    >>> flt = CaptureFilter([FilterRule(subject_id_range=(100, 199), source_node_id=5),
+    ...                      FilterRule(kind_mask=DCSFilter.KIND_REQUEST | DCSFilter.KIND_RESPONSE)])
+    >>> flt.accept(AlienSessionSpecifier(5, None, MessageDataSpecifier(150)))
+    True
+    >>> flt.accept(AlienSessionSpecifier(6, None, MessageDataSpecifier(150)))
+    False
+    >>> flt.accept(AlienSessionSpecifier(6, 7, ServiceDataSpecifier(430, ServiceDataSpecifier.Role.RESPONSE)))
+    True
+    >>> flt.accept(None)  # Unknown session.
+    True
+    >>> flt.hits, flt.drops
+    ([1, 1], [0, 0])
+    >>> other = flt.clone()
+    >>> other.accept(AlienSessionSpecifier(6, None, MessageDataSpecifier(150)))
+    False
+    >>> other.hits, other.drops  # Dropped by default because no rule has matched.
+    ([0, 0], [0, 0])
+    >>> dropper = CaptureFilter([FilterRule(source_node_id=5, drop=True)])
+    >>> dropper.accept(AlienSessionSpecifier(5, None, MessageDataSpecifier(150)))
+    False
+    >>> dropper.hits, dropper.drops
+    ([1], [1])
+    """
+
+    def __init__(self, rules: typing.Sequence[FilterRule]) -> None:
+        self._rules = list(rules)
+        self._checks = [(r.source_node_id, r.destination_node_id, not r.drop) for r in self._rules]
+        self._hits = [0] * len(self._rules)
+        self._drops = [0] * len(self._rules)
+        self._default = all(r.drop for r in self._rules)
+        interned: typing.Dict[typing.Tuple[int, ...], typing.Tuple[int, ...]] = {}
+
+        def compile_table(kind: int, size: int) -> typing.List[typing.Tuple[int, ...]]:
+            out = []
+            for port_id in range(size):
+                cand = tuple(i for i, r in enumerate(self._rules) if r.matches_port(kind, port_id))
+                out.append(interned.setdefault(cand, cand))
+            return out
+
+        self._message_table = compile_table(DCSFilter.KIND_MESSAGE, MessageDataSpecifier.SUBJECT_ID_MASK + 1)
+        self._request_table = compile_table(DCSFilter.KIND_REQUEST, ServiceDataSpecifier.SERVICE_ID_MASK + 1)
+        self._response_table = compile_table(DCSFilter.KIND_RESPONSE, ServiceDataSpecifier.SERVICE_ID_MASK + 1)
+
+    @property
+    def rules(self) -> typing.List[FilterRule]:
+        return list(self._rules)
+
+    @property
+    def hits(self) -> typing.List[int]:
+        """
+        The number of frames matched by each rule.
+        """
+        return list(self._hits)
+
+    @property
+    def drops(self) -> typing.List[int]:
+        """
+        The number of frames dropped by each rule. The frames that do not match any rule are not counted here.
+        """
+        return list(self._drops)
+
+    def clone(self) -> CaptureFilter:
+        """
+        A filter with the same rules and zero counters. The compiled tables are shared, so this is cheap.
+        """
+        out = copy.copy(self)
+        out._hits = [0] * len(self._rules)
+        out._drops = [0] * len(self._rules)
+        return out
+
+    def absorb(self, other: CaptureFilter) -> None:
+        """
+        Adds the counters of the other filter, which shall have the same rules, to the counters of this one.
+        """
+        if other.rules != self._rules:
+            raise ValueError(f"Cannot absorb {other!r} into {self!r}")
+        self._hits = [a + b for a, b in zip(self._hits, other.hits)]
+        self._drops = [a + b for a, b in zip(self._drops, other.drops)]
+
+    def accept(self, spec: typing.Optional[AlienSessionSpecifier]) -> bool:
+        """
+        :param spec: None if the session of the frame is unknown; such frames are always accepted.
+        """
+        if spec is None:
+            return True
+        ds = spec.data_specifier
+        if isinstance(ds, MessageDataSpecifier):
+            candidates = self._message_table[ds.subject_id]
+        elif isinstance(ds, ServiceDataSpecifier):
+            table = self._request_table if ds.role == ServiceDataSpecifier.Role.REQUEST else self._response_table
+            candidates = table[ds.service_id]
+        else:  # pragma: no cover
+            return True
+        for index in candidates:
+            src, dst, accept = self._checks[index]
+            if (src is None or src == spec.source_node_id) and (dst is None or dst == spec.destination_node_id):
+                self._hits[index] += 1
+                if not accept:
+                    self._drops[index] += 1
+                return accept
+        return self._default
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, self._rules)
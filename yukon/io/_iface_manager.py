@@ -0,0 +1,357 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import time
+import typing
+import asyncio
+import logging
+import threading
+import functools
+import dataclasses
+import queue
+import pyuavcan
+from org_uavcan_yukon.io.iface.transport import Config_0_1 as DCSTransportConfig
+from .iface import Iface
+
+
+_logger = logging.getLogger(__name__)
+
+
+ReadyHandler = typing.Callable[[int, Iface], None]
+"""
+Invoked from the event loop with (iface_id, iface) when an iface is initialized.
+If it raises, the iface is closed and the initialization is considered failed.
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class IfaceManagerSettings:
+    thread_count: int = 4
+    """
+    The size of the thread pool where the transports are constructed and closed.
+    A driver call that never returns occupies a thread permanently, so the number of stuck threads is bounded by this.
+    The threads are daemonic so that a stuck one does not prevent the process from exiting.
+    """
+
+    init_timeout: typing.Mapping[str, float] = dataclasses.field(default_factory=dict)
+    """
+    Initialization deadline per transport name (see :attr:`Iface.TRANSPORT_NAME`), in seconds.
+    The time spent waiting for a free thread is not counted.
+    """
+
+    init_timeout_default: float = 10.0
+    """
+    Applies to the transports that are not listed in :attr:`init_timeout`.
+    """
+
+    retry_interval_min: float = 1.0
+    """
+    A failed initialization is retried after this delay, which is doubled after every consecutive failure.
+    """
+
+    retry_interval_max: float = 30.0
+
+
+@dataclasses.dataclass
+class IfaceManagerStatistics:
+    n_threads_busy: int = 0
+    n_threads_queued: int = 0  # Initializations and closures waiting for a free thread.
+    n_init_timeouts: int = 0
+    n_late_closures: int = 0  # Transports closed because they were initialized after their iface was abandoned.
+    close_duration_max: float = 0.0  # The longest time it took to close an iface, in seconds.
+
+
+@dataclasses.dataclass
+class IfaceEntry:
+    """
+    The state of a configured iface. If neither the iface nor the failure is set, the first attempt is underway.
+    """
+
+    iface_id: int
+    config: DCSTransportConfig
+    iface: typing.Optional[Iface] = None
+    failure: typing.Optional[str] = None  # The reason of the last failed attempt; kept while the next one is underway.
+    n_attempts: int = 0
+    init_duration: float = 0.0  # Of the last initialization attempt that has finished, in seconds.
+
+
+class IfaceManager:
+    """
+    Maintains the lifecycle of the ifaces: initializes them in a bounded thread pool with a deadline per attempt,
+    retries failed attempts with exponential backoff, and closes them when they are removed.
+
+    A blocking driver call cannot be interrupted, so an attempt that has timed out or whose iface has been removed
+    is abandoned instead: if it has not started yet, it will not run at all; if it eventually succeeds,
+    the new iface is closed immediately instead of being leaked.
+    """
+
+    def __init__(self, settings: IfaceManagerSettings, on_ready: ReadyHandler) -> None:
+        if settings.thread_count < 1:
+            raise ValueError(f"Invalid thread count: {settings.thread_count}")
+        self._settings = settings
+        self._on_ready = on_ready
+        self._loop = asyncio.get_event_loop()
+        self._pool = _DaemonPool(self._loop, settings.thread_count)
+        self._entries: typing.Dict[int, IfaceEntry] = {}
+        self._tasks: typing.Dict[int, asyncio.Task[None]] = {}
+        self._stats = IfaceManagerStatistics()
+
+    @property
+    def entries(self) -> typing.Mapping[int, IfaceEntry]:
+        return self._entries
+
+    @property
+    def statistics(self) -> IfaceManagerStatistics:
+        return dataclasses.replace(self._stats)
+
+    def add(self, iface_id: int, config: DCSTransportConfig) -> None:
+        if iface_id in self._entries:
+            raise ValueError(f"Iface {iface_id} already exists")
+        entry = IfaceEntry(iface_id, config)
+        self._entries[iface_id] = entry
+        self._tasks[iface_id] = self._loop.create_task(self._maintain(entry))
+
+    def remove(self, iface_id: int) -> None:
+        """
+        Aborts the initialization if it is underway, otherwise closes the iface in the background.
+        The caller is responsible for detaching the iface from its users beforehand.
+        """
+        entry = self._entries.pop(iface_id)
+        self._tasks.pop(iface_id).cancel()
+        if entry.iface is not None:
+            self._close_in_background(entry.iface)
+
+    def close(self) -> None:
+        for iface_id in list(self._entries):
+            self.remove(iface_id)
+        self._pool.shutdown()
+
+    async def _maintain(self, entry: IfaceEntry) -> None:
+        try:
+            iface_type = Iface.resolve(entry.config)
+        except TypeError as ex:
+            entry.failure = str(ex)  # Retrying would not help.
+            _logger.error("Iface %d: %s", entry.iface_id, ex)
+            return
+        timeout = self._settings.init_timeout.get(iface_type.TRANSPORT_NAME, self._settings.init_timeout_default)
+        retry_interval = self._settings.retry_interval_min
+        while True:
+            entry.n_attempts += 1
+            try:
+                iface = await self._initialize(iface_type, entry, timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                entry.failure = f"Init failed: {type(ex).__name__}: {ex or '<description not available>'}"
+            else:
+                try:
+                    self._on_ready(entry.iface_id, iface)
+                except Exception as ex:
+                    _logger.exception("Iface %d: Could not set up %r: %s", entry.iface_id, iface, ex)
+                    entry.failure = f"Setup failed: {type(ex).__name__}: {ex or '<description not available>'}"
+                    self._close_in_background(iface)
+                else:
+                    entry.iface, entry.failure = iface, None
+                    _logger.info("Iface %d: Ready after %d attempt(s): %r", entry.iface_id, entry.n_attempts, iface)
+                    return
+            _logger.warning("Iface %d: %s; retrying in %.1f s", entry.iface_id, entry.failure, retry_interval)
+            await asyncio.sleep(retry_interval)
+            retry_interval = min(retry_interval * 2, self._settings.retry_interval_max)
+
+    async def _initialize(self, iface_type: typing.Type[Iface], entry: IfaceEntry, timeout: float) -> Iface:
+        attempt = _Attempt(self._loop)
+        self._stats.n_threads_queued += 1
+        fut = self._pool.submit(self._initialize_in_thread, iface_type, entry.config, attempt)
+        try:
+            await attempt.started.wait()
+            done, _ = await asyncio.wait([fut], timeout=timeout)
+            entry.init_duration = time.monotonic() - attempt.started_at
+            if not done:
+                self._stats.n_init_timeouts += 1
+                raise TimeoutError(f"Not initialized in {timeout:.1f} s")
+            fut.result()  # Propagate the exception if any.
+            iface = attempt.take()
+            assert iface is not None
+            return iface
+        except BaseException:
+            fut.add_done_callback(_consume_exception)  # Nobody is going to look at the outcome anymore.
+            leftover = attempt.abandon()
+            if leftover is not None:  # Finished concurrently with the cancellation.
+                self._close_in_background(leftover)
+            raise
+
+    def _initialize_in_thread(
+        self, iface_type: typing.Type[Iface], config: DCSTransportConfig, attempt: _Attempt
+    ) -> None:
+        if not attempt.start():
+            self._post(self._update_thread_counters, -1, 0)
+            return
+        self._post(self._update_thread_counters, -1, +1)
+        try:
+            # The transports look up the event loop during construction, which only works in the main thread
+            # unless the loop is explicitly assigned to the current one.
+            asyncio.set_event_loop(self._loop)
+            iface = iface_type.new(config)
+            if not attempt.deliver(iface):
+                _logger.info("Closing %r because it was initialized after being abandoned", iface)
+                self._post(self._count_late_closure)
+                self._close_in_thread(iface)
+        finally:
+            self._post(self._update_thread_counters, 0, -1)
+
+    def _close_in_background(self, iface: Iface) -> None:
+        self._stats.n_threads_queued += 1
+        self._pool.submit(self._close_queued, iface)
+
+    def _close_queued(self, iface: Iface) -> None:
+        self._post(self._update_thread_counters, -1, +1)
+        try:
+            self._close_in_thread(iface)
+        finally:
+            self._post(self._update_thread_counters, 0, -1)
+
+    def _close_in_thread(self, iface: Iface) -> None:
+        started_at = time.monotonic()
+        try:
+            iface.close()
+        except Exception as ex:
+            _logger.exception("Could not close %r: %s", iface, ex)
+        finally:
+            self._post(self._on_closed, time.monotonic() - started_at)
+
+    def _post(self, fn: typing.Callable[..., None], *args: typing.Any) -> None:
+        """
+        Runs the bookkeeping in the event loop; invoked from the pool threads.
+        """
+        try:
+            self._loop.call_soon_threadsafe(fn, *args)
+        except RuntimeError:  # The loop is closed, so nobody needs the bookkeeping anymore.
+            pass
+
+    def _update_thread_counters(self, queued: int, busy: int) -> None:
+        self._stats.n_threads_queued += queued
+        self._stats.n_threads_busy += busy
+
+    def _count_late_closure(self) -> None:
+        self._stats.n_late_closures += 1
+
+    def _on_closed(self, duration: float) -> None:
+        self._stats.close_duration_max = max(self._stats.close_duration_max, duration)
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, self._settings, self._stats)
+
+
+def _consume_exception(fut: asyncio.Future[typing.Any]) -> None:
+    if not fut.cancelled():
+        fut.exception()
+
+
+class _Attempt:
+    """
+    Hands the new iface over from the initialization thread to the event loop, or disposes of it if nobody needs it.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._abandoned = False
+        self._result: typing.Optional[Iface] = None
+        self.started = asyncio.Event()
+        self.started_at = 0.0
+
+    def start(self) -> bool:
+        """
+        Invoked from the thread. Returns False if the attempt should not run because it has been abandoned.
+        """
+        with self._lock:
+            if self._abandoned:
+                return False
+            self.started_at = time.monotonic()
+            self._loop.call_soon_threadsafe(self.started.set)
+            return True
+
+    def deliver(self, iface: Iface) -> bool:
+        """
+        Invoked from the thread. Returns False if the attempt has been abandoned, then the iface is to be closed.
+        """
+        with self._lock:
+            if self._abandoned:
+                return False
+            self._result = iface
+            return True
+
+    def take(self) -> typing.Optional[Iface]:
+        with self._lock:
+            out, self._result = self._result, None
+            return out
+
+    def abandon(self) -> typing.Optional[Iface]:
+        """
+        Returns the iface if it has been delivered but not taken; the caller is then responsible for closing it.
+        """
+        with self._lock:
+            self._abandoned = True
+            out, self._result = self._result, None
+            return out
+
+
+class _DaemonPool:
+    """
+    Unlike :class:`concurrent.futures.ThreadPoolExecutor`, the threads are daemonic,
+    so the process can exit even if some of them are stuck in a driver call forever.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, size: int) -> None:
+        self._loop = loop
+        self._queue: queue.SimpleQueue[typing.Optional[typing.Tuple[asyncio.Future[typing.Any], typing.Any]]] = (
+            queue.SimpleQueue()
+        )
+        self._threads = [
+            threading.Thread(target=self._thread_fn, name=f"io_iface_{i}", daemon=True) for i in range(size)
+        ]
+        for th in self._threads:
+            th.start()
+
+    def submit(self, fn: typing.Callable[..., typing.Any], *args: typing.Any) -> asyncio.Future[typing.Any]:
+        fut = self._loop.create_future()
+        self._queue.put((fut, functools.partial(fn, *args)))
+        return fut
+
+    def shutdown(self) -> None:
+        """
+        The pending items are still executed. Does not wait for the threads to finish.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+
+    def _thread_fn(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            fut, fn = item
+            try:
+                result = fn()
+            except BaseException as ex:  # pylint: disable=broad-except
+                self._complete(fut, None, ex)
+            else:
+                self._complete(fut, result, None)
+
+    def _complete(
+        self, fut: asyncio.Future[typing.Any], result: typing.Any, ex: typing.Optional[BaseException]
+    ) -> None:
+        def do() -> None:
+            if fut.done():
+                return
+            if ex is not None:
+                fut.set_exception(ex)
+            else:
+                fut.set_result(result)
+
+        try:
+            self._loop.call_soon_threadsafe(do)
+        except RuntimeError:  # The loop is closed.
+            pass
@@ -0,0 +1,107 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import typing
+import dataclasses
+import pyuavcan
+
+
+_SUB_BUCKET_BITS = 2
+"""
+Each power-of-two range is split into this many bits worth of buckets, so the relative resolution is 25%.
+"""
+
+_BUCKET_COUNT = 64 << _SUB_BUCKET_BITS
+
+
+@dataclasses.dataclass(frozen=True)
+class LatencySummary:
+    """
+    The quantiles are approximate, see :class:`LatencyHistogram`; the maximum is exact. All values are in seconds.
+    """
+
+    count: int = 0
+    p50: float = 0.0
+    p99: float = 0.0
+    max: float = 0.0
+
+
+class LatencyHistogram:
+    """
+    Fixed-memory histogram of durations in nanoseconds with logarithmic buckets,
+    intended for instrumenting the hot paths: recording a sample costs one method call and a few integer operations.
+    The quantiles are reported as the middle of the bucket they fall into.
+    The values are accumulated from construction onward; negative durations (clock skew) are counted as zero.
+
+    >>> h = LatencyHistogram()
+    >>> for x in range(1, 1001):
+    ...     h.add(x * 1000)  # Uniformly from 1 to 1000 microseconds.
+    >>> s = h.summarize()
+    >>> s.count, s.max
+    (1000, 0.001)
+    >>> 400e-6 < s.p50 < 600e-6, 850e-6 < s.p99 < 1150e-6
+    (True, True)
+    >>> LatencyHistogram().summarize()
+    LatencySummary(count=0, p50=0.0, p99=0.0, max=0.0)
+    """
+
+    __slots__ = ("_counts", "_max")
+
+    def __init__(self) -> None:
+        self._counts = [0] * _BUCKET_COUNT
+        self._max = 0
+
+    def add(self, duration_ns: int) -> None:
+        # The constants are inlined (see _SUB_BUCKET_BITS) because the global lookups make up a noticeable part
+        # of the cost. The leading bit is implied by the bit length; the sub-bucket is taken from the bits after it.
+        if duration_ns > 3:
+            bl = duration_ns.bit_length()
+            self._counts[(bl << 2) | ((duration_ns >> (bl - 3)) & 3)] += 1
+            if duration_ns > self._max:
+                self._max = duration_ns
+        else:
+            self._counts[duration_ns if duration_ns > 0 else 0] += 1
+
+    def summarize(self) -> LatencySummary:
+        counts = list(self._counts)  # The histogram may be updated from another thread concurrently.
+        total = sum(counts)
+        if total == 0:
+            return LatencySummary()
+        top = float(self._max)  # The middle of the last bucket may be above the maximum.
+        return LatencySummary(
+            count=total,
+            p50=min(top, _quantile(counts, total, 0.5)) * 1e-9,
+            p99=min(top, _quantile(counts, total, 0.99)) * 1e-9,
+            max=top * 1e-9,
+        )
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, self.summarize())
+
+
+def _quantile(counts: typing.List[int], total: int, q: float) -> float:
+    target = max(1, round(total * q))
+    acc = 0
+    for index, c in enumerate(counts):
+        acc += c
+        if acc >= target:
+            return _bucket_middle(index)
+    assert False, "Unreachable"
+
+
+def _bucket_middle(index: int) -> float:
+    """
+    >>> [_bucket_middle(i) for i in range(4)]
+    [0.0, 1.0, 2.0, 3.0]
+    >>> [_bucket_middle(i) for i in range(12, 16)]  # Bit length 3: [4, 5), [5, 6), [6, 7), [7, 8)
+    [4.5, 5.5, 6.5, 7.5]
+    >>> [_bucket_middle(i) for i in range(44, 48)]  # Bit length 11: [1024, 1280), ...
+    [1152.0, 1408.0, 1664.0, 1920.0]
+    """
+    bl, sub = index >> _SUB_BUCKET_BITS, index & ((1 << _SUB_BUCKET_BITS) - 1)
+    if bl == 0:
+        return float(index)
+    width = 1 << (bl - _SUB_BUCKET_BITS - 1)
+    return float((((1 << _SUB_BUCKET_BITS) | sub) * width) + width / 2)
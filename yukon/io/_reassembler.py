@@ -0,0 +1,362 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import copy
+import typing
+import logging
+import collections
+import dataclasses
+import pyuavcan
+from pyuavcan.transport import AlienSessionSpecifier, Priority, Timestamp, TransferFrom
+from pyuavcan.transport.commons.high_overhead_transport import Frame as HOFrame, TransferReassembler as HOReassembler
+from org_uavcan_yukon.io.transfer import Payload_1_0 as DCSPayload
+from .iface import Iface, IfaceCapture
+
+# The CAN reassembler is not exported by the CAN transport package but it is exactly what is needed here.
+# These are private, which is why the exact version of PyUAVCAN is pinned in setup.cfg.
+from pyuavcan.transport.can._session import TransferReassembler as CANReassembler  # pylint: disable=wrong-import-order
+from pyuavcan.transport.can import TransferReassemblyErrorID as CANReassemblyError  # pylint: disable=wrong-import-order
+from pyuavcan.transport.can._frame import UAVCANFrame  # pylint: disable=wrong-import-order
+
+
+_logger = logging.getLogger(__name__)
+
+_EXTENT_BYTES = DCSPayload.CAPACITY_BYTES
+"""
+Transfers are truncated to the size that can be represented in DCS messages; see ``n_truncated``.
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class ReassemblerSettings:
+    transfer_id_timeout: float = 2.0
+    """
+    A partial transfer whose session has been silent for this long cannot be completed because the next frame
+    would restart the reassembly anyway, so such sessions are evicted, which implements the TTL policy.
+    """
+
+    session_count_max: int = 4096
+    """
+    The least recently used sessions are evicted when the limit is exceeded.
+    """
+
+    buffered_bytes_max: int = 16 * 1024 ** 2
+    """
+    The total size of the payload fragments held by all sessions of all ifaces.
+    The least recently used sessions holding partial transfers are evicted until the total is below the limit.
+    """
+
+
+@dataclasses.dataclass
+class ReassemblerStatistics:
+    n_completed: int = 0  # Reassembled transfers.
+    n_evicted: int = 0  # Partial transfers discarded by the TTL, the LRU policy, or the memory limit.
+    n_malformed: int = 0  # Frames that could not be parsed or did not fit into a transfer, and failed transfers.
+    n_truncated: int = 0  # Completed transfers whose payload exceeded the DCS payload capacity and has been cut short.
+
+
+TransferHandler = typing.Callable[[int, typing.Tuple[int, int], AlienSessionSpecifier, TransferFrom], None]
+"""
+Accepts (iface_id, (first frame sequence number, last frame sequence number), session, transfer).
+"""
+
+
+class Reassembler:
+    """
+    Reconstructs transfers from the frames captured on several ifaces.
+
+    Each transport session on each iface is reassembled incrementally by its own state machine;
+    the sessions are kept in LRU order (least recent first) which also happens to be the order of their timestamps,
+    so both the TTL and the LRU evictions are done by popping from the front.
+    """
+
+    def __init__(self, settings: ReassemblerSettings, handler: TransferHandler) -> None:
+        self._settings = settings
+        self._handler = handler
+        self._tid_timeout_ns = int(settings.transfer_id_timeout * 1e9)
+        self._extractors: typing.Dict[int, _FrameExtractor] = {}
+        self._stats: typing.Dict[int, ReassemblerStatistics] = {}
+        self._sessions: typing.OrderedDict[typing.Tuple[int, AlienSessionSpecifier], _Session] = (
+            collections.OrderedDict()
+        )
+        self._buffered_bytes = 0
+
+    @property
+    def statistics(self) -> typing.Dict[int, ReassemblerStatistics]:
+        return {k: copy.copy(v) for k, v in self._stats.items()}
+
+    @property
+    def buffered_bytes(self) -> int:
+        return self._buffered_bytes
+
+    def has_iface(self, iface_id: int) -> bool:
+        return iface_id in self._extractors
+
+    def add_iface(self, iface_id: int, iface_type: typing.Type[Iface]) -> None:
+        self._extractors[iface_id] = _FrameExtractor.new(iface_type, self._settings.buffered_bytes_max)
+        self._stats[iface_id] = ReassemblerStatistics()
+
+    def remove_iface(self, iface_id: int) -> None:
+        del self._extractors[iface_id]
+        del self._stats[iface_id]
+        for key in [k for k in self._sessions if k[0] == iface_id]:
+            self._buffered_bytes -= self._sessions.pop(key).pending_bytes
+
+    def feed(self, iface_id: int, sequence_number: int, cap: IfaceCapture) -> None:
+        """
+        Frames of ifaces that are not registered are ignored.
+        The handler is invoked synchronously from here when a transfer is completed.
+        """
+        try:
+            extractor = self._extractors[iface_id]
+        except LookupError:
+            return
+        stats = self._stats[iface_id]
+        try:
+            frames = extractor.extract(sequence_number, cap)
+        except Exception as ex:  # The frame comes from the network so anything can happen.
+            frames = (None,)
+            _logger.info("Iface %r: could not extract %r: %s", iface_id, cap, ex, exc_info=True)
+        for item in frames:  # A malformed frame does not affect the other frames extracted from the same capture.
+            if item is None:
+                stats.n_malformed += 1
+                continue
+            seq_first, ts, spec, priority, frame = item
+            try:
+                self._process(iface_id, stats, (seq_first, sequence_number), ts, spec, priority, frame)
+            except Exception as ex:
+                stats.n_malformed += 1
+                _logger.info("Iface %r: could not process %r: %s", iface_id, frame, ex, exc_info=True)
+        self._evict(cap.timestamp.monotonic_ns)
+
+    def _process(
+        self,
+        iface_id: int,
+        stats: ReassemblerStatistics,
+        seq_range: typing.Tuple[int, int],
+        ts: Timestamp,
+        spec: AlienSessionSpecifier,
+        priority: Priority,
+        frame: typing.Union[UAVCANFrame, HOFrame],
+    ) -> None:
+        if spec.source_node_id is None:  # Anonymous transfers are single-frame, no session state needed.
+            tr = _construct_anonymous_transfer(ts, priority, frame)
+            if tr is None:
+                stats.n_malformed += 1
+            else:
+                stats.n_completed += 1
+                if _payload_size(frame, 0, single_frame=True) > _EXTENT_BYTES:
+                    stats.n_truncated += 1
+                self._handler(iface_id, seq_range, spec, tr)
+            return
+
+        key = iface_id, spec
+        try:
+            ses = self._sessions[key]
+            self._sessions.move_to_end(key)
+        except LookupError:
+            ses = _Session(spec.source_node_id, frame)
+            self._sessions[key] = ses
+
+        size = len(frame.padded_payload if isinstance(frame, UAVCANFrame) else frame.payload)
+        if _is_start_of_transfer(frame):
+            self._buffered_bytes -= ses.pending_bytes
+            ses.pending_bytes = 0
+            ses.seq_first = seq_range[0]
+        ses.pending_bytes += size
+        self._buffered_bytes += size
+        ses.last_active_ns = ts.monotonic_ns
+
+        result = ses.update(ts, priority, frame, self._tid_timeout_ns)
+        if isinstance(result, TransferFrom):
+            if _payload_size(frame, ses.pending_bytes, single_frame=_is_start_of_transfer(frame)) > _EXTENT_BYTES:
+                stats.n_truncated += 1
+            self._buffered_bytes -= ses.pending_bytes
+            ses.pending_bytes = 0
+            stats.n_completed += 1
+            self._handler(iface_id, (ses.seq_first, seq_range[1]), spec, result)
+        elif result is not None:
+            stats.n_malformed += 1
+            retained = _retained_after_error(result, ses.pending_bytes, size)
+            self._buffered_bytes -= ses.pending_bytes - retained
+            ses.pending_bytes = retained
+
+    def _evict(self, now_ns: int) -> None:
+        sessions = self._sessions
+        deadline_ns = now_ns - self._tid_timeout_ns
+        while sessions:
+            key, ses = next(iter(sessions.items()))
+            if (
+                ses.last_active_ns >= deadline_ns
+                and len(sessions) <= self._settings.session_count_max
+                and self._buffered_bytes <= self._settings.buffered_bytes_max
+            ):
+                break
+            del sessions[key]
+            if ses.pending_bytes > 0:
+                self._buffered_bytes -= ses.pending_bytes
+                self._stats[key[0]].n_evicted += 1
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(
+            self, settings=self._settings, sessions=len(self._sessions), buffered_bytes=self._buffered_bytes
+        )
+
+
+_Extracted = typing.Tuple[int, Timestamp, AlienSessionSpecifier, Priority, typing.Union[UAVCANFrame, HOFrame]]
+"""
+(first frame sequence number, timestamp, session specifier, priority, frame)
+"""
+
+_ExtractedOrMalformed = typing.Optional[_Extracted]
+"""
+None stands for a frame that is not valid.
+"""
+
+
+class _FrameExtractor:
+    """
+    Converts the captures of a particular iface into transport frames.
+    """
+
+    def __init__(self, iface_type: typing.Type[Iface]) -> None:
+        self._capture_from_dcs = iface_type.capture_from_dcs
+
+    @staticmethod
+    def new(iface_type: typing.Type[Iface], frame_size_max: int) -> _FrameExtractor:
+        if iface_type.TRANSPORT_NAME == "serial":
+            return _SerialFrameExtractor(iface_type, frame_size_max)
+        return _FrameExtractor(iface_type)
+
+    def extract(self, sequence_number: int, cap: IfaceCapture) -> typing.Sequence[_ExtractedOrMalformed]:
+        """
+        :returns: The frames contained in the capture in the order of their appearance.
+        """
+        native = self._capture_from_dcs(cap.timestamp, cap.frame)
+        parsed = native.parse()  # type: ignore
+        if parsed is None:
+            return (None,)
+        if len(parsed) == 3:  # CAN reports the priority separately from the frame.
+            spec, priority, frame = parsed
+        else:
+            spec, frame = parsed
+            priority = frame.priority
+        return ((sequence_number, cap.timestamp, spec, priority, frame),)
+
+
+class _SerialFrameExtractor(_FrameExtractor):
+    """
+    Serial captures are chunks of the byte stream rather than frames, so they are fed into a stream parser.
+    The chunks do not indicate the direction, so if the transmitted data is interleaved with the received data,
+    some frames may be damaged; such frames are reported as malformed individually, the rest of the chunk is intact.
+    """
+
+    def __init__(self, iface_type: typing.Type[Iface], frame_size_max: int) -> None:
+        from pyuavcan.transport.serial import SerialFrame
+        from pyuavcan.transport.serial._stream_parser import StreamParser
+
+        super().__init__(iface_type)
+        # A whole transfer may be sent in one frame, so the limit is not the extent: the frames larger than that
+        # are truncated like any other transfer rather than discarded. The limit only shields against garbage.
+        self._parser = StreamParser(self._on_parsed, frame_size_max)
+        self._frame_type = SerialFrame
+        self._parsed: typing.List[typing.Tuple[Timestamp, typing.Optional[typing.Any]]] = []
+        self._seq_first: typing.Optional[int] = None
+
+    def extract(self, sequence_number: int, cap: IfaceCapture) -> typing.Sequence[_ExtractedOrMalformed]:
+        data = cap.frame.serial.data  # type: ignore
+        if self._seq_first is None:
+            self._seq_first = sequence_number
+        self._parser.process_next_chunk(data.tobytes(), cap.timestamp)
+        seq_first = self._seq_first
+        if len(data) > 0 and data[-1] == self._frame_type.FRAME_DELIMITER_BYTE:
+            self._seq_first = None  # The next chunk begins a new frame.
+
+        parsed, self._parsed = self._parsed, []
+        out: typing.List[_ExtractedOrMalformed] = []
+        for ts, frame in parsed:
+            if frame is None:
+                out.append(None)
+                continue
+            spec = AlienSessionSpecifier(frame.source_node_id, frame.destination_node_id, frame.data_specifier)
+            out.append((seq_first, ts, spec, frame.priority, frame))
+        return out
+
+    def _on_parsed(self, timestamp: Timestamp, _data: memoryview, frame: typing.Optional[typing.Any]) -> None:
+        self._parsed.append((timestamp, frame))
+
+
+class _Session:
+    __slots__ = ["reassembler", "pending_bytes", "seq_first", "last_active_ns", "error"]
+
+    def __init__(self, source_node_id: int, frame: typing.Union[UAVCANFrame, HOFrame]) -> None:
+        self.reassembler: typing.Union[CANReassembler, HOReassembler]
+        if isinstance(frame, UAVCANFrame):
+            self.reassembler = CANReassembler(source_node_id, _EXTENT_BYTES)
+        else:
+            self.reassembler = HOReassembler(source_node_id, _EXTENT_BYTES, self._on_error)
+        self.pending_bytes = 0
+        self.seq_first = 0
+        self.last_active_ns = 0
+        self.error: typing.Optional[HOReassembler.Error] = None
+
+    def update(
+        self,
+        ts: Timestamp,
+        priority: Priority,
+        frame: typing.Union[UAVCANFrame, HOFrame],
+        tid_timeout_ns: int,
+    ) -> typing.Union[None, TransferFrom, CANReassemblyError, HOReassembler.Error]:
+        """
+        :returns: None if the transfer is not yet complete; the transfer once it is complete;
+            the reassembly error if the frame could not be accepted or the transfer is invalid.
+        """
+        if isinstance(self.reassembler, CANReassembler):
+            assert isinstance(frame, UAVCANFrame)
+            return self.reassembler.process_frame(ts, priority, frame, tid_timeout_ns)
+        assert isinstance(frame, HOFrame)
+        result = self.reassembler.process_frame(ts, frame, tid_timeout_ns * 1e-9)
+        error, self.error = self.error, None
+        return result if result is not None else error
+
+    def _on_error(self, error: HOReassembler.Error) -> None:
+        self.error = error
+
+
+def _retained_after_error(
+    error: typing.Union[CANReassemblyError, HOReassembler.Error], pending_bytes: int, frame_size: int
+) -> int:
+    """
+    Estimates how many of the pending bytes are still held by the reassembler after it reported an error.
+    """
+    if error in (CANReassemblyError.UNEXPECTED_TRANSFER_ID, CANReassemblyError.UNEXPECTED_TOGGLE_BIT):
+        return pending_bytes - frame_size  # The frame is ignored but the partial transfer is kept.
+    if error == HOReassembler.Error.MULTIFRAME_MISSING_FRAMES:
+        return frame_size  # The previous transfer is abandoned and a new one is started from this frame.
+    return 0
+
+
+def _payload_size(frame: typing.Union[UAVCANFrame, HOFrame], pending_bytes: int, single_frame: bool) -> int:
+    """
+    The size of the transfer payload completed by this frame, excluding the transfer CRC of multi-frame transfers.
+    The pending bytes include the size of the last frame.
+    """
+    if single_frame:
+        return len(frame.padded_payload if isinstance(frame, UAVCANFrame) else frame.payload)
+    return pending_bytes - (2 if isinstance(frame, UAVCANFrame) else 4)
+
+
+def _is_start_of_transfer(frame: typing.Union[UAVCANFrame, HOFrame]) -> bool:
+    return frame.start_of_transfer if isinstance(frame, UAVCANFrame) else frame.index == 0
+
+
+def _construct_anonymous_transfer(
+    ts: Timestamp, priority: Priority, frame: typing.Union[UAVCANFrame, HOFrame]
+) -> typing.Optional[TransferFrom]:
+    if isinstance(frame, UAVCANFrame):
+        if not (frame.start_of_transfer and frame.end_of_transfer):
+            return None
+        return TransferFrom(ts, priority, frame.transfer_id, [frame.padded_payload], None)
+    return HOReassembler.construct_anonymous_transfer(ts, frame)
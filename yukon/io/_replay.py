@@ -0,0 +1,195 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import copy
+import typing
+import asyncio
+import logging
+import dataclasses
+import pyuavcan
+from pyuavcan.transport import AlienTransfer, AlienTransferMetadata, AlienSessionSpecifier, Priority, Timestamp
+from pyuavcan.transport import TransferFrom
+from org_uavcan_yukon.io.transfer import Snoop_0_1 as DCSSnoop
+from . import session_from_dcs
+from .iface import Iface, IfaceCapture
+from .record import CaptureLog
+from ._reassembler import Reassembler, ReassemblerSettings
+from ._spoofer import Spoofer
+
+
+_logger = logging.getLogger(__name__)
+
+
+class ReplayItem(typing.NamedTuple):
+    timestamp: float
+    """
+    When the transfer was originally observed; system time in seconds.
+    """
+
+    iface_id: int
+    """
+    Which iface the transfer was captured from.
+    """
+
+    transfer: AlienTransfer
+
+
+class CaptureLogTransfers:
+    """
+    Reconstructs the transfers from the frames stored in a capture log in the order of their completion.
+    The log contains the frames of all ifaces including redundant ones, so each iface is reassembled separately.
+    """
+
+    def __init__(
+        self,
+        log: CaptureLog,
+        time_range: typing.Optional[typing.Tuple[float, float]] = None,
+        iface_id: typing.Optional[int] = None,
+        settings: ReassemblerSettings = ReassemblerSettings(),
+    ) -> None:
+        self._log = log
+        self._time_range = time_range
+        self._iface_id = iface_id
+        self._reassembler = Reassembler(settings, self._on_transfer)
+        self._completed: typing.List[ReplayItem] = []
+
+    @property
+    def n_skipped(self) -> int:
+        """
+        Transfers that could not be reconstructed: malformed frames and incomplete transfers.
+        """
+        return sum(x.n_malformed + x.n_evicted for x in self._reassembler.statistics.values())
+
+    def __iter__(self) -> typing.Iterator[ReplayItem]:
+        for rec in self._log.query(time_range=self._time_range, iface_id=self._iface_id):
+            if not self._reassembler.has_iface(rec.iface_id):
+                self._reassembler.add_iface(rec.iface_id, Iface.resolve(rec.capture.frame))
+            # The log does not keep monotonic timestamps, and the system time is monotonic enough for reassembly.
+            ts = rec.capture.timestamp.system_ns
+            self._reassembler.feed(
+                rec.iface_id,
+                rec.sequence_number,
+                IfaceCapture(Timestamp(system_ns=ts, monotonic_ns=ts), rec.capture.frame),
+            )
+            if self._completed:
+                yield from self._completed
+                self._completed.clear()
+
+    def _on_transfer(
+        self,
+        iface_id: int,
+        _seq_range: typing.Tuple[int, int],
+        spec: AlienSessionSpecifier,
+        tr: TransferFrom,
+    ) -> None:
+        meta = AlienTransferMetadata(tr.priority, tr.transfer_id, spec)
+        item = ReplayItem(tr.timestamp.system_ns * 1e-9, iface_id, AlienTransfer(meta, tr.fragmented_payload))
+        self._completed.append(item)
+
+
+def transfers_from_snoop(messages: typing.Iterable[DCSSnoop]) -> typing.Iterator[ReplayItem]:
+    """
+    Converts a stream of snooped transfers (e.g., collected by a subscriber) into replayable items.
+    """
+    for msg in messages:
+        meta = AlienTransferMetadata(Priority(msg.priority.value), int(msg.transfer_id), session_from_dcs(msg.session))
+        yield ReplayItem(
+            msg.timestamp.microsecond * 1e-6,
+            int(msg.iface_id),
+            AlienTransfer(meta, [memoryview(msg.payload.payload.tobytes())]),
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class ReplaySettings:
+    speed: float = 1.0
+    """
+    Time scaling factor: 1 reproduces the original timing, 2 is twice as fast, etc.
+    Zero disables the timing entirely; the transfers are then emitted as fast as the spoofer accepts them.
+    """
+
+    timeout: float = 1.0
+    """
+    Spoofing deadline of each transfer relative to its scheduled emission time, in seconds.
+    """
+
+    backlog_max: int = 100
+    """
+    The replay is paused while the longest spoofing queue is at least this long,
+    so that a slow iface cannot accumulate an unbounded backlog.
+    """
+
+    backlog_poll_interval: float = 0.001
+
+
+@dataclasses.dataclass
+class ReplayReport:
+    n_transfers: int = 0
+    elapsed: float = 0.0  # Since the first transfer was emitted, seconds.
+    target_rate: float = 0.0  # Transfers per second according to the recorded timing and the speed; 0 if unlimited.
+    achieved_rate: float = 0.0  # Transfers per second actually emitted.
+    jitter_mean: float = 0.0  # Mean absolute deviation from the scheduled emission time, seconds.
+    jitter_max: float = 0.0
+
+
+class Replayer:
+    """
+    Feeds previously observed transfers into the spoofer reproducing their original timing, optionally scaled.
+    Each transfer is scheduled relative to the first one, so the timing errors do not accumulate over the replay;
+    the deviations from the schedule are reported as jitter.
+    """
+
+    def __init__(self, spoofer: Spoofer, settings: ReplaySettings) -> None:
+        if settings.speed < 0:
+            raise ValueError(f"Invalid speed: {settings.speed}")
+        self._spoofer = spoofer
+        self._settings = settings
+        self._report = ReplayReport()
+
+    @property
+    def report(self) -> ReplayReport:
+        """
+        Updated while the replay is in progress.
+        """
+        return copy.copy(self._report)
+
+    async def run(self, items: typing.Iterable[ReplayItem]) -> ReplayReport:
+        loop = asyncio.get_event_loop()
+        speed = self._settings.speed
+        rep = self._report = ReplayReport()
+        jitter_sum = 0.0
+        origin: typing.Optional[typing.Tuple[float, float]] = None  # (local monotonic time, item timestamp)
+        for item in items:
+            if origin is None:
+                origin = loop.time(), item.timestamp
+            started_at, ts0 = origin
+            if speed > 0:
+                target = started_at + (item.timestamp - ts0) / speed
+                delay = target - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            while self._spoofer.backlog >= self._settings.backlog_max:
+                await asyncio.sleep(self._settings.backlog_poll_interval)
+            now = loop.time()
+            self._spoofer.push(item.transfer, now + self._settings.timeout, item.iface_id)
+
+            rep.n_transfers += 1
+            rep.elapsed = now - started_at
+            if rep.elapsed > 0:
+                rep.achieved_rate = (rep.n_transfers - 1) / rep.elapsed
+            if speed > 0:
+                jitter = abs(now - target)
+                jitter_sum += jitter
+                rep.jitter_mean = jitter_sum / rep.n_transfers
+                rep.jitter_max = max(rep.jitter_max, jitter)
+                if item.timestamp > ts0:
+                    rep.target_rate = (rep.n_transfers - 1) * speed / (item.timestamp - ts0)
+            else:
+                await asyncio.sleep(0)  # Do not starve the other tasks if the spoofer keeps up.
+        _logger.info("%s: Finished: %s", self, rep)
+        return copy.copy(rep)
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, self._settings)
@@ -0,0 +1,127 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import typing
+import asyncio
+import logging
+import collections
+import dataclasses
+import pyuavcan
+from pyuavcan.transport import AlienSessionSpecifier, TransferFrom
+from pyuavcan.presentation import Publisher
+from org_uavcan_yukon.io.transfer import Snoop_0_1 as DCSSnoop
+from org_uavcan_yukon.io.transfer import Payload_1_0 as DCSPayload, Priority_1_0 as DCSPriority
+from . import timestamp_to_dcs, session_to_dcs
+from .iface import Iface, IfaceCapture
+from ._reassembler import Reassembler, ReassemblerSettings, ReassemblerStatistics
+
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass(frozen=True)
+class SnoopSettings(ReassemblerSettings):
+    output_capacity: int = 1024
+    """
+    Reassembled transfers that could not be published because this many are already waiting are dropped.
+    """
+
+
+@dataclasses.dataclass
+class SnoopStatistics(ReassemblerStatistics):
+    n_dropped: int = 0  # Reassembled transfers lost because the publisher could not keep up.
+
+
+class Snooper:
+    """
+    Reconstructs transfers from the frames captured on all ifaces and publishes them as :class:`DCSSnoop`,
+    so that the consumers do not have to implement transfer reassembly themselves.
+
+    The frames are fed from the capture forwarding tasks on the event loop, after the capture has been published.
+    The transfers that do not fit into :class:`DCSPayload` are truncated and counted in ``n_truncated``.
+    """
+
+    def __init__(self, dcs_pub_snoop: Publisher[DCSSnoop], settings: SnoopSettings) -> None:
+        self._pub = dcs_pub_snoop
+        self._settings = settings
+        self._reassembler = Reassembler(settings, self._emit)
+        self._n_dropped: typing.Dict[int, int] = {}
+        self._shard = 0
+        self._output: typing.Deque[DCSSnoop] = collections.deque()
+        self._event_output = asyncio.Event()
+        self._task = asyncio.get_event_loop().create_task(self._task_fn())
+
+    @property
+    def statistics(self) -> typing.Dict[int, SnoopStatistics]:
+        return {
+            k: SnoopStatistics(**dataclasses.asdict(v), n_dropped=self._n_dropped[k])
+            for k, v in self._reassembler.statistics.items()
+        }
+
+    @property
+    def buffered_bytes(self) -> int:
+        return self._reassembler.buffered_bytes
+
+    def add_iface(self, iface_id: int, iface: Iface) -> None:
+        self._reassembler.add_iface(iface_id, type(iface))
+        self._n_dropped[iface_id] = 0
+
+    def remove_iface(self, iface_id: int) -> None:
+        self._reassembler.remove_iface(iface_id)
+        del self._n_dropped[iface_id]
+
+    def feed(self, iface_id: int, shard: int, sequence_number: int, cap: IfaceCapture) -> None:
+        """
+        Invoked for every captured frame. Frames of ifaces that are not registered are ignored.
+        """
+        # The shard is determined by the source node, so all frames of a transfer share it,
+        # and the transfers are emitted synchronously from the reassembler.
+        self._shard = shard
+        self._reassembler.feed(iface_id, sequence_number, cap)
+
+    def close(self) -> None:
+        self._task.cancel()
+
+    def _emit(
+        self,
+        iface_id: int,
+        seq_range: typing.Tuple[int, int],
+        spec: AlienSessionSpecifier,
+        tr: TransferFrom,
+    ) -> None:
+        if len(self._output) >= self._settings.output_capacity:
+            self._n_dropped[iface_id] += 1
+            return
+        payload = b"".join(tr.fragmented_payload)[: DCSPayload.CAPACITY_BYTES]
+        self._output.append(
+            DCSSnoop(
+                timestamp=timestamp_to_dcs(tr.timestamp),
+                iface_id=iface_id,
+                shard=self._shard,
+                frame_sequence_number_min_max=seq_range,
+                priority=DCSPriority(int(tr.priority)),
+                transfer_id=tr.transfer_id,
+                session=session_to_dcs(spec),
+                payload=DCSPayload(payload),
+            )
+        )
+        self._event_output.set()
+
+    async def _task_fn(self) -> None:
+        try:
+            while True:
+                await self._event_output.wait()
+                self._event_output.clear()
+                while self._output:
+                    msg = self._output.popleft()
+                    if not await self._pub.publish(msg):
+                        _logger.info("%s send timeout", self._pub)
+        except asyncio.CancelledError:
+            pass
+        except Exception as ex:
+            _logger.critical("Snooper has failed: %s", ex, exc_info=True)
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, self._reassembler, output=len(self._output))
@@ -0,0 +1,156 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import enum
+import heapq
+import typing
+import itertools
+import pyuavcan
+from pyuavcan.transport import AlienTransfer, Priority
+
+
+PRIORITY_LEVELS = len(Priority)
+
+
+class OverflowPolicy(enum.Enum):
+    """
+    What to do when a transfer is pushed into a full queue.
+    """
+
+    REJECT_NEW = "reject_new"
+    """
+    The new transfer is dropped.
+    """
+
+    EVICT_LOWER_PRIORITY = "evict_lower_priority"
+    """
+    The most urgent transfer of the lowest priority level that is below the priority of the new transfer is dropped;
+    that is the one closest to expiration. If there are no such transfers, the new transfer is dropped.
+    """
+
+    EVICT_EARLIEST_DEADLINE = "evict_earliest_deadline"
+    """
+    The transfer with the earliest deadline is dropped regardless of its priority; this includes the new transfer.
+    """
+
+
+_Entry = typing.Tuple[float, int, AlienTransfer, int]
+"""
+(deadline, insertion order for stable ordering, transfer, timestamp)
+"""
+
+
+class SpoofQueue:
+    """
+    A bounded scheduling queue of transfers awaiting transmission:
+    a transfer of a higher priority is always taken before any transfer of a lower priority,
+    and within the same priority level the transfers are taken in the order of their deadlines
+    (which is the order of arrival if the timeouts are equal).
+    Expired transfers are discarded when they reach the head of the queue instead of being handed to the transport.
+
+    >>> from pyuavcan.transport import AlienTransferMetadata, AlienSessionSpecifier, MessageDataSpecifier
+    >>> def mk(prio: Priority, tid: int) -> AlienTransfer:
+    ...     spec = AlienSessionSpecifier(1, None, MessageDataSpecifier(100))
+    ...     return AlienTransfer(AlienTransferMetadata(prio, tid, spec), [])
+    >>> q = SpoofQueue(3, OverflowPolicy.EVICT_LOWER_PRIORITY)
+    >>> q.push(mk(Priority.LOW, 0), 10.0) is None
+    True
+    >>> q.push(mk(Priority.LOW, 1), 5.0) is None
+    True
+    >>> q.push(mk(Priority.EXCEPTIONAL, 2), 10.0) is None
+    True
+    >>> q.push(mk(Priority.HIGH, 3), 10.0).metadata.transfer_id  # Evicts the most urgent LOW.
+    1
+    >>> q.backlog_per_priority
+    [1, 0, 0, 1, 0, 1, 0, 0]
+    >>> [q.pop(now=0.0)[0].metadata.transfer_id for _ in range(len(q))]
+    [2, 3, 0]
+    >>> q.push(mk(Priority.LOW, 4), 1.0) is None
+    True
+    >>> q.pop(now=2.0), q.n_expired, q.n_dropped
+    (None, 1, 1)
+    """
+
+    def __init__(self, capacity: int, overflow_policy: OverflowPolicy) -> None:
+        if capacity < 1:
+            raise ValueError(f"Invalid capacity: {capacity}")
+        self._capacity = int(capacity)
+        self._policy = overflow_policy
+        self._heaps: typing.List[typing.List[_Entry]] = [[] for _ in range(PRIORITY_LEVELS)]
+        self._size = 0
+        self._counter = itertools.count()
+        self.n_expired = 0
+        self.n_dropped = 0
+
+    @property
+    def backlog_per_priority(self) -> typing.List[int]:
+        """
+        Indexed by the priority level value, the highest priority first.
+        """
+        return [len(x) for x in self._heaps]
+
+    def push(
+        self, transfer: AlienTransfer, monotonic_deadline: float, timestamp: int = 0
+    ) -> typing.Optional[AlienTransfer]:
+        """
+        :param timestamp: Opaque to the queue; returned with the transfer by :meth:`pop`.
+            Used for measuring the time spent in the queue.
+        :returns: The transfer that has been dropped due to overflow (the new one or an evicted one), if any.
+        """
+        prio = int(transfer.metadata.priority)
+        entry = monotonic_deadline, next(self._counter), transfer, timestamp
+        if self._size >= self._capacity:
+            victim = self._select_victim(prio, entry)
+            if victim is None:
+                self.n_dropped += 1
+                return transfer
+            heap = self._heaps[victim]
+            evicted = heapq.heappop(heap)[2]
+            self._size -= 1
+            self.n_dropped += 1
+            self._push(prio, entry)
+            return evicted
+        self._push(prio, entry)
+        return None
+
+    def pop(self, now: float) -> typing.Optional[typing.Tuple[AlienTransfer, float, int]]:
+        """
+        :param now: The current monotonic time; the transfers whose deadlines are not in the future are discarded.
+        :returns: (transfer, deadline, timestamp) or None if there are no transfers that are still valid.
+        """
+        for heap in self._heaps:
+            while heap:
+                deadline, _, transfer, timestamp = heapq.heappop(heap)
+                self._size -= 1
+                if deadline > now:
+                    return transfer, deadline, timestamp
+                self.n_expired += 1
+        return None
+
+    def _push(self, prio: int, entry: _Entry) -> None:
+        heapq.heappush(self._heaps[prio], entry)
+        self._size += 1
+
+    def _select_victim(self, prio: int, entry: _Entry) -> typing.Optional[int]:
+        """
+        :returns: The priority level to evict the head of, or None if the new entry shall be dropped.
+        """
+        if self._policy == OverflowPolicy.EVICT_LOWER_PRIORITY:
+            for level in range(PRIORITY_LEVELS - 1, prio, -1):
+                if self._heaps[level]:
+                    return level
+        elif self._policy == OverflowPolicy.EVICT_EARLIEST_DEADLINE:
+            heads = [(h[0], level) for level, h in enumerate(self._heaps) if h]
+            head, level = min(heads)
+            return level if head < entry else None
+        return None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(
+            self, capacity=self._capacity, policy=self._policy, backlog=self.backlog_per_priority
+        )
@@ -2,21 +2,68 @@
 # This software is distributed under the terms of the MIT License.
 # Author: Pavel Kirienko <pavel@uavcan.org>
 
+from __future__ import annotations
+import time
 import typing
 import logging
 import asyncio
+import functools
 import dataclasses
-from collections import defaultdict
 import pyuavcan
 from pyuavcan.transport import AlienTransfer, AlienTransferMetadata, AlienSessionSpecifier, ResourceClosedError
-from pyuavcan.presentation import Subscriber, OutgoingTransferIDCounter
-from org_uavcan_yukon.io.transfer import Spoof_0_1 as DCSSpoof
+from pyuavcan.presentation import Subscriber, Publisher
+from org_uavcan_yukon.io.transfer import Spoof_0_1 as DCSSpoof, SpoofBatch_0_1 as DCSSpoofBatch
+from org_uavcan_yukon.io.transfer import SpoofCredit_0_1 as DCSSpoofCredit
+from org_uavcan_yukon.io.transfer import SpoofCreditEntry_0_1 as DCSSpoofCreditEntry
 from . import session_from_dcs
 from .iface import Iface
+from ._spoof_queue import SpoofQueue, OverflowPolicy, PRIORITY_LEVELS
+from ._transfer_id_map import TransferIDMap, TransferIDMapSettings, TransferIDMapStatistics
+from ._latency import LatencyHistogram, LatencySummary
 
 
 _logger = logging.getLogger(__name__)
 
+_CREDIT_PERIOD_MAX = 1.0
+
+
+@dataclasses.dataclass(frozen=True)
+class SpoofSettings:
+    queue_capacity: int = 1000
+    """
+    The maximum number of transfers awaiting transmission per iface.
+    """
+
+    overflow_policy: OverflowPolicy = OverflowPolicy.EVICT_LOWER_PRIORITY
+
+    window: int = 8
+    """
+    The maximum number of transfers being spoofed concurrently per iface.
+    Transfers of the same session are still emitted one after another in the order they are taken from the queue,
+    so the transfer-ID order on the wire is preserved.
+    """
+
+    credit_target: int = 100
+    """
+    The spoof credit of an iface is the number of transfers it can accept before its backlog reaches this value.
+    Producers that respect the credit keep the queueing latency at about this many transfers.
+    """
+
+    credit_period: float = 0.01
+    """
+    The credit is published at most this often, in seconds. This is also the worst-case delay of a credit update.
+    """
+
+    transfer_id_map: TransferIDMapSettings = TransferIDMapSettings()
+    """
+    Bounds the state kept for the transfers whose transfer-ID is assigned by the spoofer.
+    """
+
+    measure_latency: bool = True
+    """
+    Maintain the histograms of the time spent in the queue and in :meth:`Iface.spoof`.
+    """
+
 
 @dataclasses.dataclass
 class SpoofStatus:
@@ -24,104 +71,262 @@ class SpoofStatus:
     n_transfers: int = 0
     n_timeouts: int = 0
     n_errors: int = 0
+    n_expired: int = 0  # Discarded before transmission because the deadline has passed while waiting in the queue.
+    n_dropped: int = 0  # Discarded due to queue overflow.
+    n_received: int = 0  # Pushed into the queue, including those that were dropped or expired later.
     backlog: int = 0
     backlog_peak: int = 0
+    backlog_per_priority: typing.List[int] = dataclasses.field(default_factory=lambda: [0] * PRIORITY_LEVELS)
+    latency_queue: typing.Optional[LatencySummary] = None  # None if the latency is not measured.
+    latency_spoof: typing.Optional[LatencySummary] = None
 
 
 class Spoofer:
-    def __init__(self, dcs_sub_spoof: Subscriber[DCSSpoof]) -> None:
-        self._transfer_id_map: typing.DefaultDict[AlienSessionSpecifier, OutgoingTransferIDCounter] = defaultdict(
-            OutgoingTransferIDCounter
-        )
+    def __init__(
+        self,
+        dcs_sub_spoof: Subscriber[DCSSpoof],
+        settings: SpoofSettings = SpoofSettings(),
+        dcs_sub_spoof_batch: typing.Optional[Subscriber[DCSSpoofBatch]] = None,
+        dcs_pub_spoof_credit: typing.Optional[Publisher[DCSSpoofCredit]] = None,
+    ) -> None:
+        self._settings = settings
+        self._transfer_id_map = TransferIDMap(settings.transfer_id_map)
         self._inferiors: typing.Dict[int, _Inferior] = {}
         dcs_sub_spoof.receive_in_background(self._on_spoof_message)
+        if dcs_sub_spoof_batch is not None:
+            dcs_sub_spoof_batch.receive_in_background(self._on_spoof_batch_message)
+        self._credit_task: typing.Optional[asyncio.Task[None]] = None
+        if dcs_pub_spoof_credit is not None:
+            self._credit_task = asyncio.get_event_loop().create_task(self._credit_task_fn(dcs_pub_spoof_credit))
 
     @property
     def status(self) -> typing.Dict[int, SpoofStatus]:
+        """
+        The status objects are not copied; they are refreshed upon access and must not be modified by the caller.
+        """
         return {k: e.status for k, e in self._inferiors.items()}
 
+    @property
+    def credit(self) -> typing.Dict[int, int]:
+        """
+        The number of transfers each iface can accept before its backlog reaches the target.
+        """
+        return {k: max(0, self._settings.credit_target - e.backlog) for k, e in self._inferiors.items()}
+
+    @property
+    def transfer_id_map_statistics(self) -> TransferIDMapStatistics:
+        return self._transfer_id_map.statistics
+
+    @property
+    def backlog(self) -> int:
+        """
+        The number of transfers awaiting transmission in the longest queue.
+        """
+        return max((e.backlog for e in self._inferiors.values()), default=0)
+
     def add_iface(self, iface_id: int, iface: Iface) -> None:
-        self._inferiors[iface_id] = _Inferior(iface)
+        self._inferiors[iface_id] = _Inferior(iface, self._settings)
 
     def remove_iface(self, iface_id: int) -> None:
         self._inferiors.pop(iface_id).close()
 
     def close(self) -> None:
+        if self._credit_task is not None:
+            self._credit_task.cancel()
         for k in list(self._inferiors):
             self.remove_iface(k)
 
+    async def _credit_task_fn(self, pub: Publisher[DCSSpoofCredit]) -> None:
+        loop = asyncio.get_event_loop()
+        last: typing.List[typing.Tuple[int, int, int]] = []
+        last_at = loop.time()
+        try:
+            while True:
+                await asyncio.sleep(self._settings.credit_period)
+                # The received counters are included because the producers need them to release their credit.
+                state = [(k, v, self._inferiors[k].n_received) for k, v in sorted(self.credit.items())]
+                if state == last and loop.time() - last_at < _CREDIT_PERIOD_MAX:
+                    continue
+                last, last_at = state, loop.time()
+                msg = DCSSpoofCredit(iface=[DCSSpoofCreditEntry(iface_id=k, credit=v, received=r) for k, v, r in state])
+                if not await pub.publish(msg):
+                    _logger.info("%s send timeout", pub)
+        except asyncio.CancelledError:
+            pass
+        except Exception as ex:
+            _logger.critical("Spoof credit publisher has failed: %s", ex, exc_info=True)
+
     async def _on_spoof_message(self, msg: DCSSpoof, transfer: pyuavcan.transport.TransferFrom) -> None:
         _logger.debug("Spoofing %s %s over %d ifaces", transfer, msg, len(self._inferiors))
         ss = session_from_dcs(msg.session)
-
-        if msg.transfer_id.size:
-            transfer_id = int(msg.transfer_id[0])
-        else:
-            transfer_id = self._transfer_id_map[ss].get_then_increment()
-
         # noinspection PyArgumentList
         atr = AlienTransfer(
             metadata=AlienTransferMetadata(
                 priority=pyuavcan.transport.Priority(msg.priority.value),
-                transfer_id=transfer_id,
+                transfer_id=self._get_transfer_id(ss, msg.transfer_id, time.monotonic()),
                 session_specifier=ss,
             ),
             fragmented_payload=[memoryview(msg.payload.payload)],
         )
 
+        monotonic_deadline = asyncio.get_event_loop().time() + msg.timeout.second
+        self.push(atr, monotonic_deadline, int(msg.iface_id[0]) if msg.iface_id.size else None)
+
+    async def _on_spoof_batch_message(self, msg: DCSSpoofBatch, transfer: pyuavcan.transport.TransferFrom) -> None:
+        _logger.debug("Spoofing batch of %d from %s over %d ifaces", len(msg.entry), transfer, len(self._inferiors))
+        # The payloads are slices of the deserialized buffer, which in turn refers to the received transfer,
+        # so the data is not copied until it reaches the transport.
+        payload = memoryview(msg.payload)
+        offsets = [int(e.payload_offset) for e in msg.entry] + [len(payload)]
+        if any(a > b for a, b in zip(offsets, offsets[1:])):
+            _logger.error("Spoof batch from %s discarded because of invalid payload offsets: %s", transfer, offsets)
+            return
+
+        priority = pyuavcan.transport.Priority(msg.priority.value)
+        monotonic_deadline = asyncio.get_event_loop().time() + msg.timeout.second
+        iface_id = int(msg.iface_id[0]) if msg.iface_id.size else None
+        now = time.monotonic()
+        for entry, start, end in zip(msg.entry, offsets, offsets[1:]):
+            ss = session_from_dcs(entry.session)
+            # noinspection PyArgumentList
+            atr = AlienTransfer(
+                metadata=AlienTransferMetadata(
+                    priority=priority,
+                    transfer_id=self._get_transfer_id(ss, entry.transfer_id, now),
+                    session_specifier=ss,
+                ),
+                fragmented_payload=[payload[start:end]],
+            )
+            self.push(atr, monotonic_deadline, iface_id)
+
+    def _get_transfer_id(self, ss: AlienSessionSpecifier, explicit: typing.Sequence[int], now: float) -> int:
+        if len(explicit):
+            return int(explicit[0])
+        return self._transfer_id_map.get_then_increment(ss, now)
+
+    def push(self, transfer: AlienTransfer, monotonic_deadline: float, iface_id: typing.Optional[int] = None) -> None:
+        """
+        Schedules the transfer for transmission over the specified iface or over all ifaces if none is specified.
+        Unknown iface-IDs are ignored.
+        """
         inferiors: typing.Iterable[_Inferior]
-        if msg.iface_id.size:
+        if iface_id is not None:
             try:
-                inferiors = (self._inferiors[int(msg.iface_id[0])],)
+                inferiors = (self._inferiors[iface_id],)
             except LookupError:
                 inferiors = []  # No such interface -- do nothing.
         else:
             inferiors = self._inferiors.values()
-        monotonic_deadline = asyncio.get_event_loop().time() + msg.timeout.second
         for inf in inferiors:
-            inf.push(atr, monotonic_deadline)
+            inf.push(transfer, monotonic_deadline)
 
 
 class _Inferior:
-    def __init__(self, iface: Iface) -> None:
+    def __init__(self, iface: Iface, settings: SpoofSettings) -> None:
         self._status = SpoofStatus()
         self._iface = iface
-        self._queue: asyncio.Queue[typing.Tuple[AlienTransfer, float]] = asyncio.Queue()
+        self._queue = SpoofQueue(settings.queue_capacity, settings.overflow_policy)
+        self._event_pushed = asyncio.Event()
+        if settings.window < 1:
+            raise ValueError(f"Invalid window: {settings.window}")
+        self._window = asyncio.Semaphore(settings.window)
+        self._in_flight: typing.Set[asyncio.Task[None]] = set()
+        self._session_tails: typing.Dict[AlienSessionSpecifier, asyncio.Task[None]] = {}
+        self._latency_queue = LatencyHistogram() if settings.measure_latency else None
+        self._latency_spoof = LatencyHistogram() if settings.measure_latency else None
         self._task = asyncio.create_task(self._task_fn())
 
     @property
     def status(self) -> SpoofStatus:
-        from copy import copy
+        out = self._status
+        out.n_expired = self._queue.n_expired
+        out.n_dropped = self._queue.n_dropped
+        out.backlog_per_priority = self._queue.backlog_per_priority
+        if self._latency_queue is not None and self._latency_spoof is not None:
+            out.latency_queue = self._latency_queue.summarize()
+            out.latency_spoof = self._latency_spoof.summarize()
+        return out
 
-        return copy(self._status)
+    @property
+    def backlog(self) -> int:
+        return len(self._queue)
+
+    @property
+    def n_received(self) -> int:
+        return self._status.n_received
 
     def push(self, transfer: AlienTransfer, monotonic_deadline: float) -> None:
+        self._status.n_received += 1
+        dropped = self._queue.push(
+            transfer, monotonic_deadline, time.monotonic_ns() if self._latency_queue is not None else 0
+        )
+        if dropped is not None:
+            _logger.debug("Spoof queue of %s is full, dropped %s", self._iface, dropped)
         self._update_status()
-        self._queue.put_nowait((transfer, monotonic_deadline))
+        self._event_pushed.set()
 
     def close(self) -> None:
         self._task.cancel()
+        for t in self._in_flight:
+            t.cancel()
 
     def _update_status(self) -> None:
-        self._status.backlog = self._queue.qsize()
+        self._status.backlog = len(self._queue)
         self._status.backlog_peak = max(self._status.backlog_peak, self._status.backlog)
 
     async def _task_fn(self) -> None:
+        loop = asyncio.get_event_loop()
         try:
             while True:
                 self._update_status()
-                transfer, monotonic_deadline = await self._queue.get()
-                await self._do_spoof(transfer, monotonic_deadline)
+                await self._window.acquire()  # Taking from the queue as late as possible to keep the order optimal.
+                item = self._queue.pop(loop.time())
+                if item is None:
+                    self._window.release()
+                    self._event_pushed.clear()
+                    await self._event_pushed.wait()
+                    continue
+                transfer, monotonic_deadline, pushed_at = item
+                if self._latency_queue is not None:
+                    self._latency_queue.add(time.monotonic_ns() - pushed_at)
+                self._launch(transfer, monotonic_deadline)
         except asyncio.CancelledError:
             pass
-        except ResourceClosedError:
-            _logger.warning("Spoofer worker for %s is stopping because the iface is closed", self._iface)
         except Exception as ex:
             _logger.critical("Spoofer worker for %s has failed: %s", self._iface, ex, exc_info=True)
 
+    def _launch(self, transfer: AlienTransfer, monotonic_deadline: float) -> None:
+        """
+        The spoofs of the same session are chained: each one waits for the previous one to finish.
+        """
+        ss = transfer.metadata.session_specifier
+        task = asyncio.create_task(self._spoof_after(self._session_tails.get(ss), transfer, monotonic_deadline))
+        self._session_tails[ss] = task
+        self._in_flight.add(task)
+        task.add_done_callback(functools.partial(self._on_spoof_done, ss))
+
+    async def _spoof_after(
+        self, predecessor: typing.Optional[asyncio.Task[None]], transfer: AlienTransfer, monotonic_deadline: float
+    ) -> None:
+        if predecessor is not None:
+            await asyncio.wait([predecessor])  # Only the order matters, not the outcome.
+        await self._do_spoof(transfer, monotonic_deadline)
+
+    def _on_spoof_done(self, ss: AlienSessionSpecifier, task: asyncio.Task[None]) -> None:
+        self._in_flight.discard(task)
+        if self._session_tails.get(ss) is task:
+            del self._session_tails[ss]
+        self._window.release()
+        if not task.cancelled() and isinstance(task.exception(), ResourceClosedError):
+            _logger.warning("Spoofer worker for %s is stopping because the iface is closed", self._iface)
+            self.close()
+
     async def _do_spoof(self, transfer: AlienTransfer, monotonic_deadline: float) -> None:
         try:
+            started_at = time.monotonic_ns() if self._latency_spoof is not None else 0
             result = await self._iface.spoof(transfer, monotonic_deadline)
+            if self._latency_spoof is not None:
+                self._latency_spoof.add(time.monotonic_ns() - started_at)
             if result:
                 self._status.n_bytes += sum(map(len, transfer.fragmented_payload))
                 self._status.n_transfers += 1
@@ -0,0 +1,27 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+import dataclasses
+
+
+@dataclasses.dataclass
+class StartupTiming:
+    """
+    Durations of the consecutive startup stages of the worker process, in seconds.
+    """
+
+    imports: float = 0.0  # From the start of the import of the package until the entry point is invoked.
+    node: float = 0.0  # Construction of the DCS node.
+    first_heartbeat: float = 0.0  # From the construction of the node until its first heartbeat.
+    worker: float = 0.0  # Import and construction of the worker, which is done after the first heartbeat.
+
+    @property
+    def total(self) -> float:
+        return self.imports + self.node + self.first_heartbeat + self.worker
+
+    def __str__(self) -> str:
+        return (
+            f"{self.total:.3f} s total: imports {self.imports:.3f} s, node {self.node:.3f} s, "
+            f"first heartbeat {self.first_heartbeat:.3f} s, worker {self.worker:.3f} s"
+        )
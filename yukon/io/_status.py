@@ -0,0 +1,241 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import time
+import typing
+import logging
+import dataclasses
+import numpy
+import pyuavcan
+from pyuavcan.presentation import Publisher
+from org_uavcan_yukon.io import Status_0_1 as IOStatus
+from org_uavcan_yukon.io.iface import OperationalInfo_0_1 as OperationalInfo, State_0_1 as IOIfaceState
+from org_uavcan_yukon.io.iface import Status_0_1 as IOIfaceStatus, Latency_0_1 as DCSLatency
+from uavcan.primitive import Empty_1_0, String_1_0
+from .iface import IfaceStatistics
+from ._spoofer import SpoofStatus
+from ._captor import CaptureStatistics
+from ._snooper import SnoopStatistics
+from ._dedup import DedupIfaceStatistics
+from ._latency import LatencySummary
+
+
+_logger = logging.getLogger(__name__)
+
+
+_UINT16_MAX = 2 ** 16 - 1
+
+HIGH_RATE_INTERVAL = 1 / 20
+"""
+The publication interval used in the high-rate mode intended for live dashboards.
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class StatusSettings:
+    interval_min: float = 1.0
+    """
+    Changes are published at most this often, in seconds, unless the publication is forced.
+    Dashboards that need a faster update should use the high-rate mode.
+    """
+
+    interval_max: float = 10.0
+    """
+    The status is published at least this often, in seconds, even if nothing has changed.
+    Subscribers should consider the status stale if it has not been received within this interval.
+    """
+
+    @staticmethod
+    def high_rate() -> StatusSettings:
+        return StatusSettings(interval_min=HIGH_RATE_INTERVAL, interval_max=HIGH_RATE_INTERVAL)
+
+
+@dataclasses.dataclass
+class StatusStatistics:
+    n_published: int = 0
+    n_unchanged: int = 0  # Not published because nothing has changed since the last publication.
+    cpu_time: float = 0.0  # Spent on detecting changes and publishing, in seconds.
+
+
+class StatusReporter:
+    """
+    Owns the IO status message and publishes it when its contents change, subject to the interval limits.
+
+    The message and the per-iface entries are long-lived and updated in place by the owner;
+    the array of iface entries is only rebuilt when an iface is added, removed, or replaced.
+    Changes are detected by comparing the serialized representation against the last published one,
+    which is exact and costs about as much as one extra serialization.
+
+    The statistics of the reporter itself are exported in the ``status_*`` fields of the published messages only;
+    they are zero otherwise, so that they are not considered a change.
+    """
+
+    def __init__(self, pub: Publisher[IOStatus], settings: StatusSettings) -> None:
+        if not 0 < settings.interval_min <= settings.interval_max:
+            raise ValueError(f"Invalid status publication intervals: {settings}")
+        self._pub = pub
+        self._settings = settings
+        self._msg = IOStatus()
+        self._ifaces: typing.Dict[int, IOIfaceStatus] = {}
+        self._last_image = b""
+        self._last_published_at = 0.0
+        self._stats = StatusStatistics()
+
+    @property
+    def settings(self) -> StatusSettings:
+        return self._settings
+
+    @property
+    def message(self) -> IOStatus:
+        """
+        The fields that are not related to a specific iface are to be updated directly by the owner.
+        """
+        return self._msg
+
+    @property
+    def statistics(self) -> StatusStatistics:
+        return dataclasses.replace(self._stats)
+
+    def set_initializing(self, iface_id: int) -> None:
+        self._get_state(iface_id).initialization = Empty_1_0()
+
+    def set_failure(self, iface_id: int, text: str) -> None:
+        self._get_state(iface_id).failure = String_1_0(text)
+
+    def get_operational(self, iface_id: int) -> OperationalInfo:
+        """
+        Returns the operational info entry of the iface for in-place modification, switching the state if necessary.
+        """
+        state = self._get_state(iface_id)
+        if state.operational is None:
+            state.operational = OperationalInfo()
+        return state.operational
+
+    def set_lifecycle(self, iface_id: int, n_attempts: int, init_duration: float) -> None:
+        entry = self._get_entry(iface_id)
+        entry.init_attempts = min(n_attempts, _UINT16_MAX)
+        entry.init_duration = init_duration
+
+    def set_iface_status(self, status: IOIfaceStatus) -> None:
+        """
+        Replaces the entry of the iface entirely; used where the status is obtained in the DCS representation
+        (e.g., from a child process).
+        """
+        self._ifaces[int(status.iface_id)] = status
+        self._rebuild()
+
+    def remove(self, iface_id: int) -> None:
+        if self._ifaces.pop(iface_id, None) is not None:
+            self._rebuild()
+
+    async def publish(self, force: bool = False) -> bool:
+        """
+        Publishes the message if it has changed and the minimum interval has passed, if the maximum interval
+        has passed, or if forced. Returns True if the message has been published.
+        """
+        started_at = time.process_time()
+        now = time.monotonic()
+        elapsed = now - self._last_published_at
+        published = False
+        if force or elapsed >= self._settings.interval_min:
+            image = b"".join(pyuavcan.dsdl.serialize(self._msg))
+            if force or image != self._last_image or elapsed >= self._settings.interval_max:
+                self._last_image = image
+                self._last_published_at = now
+                self._stats.n_published += 1
+                published = True
+                msg = self._msg
+                msg.status_published = self._stats.n_published
+                msg.status_unchanged = self._stats.n_unchanged
+                msg.status_cpu_time = self._stats.cpu_time + (time.process_time() - started_at)
+                try:
+                    if not await self._pub.publish(msg):
+                        _logger.error("IO status publication has timed out")
+                finally:
+                    msg.status_published, msg.status_unchanged, msg.status_cpu_time = 0, 0, 0.0
+            else:
+                self._stats.n_unchanged += 1
+        self._stats.cpu_time += time.process_time() - started_at
+        return published
+
+    def _get_state(self, iface_id: int) -> IOIfaceState:
+        out = self._get_entry(iface_id).state
+        assert isinstance(out, IOIfaceState)
+        return out
+
+    def _get_entry(self, iface_id: int) -> IOIfaceStatus:
+        try:
+            return self._ifaces[iface_id]
+        except LookupError:
+            self._ifaces[iface_id] = IOIfaceStatus(iface_id=iface_id)
+            self._rebuild()
+            return self._ifaces[iface_id]
+
+    def _rebuild(self) -> None:
+        arr = numpy.empty(len(self._ifaces), object)  # Avoid the slow conversion from a list inside the setter.
+        arr[:] = [self._ifaces[k] for k in sorted(self._ifaces)]
+        self._msg.iface_status = arr
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, self._settings, self._stats)
+
+
+def update_operational_info(
+    info: OperationalInfo,
+    iface: IfaceStatistics,
+    spoof: SpoofStatus,
+    capture: CaptureStatistics,
+    snoop: SnoopStatistics,
+    dedup: typing.Optional[DedupIfaceStatistics] = None,
+) -> None:
+    """
+    Copies the statistics into the existing operational info entry.
+    The deduplication statistics are left intact if not provided.
+    """
+    info.media_frames = iface.n_frames
+    info.media_bytes = iface.n_media_layer_bytes
+    info.media_utilization_pct = (
+        iface.media_utilization_pct
+        if iface.media_utilization_pct is not None
+        else OperationalInfo.MEDIA_UTILIZATION_PCT_UNKNOWN
+    )
+    info.media_utilization_peak_pct = (
+        iface.media_utilization_peak_pct
+        if iface.media_utilization_peak_pct is not None
+        else OperationalInfo.MEDIA_UTILIZATION_PCT_UNKNOWN
+    )
+    info.errors = iface.n_errors
+    info.spoof_bytes = spoof.n_bytes
+    info.spoof_transfers = spoof.n_transfers
+    info.spoof_timeouts = spoof.n_timeouts
+    info.spoof_failures = spoof.n_errors
+    info.spoof_backlog_current = spoof.backlog
+    info.spoof_backlog_peak = spoof.backlog_peak
+    info.spoof_expired = spoof.n_expired
+    info.spoof_dropped = spoof.n_dropped
+    info.spoof_backlog_per_priority = spoof.backlog_per_priority
+    info.capture_frames = capture.n_frames
+    info.capture_dropped = capture.n_dropped
+    info.capture_batches = capture.n_batches
+    info.capture_batch_size_peak = capture.batch_size_peak
+    info.capture_filtered = iface.n_filtered
+    info.snoop_completed = snoop.n_completed
+    info.snoop_evicted = snoop.n_evicted
+    info.snoop_malformed = snoop.n_malformed
+    info.snoop_dropped = snoop.n_dropped
+    info.snoop_truncated = snoop.n_truncated
+    _update_latency(info.latency_capture_handoff, capture.latency_handoff)
+    _update_latency(info.latency_capture_publish, capture.latency_publish)
+    _update_latency(info.latency_spoof_queue, spoof.latency_queue)
+    _update_latency(info.latency_spoof, spoof.latency_spoof)
+    if dedup is not None:
+        info.dedup_first = dedup.n_first
+        info.dedup_missed = dedup.n_missed
+        _update_latency(info.dedup_skew, dedup.skew)
+
+
+def _update_latency(out: DCSLatency, summary: typing.Optional[LatencySummary]) -> None:
+    if summary is not None:
+        out.p50, out.p99, out.max = summary.p50, summary.p99, summary.max
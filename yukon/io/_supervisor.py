@@ -0,0 +1,504 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+"""
+The supervisor mode of the IO worker: the ifaces are served by dedicated child processes, one per iface,
+so that the capture and the spoofing of different ifaces are not serialized by the GIL of a single process.
+
+Each child is an ordinary :class:`yukon.io._worker.IOWorker` restricted to one iface with its own DCS node,
+so it publishes the captures and serves the spoofing requests on the same subjects as a standalone worker.
+The only difference is that the child receives its configuration from the supervisor and reports its status
+back to it instead of the DCS; both go through the standard streams of the child as length-prefixed
+serialized DSDL objects. The supervisor publishes the aggregated status on behalf of all children.
+The captures of different ifaces are not deduplicated in this mode because no process sees more than one iface.
+
+A child whose standard input is closed (e.g., because the supervisor has exited) terminates itself;
+likewise, it terminates if the heartbeats of the supervisor disappear, since the supervisor is its head node.
+"""
+
+from __future__ import annotations
+import os
+import sys
+import time
+import struct
+import typing
+import asyncio
+import logging
+import threading
+import dataclasses
+import pyuavcan
+from org_uavcan_yukon.io import Config_0_1 as IOConfig, Status_0_1 as IOStatus
+from org_uavcan_yukon.io.iface import Config_0_1 as IOIfaceConfig, State_0_1 as IOIfaceState
+from org_uavcan_yukon.io.iface import Status_0_1 as IOIfaceStatus
+from uavcan.primitive import Empty_1_0, String_1_0
+import yukon.dcs
+from ._status import StatusReporter, StatusSettings
+from ._startup import StartupTiming
+
+
+_FRAME_HEADER = struct.Struct("<I")
+_FRAME_SIZE_MAX = 1024 ** 2
+_UINT16_MAX = 2 ** 16 - 1
+
+_SUMMED_FIELDS = [
+    "record_frames",
+    "record_bytes",
+    "record_dropped",
+    "record_segments",
+    "record_errors",
+    "iface_threads_busy",
+    "iface_threads_queued",
+    "iface_init_timeouts",
+    "iface_late_closures",
+    "dedup_frames_in",
+    "dedup_frames_out",
+    "dedup_evicted",
+]
+
+_MAXED_FIELDS = [
+    "iface_close_duration_max",
+    # Every child receives the same spoofing and replay requests, so these are nearly the same in all children.
+    "spoof_sessions",
+    "spoof_sessions_evicted",
+    "spoof_sessions_expired",
+    "replay_transfers",
+    "replay_skipped",
+    "replay_target_rate",
+    "replay_achieved_rate",
+    "replay_jitter_mean",
+    "replay_jitter_max",
+]
+
+
+@dataclasses.dataclass(frozen=True)
+class SupervisorSettings:
+    child_node_ids: typing.Sequence[int]
+    """
+    The node-IDs that are assigned to the child processes; one is taken per iface and returned when it is removed.
+    An iface cannot be served while all of them are taken.
+    """
+
+    cpu_affinity: typing.Mapping[int, int] = dataclasses.field(default_factory=dict)
+    """
+    The child process serving the iface is pinned to the CPU by the iface-ID.
+    The ifaces that are not listed are not pinned. Only supported on Linux; ignored elsewhere.
+    """
+
+    restart_interval_min: float = 1.0
+    """
+    A child that has exited is restarted after this delay, which is doubled after every consecutive failure.
+    The delay is reset if the child has run for longer than :attr:`restart_interval_max`.
+    """
+
+    restart_interval_max: float = 30.0
+
+    stop_timeout: float = 5.0
+    """
+    A child that is being stopped is given this long to exit gracefully before it is killed, in seconds.
+    """
+
+
+class ChildProcess:
+    """
+    Runs a child process serving one iface and restarts it whenever it exits until closed.
+    The last configuration is delivered to every new instance of the child.
+    """
+
+    def __init__(
+        self,
+        iface_id: int,
+        argv: typing.Sequence[str],
+        env: typing.Mapping[str, str],
+        settings: SupervisorSettings,
+    ) -> None:
+        self._iface_id = int(iface_id)
+        self._argv = list(argv)
+        self._env = dict(env)
+        self._settings = settings
+        self._loop = asyncio.get_event_loop()
+        self._config: typing.Optional[IOConfig] = None
+        self._proc: typing.Optional[asyncio.subprocess.Process] = None
+        self.status: typing.Optional[IOStatus] = None
+        """
+        The last status reported by the current instance of the child; None until reported.
+        """
+        self.failure: typing.Optional[str] = None
+        """
+        Why the last instance has exited; cleared when the new instance reports its status.
+        """
+        self.n_restarts = 0
+        self._task = self._loop.create_task(self._run())
+
+    @property
+    def iface_id(self) -> int:
+        return self._iface_id
+
+    @property
+    def pid(self) -> typing.Optional[int]:
+        return self._proc.pid if self._proc is not None else None
+
+    def configure(self, cfg: IOConfig) -> None:
+        self._config = cfg
+        if self._proc is not None and self._proc.stdin is not None:
+            self._proc.stdin.write(encode_frame(cfg))
+
+    def close(self) -> None:
+        self._task.cancel()
+
+    async def _run(self) -> None:
+        retry_interval = self._settings.restart_interval_min
+        while True:
+            started_at = time.monotonic()
+            try:
+                self.failure = f"Exited with code {await self._run_once()}"
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                _logger.exception("Iface %d: Child process failure: %s", self._iface_id, ex)
+                self.failure = f"Child process failure: {type(ex).__name__}: {ex or '<description not available>'}"
+            self.status = None
+            if time.monotonic() - started_at > self._settings.restart_interval_max:
+                retry_interval = self._settings.restart_interval_min
+            _logger.warning("Iface %d: %s; restarting in %.1f s", self._iface_id, self.failure, retry_interval)
+            await asyncio.sleep(retry_interval)
+            retry_interval = min(retry_interval * 2, self._settings.restart_interval_max)
+            self.n_restarts += 1
+
+    async def _run_once(self) -> int:
+        proc = await asyncio.create_subprocess_exec(
+            *self._argv,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=self._env,
+        )
+        self._proc = proc
+        assert proc.stdin is not None and proc.stdout is not None
+        _logger.info("Iface %d: Started child process %d: %s", self._iface_id, proc.pid, self._argv)
+        try:
+            cpu = self._settings.cpu_affinity.get(self._iface_id)
+            if cpu is not None:
+                _pin(proc.pid, cpu)
+            if self._config is not None:
+                proc.stdin.write(encode_frame(self._config))
+            while True:
+                data = await _read_frame_async(proc.stdout)
+                if data is None:
+                    break
+                status = pyuavcan.dsdl.deserialize(IOStatus, [memoryview(data)])
+                if status is None:
+                    raise ValueError(f"Malformed status frame of {len(data)} bytes")
+                self.status, self.failure = status, None
+            return await proc.wait()
+        finally:
+            self._proc = None
+            self._stop(proc)
+
+    def _stop(self, proc: asyncio.subprocess.Process) -> None:
+        """
+        Closing the standard input requests the child to exit; it is killed if it does not comply in time.
+        """
+        if proc.returncode is not None:
+            return
+        if proc.stdin is not None:
+            proc.stdin.close()
+
+        def kill() -> None:
+            if proc.returncode is None:
+                _logger.warning("Iface %d: Killing child process %d", self._iface_id, proc.pid)
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+
+        self._loop.call_later(self._settings.stop_timeout, kill)
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(
+            self, iface_id=self._iface_id, pid=self.pid, failure=self.failure, n_restarts=self.n_restarts
+        )
+
+
+class IOSupervisor:
+    """
+    Has the same interface as :class:`yukon.io._worker.IOWorker` so that the entry point can run either.
+    """
+
+    def __init__(self, node: yukon.dcs.Node, startup: typing.Optional[StartupTiming] = None) -> None:
+        """
+        :param node: Taken over by the supervisor; it is closed together with the supervisor.
+        :param startup: Reported in the status if provided.
+        """
+        from pyuavcan.application import register
+
+        self._node = node
+        self._startup = startup
+        self._sub_config = self._node.make_subscriber(IOConfig, "io_config")
+        reg = self._node.registry
+        status_settings = StatusSettings(
+            interval_min=float(reg.setdefault("yukon.io.status.interval_min", register.Real32([1.0]))),
+            interval_max=float(reg.setdefault("yukon.io.status.interval_max", register.Real32([10.0]))),
+        )
+        if reg.setdefault("yukon.io.status.high_rate", register.Bit([False])):
+            status_settings = StatusSettings.high_rate()
+        self._status = StatusReporter(self._node.make_publisher(IOStatus, "io_status"), status_settings)
+        # By default, the node-IDs following the one of the supervisor are used.
+        default_node_ids = [node.id + 1 + i for i in range(IOConfig.MAX_REDUNDANCY_FACTOR)]
+        # A flat list of (iface-ID, CPU index) pairs.
+        cpu_affinity = reg.setdefault("yukon.io.supervisor.cpu_affinity", register.Natural16([])).ints
+        child_node_ids = reg.setdefault("yukon.io.supervisor.child_node_ids", register.Natural16(default_node_ids))
+        self._settings = SupervisorSettings(
+            child_node_ids=child_node_ids.ints,
+            cpu_affinity=dict(zip(cpu_affinity[::2], cpu_affinity[1::2])),
+            restart_interval_min=float(
+                reg.setdefault("yukon.io.supervisor.restart_interval_min", register.Real32([1.0]))
+            ),
+            restart_interval_max=float(
+                reg.setdefault("yukon.io.supervisor.restart_interval_max", register.Real32([30.0]))
+            ),
+            stop_timeout=float(reg.setdefault("yukon.io.supervisor.stop_timeout", register.Real32([5.0]))),
+        )
+        self._free_node_ids = list(self._settings.child_node_ids)
+        self._children: typing.Dict[int, typing.Tuple[ChildProcess, int]] = {}  # Iface-ID -> (child, node-ID).
+        self._unserved: typing.Dict[int, str] = {}  # Iface-ID -> reason.
+        _logger.info("IO supervisor settings: %s", self._settings)
+
+    async def run(self) -> int:
+        if self._startup is not None:
+            msg = self._status.message
+            msg.startup_imports = self._startup.imports
+            msg.startup_node = self._startup.node
+            msg.startup_first_heartbeat = self._startup.first_heartbeat
+            msg.startup_worker = self._startup.worker
+        while not self._node.shutdown:
+            cfg_transfer = await self._sub_config.receive_for(self._status.settings.interval_min)
+            if cfg_transfer:
+                self._reconfigure(cfg_transfer[0])
+            self._update()
+            await self._status.publish(force=cfg_transfer is not None)
+        return int(self._node.health)
+
+    def close(self) -> None:
+        for iface_id in list(self._children):
+            self._remove(iface_id)
+        self._node.close()
+
+    def _reconfigure(self, cfg: IOConfig) -> None:
+        _logger.info("Processing %s", cfg)
+        wanted: typing.Dict[int, IOIfaceConfig] = {int(x.iface_id): x for x in cfg.iface_config}
+        for iface_id in set(self._children) - set(wanted):
+            _logger.info("Terminating iface %s: %r", iface_id, self._children[iface_id][0])
+            self._remove(iface_id)
+        for iface_id in set(self._unserved) - set(wanted):
+            del self._unserved[iface_id]
+            self._status.remove(iface_id)
+
+        for iface_id, ifc in wanted.items():
+            # Like in the standalone worker, an existing iface is not reconstructed, only the filters are updated.
+            if iface_id not in self._children:
+                if not self._free_node_ids:
+                    self._unserved[iface_id] = "No node-ID is available for the child process"
+                    _logger.error("Iface %d: %s", iface_id, self._unserved[iface_id])
+                    continue
+                self._unserved.pop(iface_id, None)
+                node_id = self._free_node_ids.pop(0)
+                _logger.info("Constructing new iface in a child process with node-ID %d: %s", node_id, ifc)
+                child = ChildProcess(
+                    iface_id, self._make_child_argv(iface_id), self._make_child_env(node_id), self._settings
+                )
+                self._children[iface_id] = child, node_id
+            self._children[iface_id][0].configure(IOConfig(iface_config=[ifc], capture_filter=cfg.capture_filter))
+
+    def _remove(self, iface_id: int) -> None:
+        child, node_id = self._children.pop(iface_id)
+        child.close()
+        self._free_node_ids.append(node_id)
+        self._status.remove(iface_id)
+
+    def _make_child_argv(self, iface_id: int) -> typing.List[str]:
+        return [sys.executable, "-m", "yukon.io", "--child", str(iface_id)]
+
+    def _make_child_env(self, node_id: int) -> typing.Dict[str, str]:
+        # The other registers, including the port-IDs, are inherited, so the children use the same subjects.
+        env = dict(os.environ)
+        env["UAVCAN__NODE__ID"] = str(node_id)
+        env["YUKON__DCS__HEAD_NODE_ID"] = str(self._node.id)
+        return env
+
+    def _update(self) -> None:
+        statuses: typing.List[IOStatus] = []
+        for iface_id, (child, _) in self._children.items():
+            entry: typing.Optional[IOIfaceStatus] = None
+            if child.status is not None:
+                statuses.append(child.status)
+                entry = next((x for x in child.status.iface_status if x.iface_id == iface_id), None)
+            if entry is None:  # The child is starting or has exited.
+                entry = IOIfaceStatus(
+                    iface_id=iface_id,
+                    state=(
+                        IOIfaceState(failure=String_1_0(child.failure))
+                        if child.failure is not None
+                        else IOIfaceState(initialization=Empty_1_0())
+                    ),
+                )
+            entry.process_restarts = min(child.n_restarts, _UINT16_MAX)
+            self._status.set_iface_status(entry)
+        for iface_id, reason in self._unserved.items():
+            self._status.set_failure(iface_id, reason)
+        merge_statuses(self._status.message, statuses)
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, self._settings, children=[x for x, _ in self._children.values()])
+
+
+def merge_statuses(out: IOStatus, statuses: typing.Sequence[IOStatus]) -> None:
+    """
+    Aggregates the fields of the child statuses that are not specific to an iface into the output.
+    The counters of the independent activities of the children are summed up; the ones that are duplicated
+    across the children (e.g., the replay, which is performed by every child on its own iface) take the maximum.
+    The iface entries, the startup timing, and the statistics of the status publication are not touched.
+
+    >>> a = IOStatus(record_frames=10, replay_transfers=5, capture_filter_hits=[1, 2], iface_close_duration_max=0.5)
+    >>> b = IOStatus(record_frames=20, replay_transfers=7, capture_filter_hits=[3], replay_active=True)
+    >>> out = IOStatus(startup_node=1.0)
+    >>> merge_statuses(out, [a, b])
+    >>> out.record_frames, out.replay_transfers, out.capture_filter_hits.tolist(), out.replay_active
+    (30, 7, [4, 2], True)
+    >>> out.iface_close_duration_max, out.startup_node
+    (0.5, 1.0)
+    """
+    for name in _SUMMED_FIELDS:
+        setattr(out, name, sum(int(getattr(x, name)) for x in statuses))
+    for name in _MAXED_FIELDS:
+        setattr(out, name, max((getattr(x, name) for x in statuses), default=0))
+    out.replay_active = any(x.replay_active for x in statuses)
+    for name in ("capture_filter_hits", "capture_filter_drops"):
+        acc = [0] * max((len(getattr(x, name)) for x in statuses), default=0)
+        for x in statuses:  # The lengths differ while the new filter configuration is being applied.
+            for index, value in enumerate(getattr(x, name)):
+                acc[index] += int(value)
+        setattr(out, name, acc)
+
+
+class ChildChannel:
+    """
+    The child side of the link with the supervisor. The configuration is received from the standard input;
+    the status is published into the standard output, so the latter is redirected into the standard error
+    to prevent stray output from corrupting the stream.
+
+    The worker uses it in place of the configuration subscriber and the status publisher.
+    """
+
+    def __init__(self, iface_id: int) -> None:
+        self._iface_id = int(iface_id)
+        self._loop = asyncio.get_event_loop()
+        self._queue: asyncio.Queue[IOConfig] = asyncio.Queue()
+        self._closed = False
+        self._output = sys.stdout.buffer
+        sys.stdout = sys.stderr
+        threading.Thread(target=self._read_thread, name="io_child_input", daemon=True).start()
+
+    @property
+    def iface_id(self) -> int:
+        return self._iface_id
+
+    @property
+    def closed(self) -> bool:
+        """
+        True once the supervisor has closed the link; the child should exit then.
+        """
+        return self._closed
+
+    async def receive_for(self, timeout: float) -> typing.Optional[typing.Tuple[IOConfig, None]]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout), None
+        except asyncio.TimeoutError:
+            return None
+
+    async def publish(self, msg: IOStatus) -> bool:
+        try:
+            write_frame(self._output, msg)
+        except OSError as ex:
+            _logger.error("Could not report the status to the supervisor: %s", ex)
+            self._closed = True
+            return False
+        return True
+
+    def _read_thread(self) -> None:
+        stream = sys.stdin.buffer
+        try:
+            while True:
+                data = read_frame(stream)
+                if data is None:
+                    break
+                cfg = pyuavcan.dsdl.deserialize(IOConfig, [memoryview(data)])
+                if cfg is None:
+                    raise ValueError(f"Malformed configuration frame of {len(data)} bytes")
+                self._loop.call_soon_threadsafe(self._queue.put_nowait, cfg)
+        except Exception as ex:
+            _logger.exception("Link with the supervisor has failed: %s", ex)
+        _logger.info("Link with the supervisor is closed")
+        try:
+            self._loop.call_soon_threadsafe(setattr, self, "_closed", True)
+        except RuntimeError:  # The loop is closed, so nobody is interested anymore.
+            pass
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, iface_id=self._iface_id, closed=self._closed)
+
+
+def encode_frame(obj: pyuavcan.dsdl.CompositeObject) -> bytes:
+    """
+    >>> frame = encode_frame(IOStatus(record_frames=123))
+    >>> import io
+    >>> stream = io.BytesIO(frame + frame[:-1])
+    >>> pyuavcan.dsdl.deserialize(IOStatus, [memoryview(read_frame(stream))]).record_frames
+    123
+    >>> read_frame(stream) is None  # Truncated.
+    True
+    """
+    payload = b"".join(pyuavcan.dsdl.serialize(obj))
+    return _FRAME_HEADER.pack(len(payload)) + payload
+
+
+def write_frame(stream: typing.BinaryIO, obj: pyuavcan.dsdl.CompositeObject) -> None:
+    stream.write(encode_frame(obj))
+    stream.flush()
+
+
+def read_frame(stream: typing.BinaryIO) -> typing.Optional[bytes]:
+    """
+    Blocks until the frame is received. Returns None at the end of the stream.
+    """
+    header = stream.read(_FRAME_HEADER.size)
+    if len(header) < _FRAME_HEADER.size:
+        return None
+    (size,) = _FRAME_HEADER.unpack(header)
+    if size > _FRAME_SIZE_MAX:
+        raise ValueError(f"Frame size {size} is too large")
+    data = stream.read(size)
+    return data if len(data) == size else None
+
+
+async def _read_frame_async(stream: asyncio.StreamReader) -> typing.Optional[bytes]:
+    try:
+        (size,) = _FRAME_HEADER.unpack(await stream.readexactly(_FRAME_HEADER.size))
+        if size > _FRAME_SIZE_MAX:
+            raise ValueError(f"Frame size {size} is too large")
+        return await stream.readexactly(size)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def _pin(pid: int, cpu: int) -> None:
+    try:
+        os.sched_setaffinity(pid, {cpu})  # type: ignore
+    except AttributeError:
+        _logger.warning("CPU affinity is not supported on this platform")
+    except OSError as ex:
+        _logger.error("Could not pin process %d to CPU %d: %s", pid, cpu, ex)
+    else:
+        _logger.info("Process %d is pinned to CPU %d", pid, cpu)
+
+
+_logger = logging.getLogger(__name__)
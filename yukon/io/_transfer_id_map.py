@@ -0,0 +1,153 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import typing
+import collections
+import dataclasses
+import pyuavcan
+from pyuavcan.transport import AlienSessionSpecifier, MessageDataSpecifier, ServiceDataSpecifier
+
+
+@dataclasses.dataclass(frozen=True)
+class TransferIDMapSettings:
+    capacity: int = 65536
+    """
+    Once exceeded, the least recently used sessions are evicted, but only those that have been idle for longer
+    than the transfer-ID timeout. The map may temporarily exceed the capacity if more sessions are active at once.
+    """
+
+    transfer_id_timeout: float = 2.0
+    """
+    The transfer-ID timeout of the receivers (the default value defined by the UAVCAN Specification).
+    A session is never evicted before it has been idle for this long, because the transfer-ID counter restarts
+    from zero when the session is seen again, and a receiver would reject the new transfer as a duplicate
+    unless the transfer-ID timeout has expired since the last transfer.
+    """
+
+    idle_timeout: float = 60.0
+    """
+    Sessions that have been idle for this long are evicted regardless of the capacity. Must exceed the above.
+    """
+
+
+@dataclasses.dataclass
+class TransferIDMapStatistics:
+    size: int = 0
+    n_evicted: int = 0  # Due to the capacity limit.
+    n_expired: int = 0  # Due to the idle timeout.
+
+
+class TransferIDMap:
+    """
+    Allocates the transfer-IDs of the spoofed transfers that do not specify one explicitly.
+    The sessions are kept in LRU order (least recently used first), so the eviction candidates are always at the front.
+
+    Each session specifier is mapped onto a single integer key; the hash of an int is the int itself,
+    so there is no hashing cost beyond the construction of the key, unlike with the specifier dataclass.
+    The counters are slot objects that are updated in place, so the map is not modified on the hot path
+    except for the reordering.
+
+    >>> m = TransferIDMap(TransferIDMapSettings(capacity=1, transfer_id_timeout=2.0, idle_timeout=10.0))
+    >>> ss_a = AlienSessionSpecifier(1, None, MessageDataSpecifier(100))
+    >>> ss_b = AlienSessionSpecifier(2, None, MessageDataSpecifier(100))
+    >>> m.get_then_increment(ss_a, 0.0), m.get_then_increment(ss_a, 0.5), m.get_then_increment(ss_b, 1.0)
+    (0, 1, 0)
+    >>> m.statistics  # ss_a has not been idle for long enough to be evicted.
+    TransferIDMapStatistics(size=2, n_evicted=0, n_expired=0)
+    >>> ss_c = AlienSessionSpecifier(3, None, MessageDataSpecifier(100))
+    >>> m.get_then_increment(ss_c, 2.6), m.statistics  # Now ss_a is evicted but ss_b is still too recent.
+    (0, TransferIDMapStatistics(size=2, n_evicted=1, n_expired=0))
+    >>> m.get_then_increment(ss_a, 20.0), m.statistics  # ss_a restarts from zero; the others have expired.
+    (0, TransferIDMapStatistics(size=1, n_evicted=1, n_expired=2))
+    """
+
+    def __init__(self, settings: TransferIDMapSettings) -> None:
+        if not settings.idle_timeout > settings.transfer_id_timeout:
+            raise ValueError(f"The idle timeout shall exceed the transfer-ID timeout: {settings}")
+        self._settings = settings
+        self._slots: typing.OrderedDict[int, _Slot] = collections.OrderedDict()
+        self._n_evicted = 0
+        self._n_expired = 0
+
+    @property
+    def statistics(self) -> TransferIDMapStatistics:
+        return TransferIDMapStatistics(size=len(self._slots), n_evicted=self._n_evicted, n_expired=self._n_expired)
+
+    def get_then_increment(self, ss: AlienSessionSpecifier, now: float) -> int:
+        """
+        :param now: Monotonic time in seconds.
+        """
+        key = _make_key(ss)
+        slots = self._slots
+        slot = slots.get(key)
+        if slot is None:
+            slot = _Slot()
+            slots[key] = slot
+            slot.last_used = now
+            self._evict(now)  # The map only grows here, so this is the only place where the cleanup is needed.
+        else:
+            slots.move_to_end(key)
+            slot.last_used = now
+        out = slot.value
+        slot.value = out + 1
+        return out
+
+    def _evict(self, now: float) -> None:
+        slots = self._slots
+        capacity, tid_timeout, idle_timeout = (
+            self._settings.capacity,
+            self._settings.transfer_id_timeout,
+            self._settings.idle_timeout,
+        )
+        while slots:
+            idle = now - next(iter(slots.values())).last_used
+            if idle > idle_timeout:
+                self._n_expired += 1
+            elif idle > tid_timeout and len(slots) > capacity:
+                self._n_evicted += 1
+            else:
+                break
+            slots.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, self._settings, self.statistics)
+
+
+class _Slot:
+    __slots__ = ["value", "last_used"]
+
+    def __init__(self) -> None:
+        self.value = 0
+        self.last_used = 0.0
+
+
+_NODE_ID_BITS = 17  # Node-IDs are up to 65535 in UDP; plus one to represent None.
+_PORT_BITS = 15  # Subject-ID or service-ID plus the kind.
+_KIND_REQUEST = 1 << 13
+_KIND_RESPONSE = 1 << 14
+
+
+def _make_key(ss: AlienSessionSpecifier) -> int:
+    """
+    >>> _make_key(AlienSessionSpecifier(None, None, MessageDataSpecifier(8191))) == 8191
+    True
+    >>> req = ServiceDataSpecifier(511, ServiceDataSpecifier.Role.REQUEST)
+    >>> res = ServiceDataSpecifier(511, ServiceDataSpecifier.Role.RESPONSE)
+    >>> keys = {_make_key(AlienSessionSpecifier(s, d, ds)) for s in (0, 65535) for d in (0, 65535) for ds in (req, res)}
+    >>> len(keys)
+    8
+    """
+    ds = ss.data_specifier
+    if isinstance(ds, MessageDataSpecifier):
+        port = ds.subject_id
+    else:
+        assert isinstance(ds, ServiceDataSpecifier)
+        port = ds.service_id | (_KIND_REQUEST if ds.role == ServiceDataSpecifier.Role.REQUEST else _KIND_RESPONSE)
+    src = 0 if ss.source_node_id is None else ss.source_node_id + 1
+    dst = 0 if ss.destination_node_id is None else ss.destination_node_id + 1
+    return (((src << _NODE_ID_BITS) | dst) << _PORT_BITS) | port
@@ -3,137 +3,394 @@
 # Author: Pavel Kirienko <pavel@uavcan.org>
 
 from __future__ import annotations
+import time
 import typing
 import logging
 import asyncio
-import concurrent.futures
-from pyuavcan.presentation import Publisher
+from pathlib import Path
+import pyuavcan
+from pyuavcan.application import register
 from org_uavcan_yukon.io import Config_0_1 as IOConfig
 from org_uavcan_yukon.io import Status_0_1 as IOStatus
+from org_uavcan_yukon.io import Replay_0_1 as IOReplay
 from org_uavcan_yukon.io.iface import Config_0_1 as IOIfaceConfig
+from org_uavcan_yukon.io.iface.transport import Config_0_1 as DCSTransportConfig
 import yukon.dcs
-from ._spoofer import Spoofer, SpoofStatus, DCSSpoof
-from ._captor import DCSCapture, setup_capture_forwarding
+import yukon.filesystem
+from ._spoofer import Spoofer, SpoofSettings, SpoofStatus, DCSSpoof, DCSSpoofBatch, DCSSpoofCredit
+from ._spoof_queue import OverflowPolicy
+from ._transfer_id_map import TransferIDMapSettings
+from ._captor import DCSCapture, DCSCaptureBatch, CaptureSettings, CaptureForwarder, setup_capture_forwarding
+from ._dedup import DCSDedupCapture, DedupForwarder, DedupSettings
+from ._filter import CaptureFilter, FilterRule
+from ._snooper import DCSSnoop, SnoopSettings, SnoopStatistics, Snooper
+from ._replay import Replayer, ReplaySettings, CaptureLogTransfers
+from ._status import StatusReporter, StatusSettings, update_operational_info
+from .record import Recorder, RecorderSettings, CaptureLog
+from ._iface_manager import IfaceManager, IfaceManagerSettings
+from ._startup import StartupTiming
+from ._supervisor import ChildChannel
 from .iface import Iface
 
 
-MAX_UPDATE_PERIOD = 1.0
-"""
-An update is always published immediately after each configuration message.
-If there are no configuration messages in this amount of time, an update will be published regardless.
-"""
-
-
 class IOWorker:
-    def __init__(self) -> None:
-        self._node = yukon.dcs.Node("io")
-        self._pub_status = self._node.make_publisher(IOStatus, "io_status")
-        self._sub_config = self._node.make_subscriber(IOConfig, "io_config")
-        self._pub_capture = self._node.make_publisher(DCSCapture, "capture")
-        self._spoofer = Spoofer(self._node.make_subscriber(DCSSpoof, "spoof"))
-        self._ifaces: typing.Dict[int, typing.Union[Iface, typing.Awaitable[Iface], str]] = {}
-        self._executor = concurrent.futures.ThreadPoolExecutor(9999, thread_name_prefix="io_worker_pool")
+    def __init__(
+        self,
+        node: yukon.dcs.Node,
+        startup: typing.Optional[StartupTiming] = None,
+        channel: typing.Optional[ChildChannel] = None,
+    ) -> None:
+        """
+        :param node: Taken over by the worker; it is closed together with the worker.
+        :param startup: Reported in the status if provided.
+        :param channel: If provided, the worker is a child of the supervisor (see :mod:`yukon.io._supervisor`):
+            the configuration is received from and the status is reported to the supervisor instead of the DCS.
+        """
+        self._node = node
+        self._channel = channel
+        self._sub_config: typing.Union[pyuavcan.presentation.Subscriber[IOConfig], ChildChannel] = (
+            channel if channel is not None else self._node.make_subscriber(IOConfig, "io_config")
+        )
+        self._captors: typing.Dict[int, CaptureForwarder] = {}
+        # The configured filter is not evaluated itself; each iface evaluates its own clone in its capture thread.
+        # The configured one accumulates the counters of the ifaces that have been removed since it was applied.
+        self._capture_filter: typing.Optional[CaptureFilter] = None
+        self._iface_filters: typing.Dict[int, CaptureFilter] = {}
+        reg = self._node.registry
+        # The status is always published immediately after each configuration message.
+        status_settings = StatusSettings(
+            interval_min=float(reg.setdefault("yukon.io.status.interval_min", register.Real32([1.0]))),
+            interval_max=float(reg.setdefault("yukon.io.status.interval_max", register.Real32([10.0]))),
+        )
+        if reg.setdefault("yukon.io.status.high_rate", register.Bit([False])):
+            status_settings = StatusSettings.high_rate()
+        self._status = StatusReporter(
+            typing.cast(pyuavcan.presentation.Publisher[IOStatus], channel)
+            if channel is not None
+            else self._node.make_publisher(IOStatus, "io_status"),
+            status_settings,
+        )
+        self._startup = startup
+        # The latency histograms are cheap, but they can be disabled to squeeze the last bit of performance.
+        measure_latency = bool(reg.setdefault("yukon.io.measure_latency", register.Bit([True])))
+        # A flat list of (node-ID, shard index) pairs.
+        shard_map = reg.setdefault("yukon.io.capture.shard_map", register.Natural16([])).ints
+        self._capture_settings = CaptureSettings(
+            batch_size_max=int(reg.setdefault("yukon.io.capture.batch_size_max", register.Natural32([256]))),
+            linger_max=float(reg.setdefault("yukon.io.capture.linger_max", register.Real32([0.01]))),
+            buffer_capacity=int(reg.setdefault("yukon.io.capture.buffer_capacity", register.Natural32([65536]))),
+            shard_count=int(reg.setdefault("yukon.io.capture.shard_count", register.Natural32([1]))),
+            shard_map=dict(zip(shard_map[::2], shard_map[1::2])),
+            columnar=bool(reg.setdefault("yukon.io.capture.columnar", register.Bit([False]))),
+            measure_latency=measure_latency,
+        )
+        self._spoofer = Spoofer(
+            self._node.make_subscriber(DCSSpoof, "spoof"),
+            SpoofSettings(
+                queue_capacity=int(reg.setdefault("yukon.io.spoof.queue_capacity", register.Natural32([1000]))),
+                window=int(reg.setdefault("yukon.io.spoof.window", register.Natural16([8]))),
+                credit_target=int(reg.setdefault("yukon.io.spoof.credit_target", register.Natural32([100]))),
+                credit_period=float(reg.setdefault("yukon.io.spoof.credit_period", register.Real32([0.01]))),
+                transfer_id_map=TransferIDMapSettings(
+                    capacity=int(reg.setdefault("yukon.io.spoof.tid_map.capacity", register.Natural32([65536]))),
+                    transfer_id_timeout=float(
+                        reg.setdefault("yukon.io.spoof.tid_map.transfer_id_timeout", register.Real32([2.0]))
+                    ),
+                    idle_timeout=float(reg.setdefault("yukon.io.spoof.tid_map.idle_timeout", register.Real32([60.0]))),
+                ),
+                overflow_policy=OverflowPolicy(
+                    str(
+                        reg.setdefault(
+                            "yukon.io.spoof.overflow_policy",
+                            register.String(OverflowPolicy.EVICT_LOWER_PRIORITY.value),
+                        )
+                    )
+                ),
+                measure_latency=measure_latency,
+            ),
+            self._node.make_subscriber(DCSSpoofBatch, "spoof_batch"),
+            self._node.make_publisher(DCSSpoofCredit, "spoof_credit"),
+        )
+        # Without sharding the only subject is named "capture"; otherwise, the shards are "capture_0", "capture_1", ...
+        # The columnar format is published under "capture_batch" instead, likewise. It is opt-in so that the existing
+        # consumers of the per-frame "capture" subjects keep working by default.
+        shard_count = self._capture_settings.shard_count
+        capture_type, capture_name = (
+            (DCSCaptureBatch, "capture_batch") if self._capture_settings.columnar else (DCSCapture, "capture")
+        )
+        # With the deduplication, the captures of all ifaces are merged into one stream under "capture_dedup",
+        # which replaces the capture subjects. It is useless in the supervisor mode since a child has only one iface.
+        self._dedup: typing.Optional[DedupForwarder] = None
+        self._pub_capture: typing.List[pyuavcan.presentation.Publisher[typing.Any]] = []
+        if reg.setdefault("yukon.io.dedup.enable", register.Bit([False])):
+            self._dedup = DedupForwarder(
+                self._node.make_publisher(DCSDedupCapture, "capture_dedup"),
+                DedupSettings(
+                    window=float(reg.setdefault("yukon.io.dedup.window", register.Real32([0.05]))),
+                    capacity=int(reg.setdefault("yukon.io.dedup.capacity", register.Natural32([65536]))),
+                ),
+            )
+        else:
+            self._pub_capture = [
+                self._node.make_publisher(capture_type, f"{capture_name}_{i}" if shard_count > 1 else capture_name)
+                for i in range(shard_count)
+            ]
+        self._snooper = Snooper(
+            self._node.make_publisher(DCSSnoop, "snoop"),
+            SnoopSettings(
+                transfer_id_timeout=float(reg.setdefault("yukon.io.snoop.transfer_id_timeout", register.Real32([2.0]))),
+                session_count_max=int(reg.setdefault("yukon.io.snoop.session_count_max", register.Natural32([4096]))),
+                buffered_bytes_max=int(
+                    reg.setdefault("yukon.io.snoop.buffered_bytes_max", register.Natural32([16 * 1024 ** 2]))
+                ),
+                output_capacity=int(reg.setdefault("yukon.io.snoop.output_capacity", register.Natural32([1024]))),
+            ),
+        )
+        self._recorder: typing.Optional[Recorder] = None
+        if reg.setdefault("yukon.io.record.enable", register.Bit([False])):
+            # The children of the supervisor record their ifaces separately.
+            record_name = time.strftime("%Y%m%d-%H%M%S") + (f"-{channel.iface_id}" if channel is not None else "")
+            self._recorder = Recorder(
+                yukon.filesystem.APP_DIRS.log / "capture" / record_name,
+                RecorderSettings(
+                    segment_size_max=int(
+                        reg.setdefault("yukon.io.record.segment_size_max", register.Natural32([256 * 1024 ** 2]))
+                    ),
+                    segment_duration_max=float(
+                        reg.setdefault("yukon.io.record.segment_duration_max", register.Real32([3600.0]))
+                    ),
+                    fsync_interval=float(reg.setdefault("yukon.io.record.fsync_interval", register.Real32([1.0]))),
+                    buffer_capacity=int(
+                        reg.setdefault("yukon.io.record.buffer_capacity", register.Natural32([256 * 1024]))
+                    ),
+                ),
+            )
+            _logger.info("Recording captures into %s", self._recorder.directory)
+        observers = [self._snooper.feed] + ([self._recorder.feed] if self._recorder else [])
+        self._capture_observer = pyuavcan.util.broadcast(observers) if len(observers) > 1 else observers[0]
+        self._ifaces = IfaceManager(
+            IfaceManagerSettings(
+                thread_count=int(reg.setdefault("yukon.io.iface.thread_count", register.Natural16([4]))),
+                init_timeout={
+                    f.name: float(reg.setdefault(f"yukon.io.iface.{f.name}.init_timeout", register.Real32([10.0])))
+                    for f in pyuavcan.dsdl.get_model(DCSTransportConfig).fields_except_padding
+                },
+                retry_interval_min=float(reg.setdefault("yukon.io.iface.retry_interval_min", register.Real32([1.0]))),
+                retry_interval_max=float(reg.setdefault("yukon.io.iface.retry_interval_max", register.Real32([30.0]))),
+            ),
+            self._on_iface_ready,
+        )
+        self._replay: typing.Optional[typing.Tuple[asyncio.Task[None], Replayer, CaptureLogTransfers]] = None
+        self._node.make_subscriber(IOReplay, "replay").receive_in_background(self._on_replay_request)
 
     async def run(self) -> int:
-        while not self._node.shutdown:
-            assert set(self._ifaces.keys()) >= set(self._spoofer.status.keys()), "State divergence"
-            cfg_transfer = await self._sub_config.receive_for(MAX_UPDATE_PERIOD)
+        if self._startup is not None:  # The timing is complete once the worker is constructed.
+            msg = self._status.message
+            msg.startup_imports = self._startup.imports
+            msg.startup_node = self._startup.node
+            msg.startup_first_heartbeat = self._startup.first_heartbeat
+            msg.startup_worker = self._startup.worker
+        while not self._node.shutdown and not (self._channel is not None and self._channel.closed):
+            assert set(self._ifaces.entries.keys()) >= set(self._spoofer.status.keys()), "State divergence"
+            cfg_transfer = await self._sub_config.receive_for(self._status.settings.interval_min)
             if cfg_transfer:
                 self._reconfigure(cfg_transfer[0])
-            await self._update()
+            self._update()
+            await self._status.publish(force=cfg_transfer is not None)
         return int(self._node.health)
 
     def close(self) -> None:
+        if self._replay:
+            self._replay[0].cancel()
+        self._snooper.close()
+        self._spoofer.close()
+        if self._dedup:
+            self._dedup.close()
+        self._ifaces.close()
+        if self._recorder:
+            self._recorder.close()
         self._node.close()
 
     def _reconfigure(self, cfg: IOConfig) -> None:
         _logger.info("Processing %s", cfg)
-        to_remove = set(self._ifaces.keys())
+        rules = [FilterRule.from_dcs(x) for x in cfg.capture_filter]
+        if rules != (self._capture_filter.rules if self._capture_filter else []):  # Keep the counters if unchanged.
+            self._capture_filter = CaptureFilter(rules) if rules else None
+            _logger.info("New capture filter: %r", self._capture_filter)
+            self._iface_filters.clear()
+            for iface_id in self._captors:
+                iface = self._ifaces.entries[iface_id].iface
+                if iface is not None:
+                    self._install_capture_filter(iface_id, iface)
+
+        to_remove = set(self._ifaces.entries.keys())
         for ifc in cfg.iface_config:
             assert isinstance(ifc, IOIfaceConfig)
             try:
                 to_remove.remove(ifc.iface_id)
             except LookupError:
                 pass
-            if ifc.iface_id in self._ifaces:  # Existing -- nothing to change.
+            if ifc.iface_id in self._ifaces.entries:  # Existing -- nothing to change.
                 continue
 
             _logger.info("Constructing new iface: %s", ifc)
-            fut = asyncio.get_event_loop().run_in_executor(self._executor, _initialize_iface, self._pub_capture, ifc)
-            assert isinstance(fut, asyncio.Future)
-            self._ifaces[ifc.iface_id] = fut
+            self._ifaces.add(ifc.iface_id, ifc.config)
+            self._status.set_initializing(ifc.iface_id)
 
         for iface_id in to_remove:
-            item = self._ifaces.pop(iface_id)
-            _logger.info("Terminating iface %s: %r", iface_id, item)
+            _logger.info("Terminating iface %s: %r", iface_id, self._ifaces.entries[iface_id])
+            self._status.remove(iface_id)
             try:
                 self._spoofer.remove_iface(iface_id)
             except LookupError:
                 pass
-            if isinstance(item, Iface):
-                asyncio.get_event_loop().run_in_executor(self._executor, item.close)
-            elif isinstance(item, asyncio.Future):
-                item.cancel()  # Cancel initialization in the worker thread. This may be done after some timeout also.
-            elif isinstance(item, str):
-                pass  # Already dead, nothing else to do here.
-            else:
-                assert False
+            try:
+                self._captors.pop(iface_id).close()
+            except LookupError:
+                pass
+            self._retire_capture_filter(iface_id)
+            try:
+                self._snooper.remove_iface(iface_id)
+            except LookupError:
+                pass
+            if self._dedup:
+                try:
+                    self._dedup.remove_iface(iface_id)
+                except LookupError:
+                    pass
+            self._ifaces.remove(iface_id)  # Closes the iface or abandons its initialization.
+
+    def _on_iface_ready(self, iface_id: int, iface: Iface) -> None:
+        self._snooper.add_iface(iface_id, iface)
+        if self._dedup:
+            self._dedup.add_iface(iface_id)
+        try:
+            self._install_capture_filter(iface_id, iface)
+            self._captors[iface_id] = setup_capture_forwarding(
+                self._pub_capture,
+                iface_id,
+                iface,
+                self._capture_settings,
+                self._capture_observer,
+                self._dedup,
+            )
+            self._spoofer.add_iface(iface_id, iface)
+        except Exception:
+            self._snooper.remove_iface(iface_id)
+            if self._dedup:
+                self._dedup.remove_iface(iface_id)
+            try:
+                self._captors.pop(iface_id).close()
+            except LookupError:
+                pass
+            raise
+
+    def _install_capture_filter(self, iface_id: int, iface: Iface) -> None:
+        self._retire_capture_filter(iface_id)  # The iface may have been reinitialized.
+        flt = self._capture_filter.clone() if self._capture_filter else None
+        if flt is not None:
+            self._iface_filters[iface_id] = flt
+        iface.set_capture_filter(flt.accept if flt is not None else None)
+
+    def _retire_capture_filter(self, iface_id: int) -> None:
+        flt = self._iface_filters.pop(iface_id, None)
+        if flt is not None and self._capture_filter is not None:
+            self._capture_filter.absorb(flt)
+
+    async def _on_replay_request(self, msg: IOReplay, _meta: pyuavcan.transport.TransferFrom) -> None:
+        _logger.info("Processing %s", msg)
+        if self._replay:
+            self._replay[0].cancel()
+            self._replay = None
+        path = msg.path.value.tobytes().decode(errors="replace")
+        if not path:
+            return
+        replayer = Replayer(self._spoofer, ReplaySettings(speed=float(msg.speed), timeout=float(msg.timeout.second)))
+        # Building the index of a large log may take a while, so the log is opened in a worker thread.
+        try:
+            log = await asyncio.get_event_loop().run_in_executor(None, CaptureLog, Path(path))
+        except Exception as ex:
+            _logger.error("Cannot replay %s: %s", path, ex)
+            return
+        source = CaptureLogTransfers(
+            log,
+            time_range=(float(msg.time_range[0]), float(msg.time_range[1])) if msg.time_range.size == 2 else None,
+            iface_id=int(msg.iface_id[0]) if msg.iface_id.size else None,
+        )
 
-    async def _update(self) -> None:
-        from org_uavcan_yukon.io.iface import OperationalInfo_0_1 as OperationalInfo, State_0_1 as IOIfaceState
-        from org_uavcan_yukon.io.iface import Status_0_1 as IOIfaceStatus
-        from uavcan.primitive import Empty_1_0, String_1_0
+        async def run() -> None:
+            try:
+                await replayer.run(source)
+            except asyncio.CancelledError:
+                _logger.info("Replay of %s aborted", path)
+            except Exception as ex:
+                _logger.exception("Replay of %s has failed: %s", path, ex)
+            finally:
+                log.close()
+
+        self._replay = asyncio.get_event_loop().create_task(run()), replayer, source
 
-        msg = IOStatus()
+    def _update(self) -> None:
         spoof_status = self._spoofer.status
-        for iface_id, iface in list(self._ifaces.items()):  # Create a copy to allow mutation.
-            dcs_iface_state = IOIfaceState()
-            if isinstance(iface, asyncio.Future) and iface.done():
-                try:
-                    iface = iface.result()
-                    assert isinstance(iface, Iface)
-                    self._spoofer.add_iface(iface_id, iface)
-                except Exception as ex:
-                    iface = f"Init failed: {type(ex).__name__}: {ex or '<description not available>'}"
-
-            if isinstance(iface, Iface):
-                iface_stats = iface.sample_statistics()
-                spoof_stats = spoof_status.get(iface_id, SpoofStatus())
-                media_utilization_pct = (
-                    iface_stats.media_utilization_pct
-                    if iface_stats.media_utilization_pct is not None
-                    else OperationalInfo.MEDIA_UTILIZATION_PCT_UNKNOWN
+        snoop_stats = self._snooper.statistics
+        dedup_stats = self._dedup.iface_statistics if self._dedup else {}
+        for iface_id, entry in self._ifaces.entries.items():
+            self._status.set_lifecycle(iface_id, entry.n_attempts, entry.init_duration)
+            if entry.iface is not None:
+                update_operational_info(
+                    self._status.get_operational(iface_id),
+                    entry.iface.sample_statistics(),
+                    spoof_status.get(iface_id, SpoofStatus()),
+                    self._captors[iface_id].statistics,
+                    snoop_stats.get(iface_id, SnoopStatistics()),
+                    dedup_stats.get(iface_id),
                 )
-                dcs_iface_state.operational = OperationalInfo(
-                    media_frames=iface_stats.n_frames,
-                    media_bytes=iface_stats.n_media_layer_bytes,
-                    media_utilization_pct=media_utilization_pct,
-                    errors=iface_stats.n_errors,
-                    spoof_bytes=spoof_stats.n_bytes,
-                    spoof_transfers=spoof_stats.n_transfers,
-                    spoof_timeouts=spoof_stats.n_timeouts,
-                    spoof_failures=spoof_stats.n_errors,
-                    spoof_backlog_current=spoof_stats.backlog,
-                    spoof_backlog_peak=spoof_stats.backlog_peak,
-                )
-            elif isinstance(iface, str):
-                dcs_iface_state.failure = String_1_0(iface)
-            elif isinstance(iface, asyncio.Future):
-                dcs_iface_state.initialization = Empty_1_0()
+            elif entry.failure is not None:
+                self._status.set_failure(iface_id, entry.failure)
             else:
-                assert False
+                self._status.set_initializing(iface_id)
+
+        msg = self._status.message
+        lifecycle = self._ifaces.statistics
+        msg.iface_threads_busy = lifecycle.n_threads_busy
+        msg.iface_threads_queued = lifecycle.n_threads_queued
+        msg.iface_init_timeouts = lifecycle.n_init_timeouts
+        msg.iface_late_closures = lifecycle.n_late_closures
+        msg.iface_close_duration_max = lifecycle.close_duration_max
+
+        tid_map = self._spoofer.transfer_id_map_statistics
+        msg.spoof_sessions = tid_map.size
+        msg.spoof_sessions_evicted = tid_map.n_evicted
+        msg.spoof_sessions_expired = tid_map.n_expired
 
-            # Concatenation is ugly because we use NumPy arrays.
-            msg.iface_status = list(msg.iface_status) + [IOIfaceStatus(iface_id=iface_id, state=dcs_iface_state)]
+        filters = [self._capture_filter, *self._iface_filters.values()] if self._capture_filter else []
+        msg.capture_filter_hits = [sum(x) for x in zip(*(f.hits for f in filters))]
+        msg.capture_filter_drops = [sum(x) for x in zip(*(f.drops for f in filters))]
 
-        if not await self._pub_status.publish(msg):
-            _logger.error("IO status publication has timed out")
+        if self._dedup:
+            dedup = self._dedup.statistics
+            msg.dedup_frames_in = dedup.n_input
+            msg.dedup_frames_out = dedup.n_output
+            msg.dedup_evicted = dedup.n_evicted
 
+        if self._recorder:
+            rec = self._recorder.statistics
+            msg.record_frames = rec.n_frames
+            msg.record_bytes = rec.n_bytes
+            msg.record_dropped = rec.n_dropped
+            msg.record_segments = rec.n_segments
+            msg.record_errors = rec.n_errors
 
-def _initialize_iface(pub_capture: Publisher[DCSCapture], ifc: IOIfaceConfig) -> Iface:
-    iface = Iface.resolve(ifc.config).new(ifc.config)
-    setup_capture_forwarding(pub_capture, ifc.iface_id, iface)
-    return iface
+        if self._replay:
+            task, replayer, source = self._replay
+            report = replayer.report
+            msg.replay_active = not task.done()
+            msg.replay_transfers = report.n_transfers
+            msg.replay_skipped = source.n_skipped
+            msg.replay_target_rate = report.target_rate
+            msg.replay_achieved_rate = report.achieved_rate
+            msg.replay_jitter_mean = report.jitter_mean
+            msg.replay_jitter_max = report.jitter_max
 
 
 _logger = logging.getLogger(__name__)
@@ -3,12 +3,13 @@
 # Author: Pavel Kirienko <pavel@uavcan.org>
 
 from __future__ import annotations
-import sys
 import typing
+import importlib
 import dataclasses
 import pyuavcan
 from org_uavcan_yukon.io.frame import Frame_0_1 as DCSFrame
 from org_uavcan_yukon.io.iface.transport import Config_0_1 as DCSTransportConfig
+from ._rate import RateEstimator as RateEstimator
 
 
 class Iface:
@@ -19,9 +20,13 @@ class Iface:
 
     @staticmethod
     def resolve(selector: pyuavcan.dsdl.CompositeObject) -> typing.Type[Iface]:
-        for des in _DESCENDANTS:
-            if getattr(selector, des.TRANSPORT_NAME, None):
-                return des
+        """
+        Finds the implementation by the name of the selected field of a DCS union (e.g., the transport config
+        or the frame). The implementation is imported upon first use, see :data:`BACKENDS`.
+        """
+        for name in BACKENDS:
+            if getattr(selector, name, None):
+                return load_backend(name)
         raise TypeError(f"No matching transport for {selector}")
 
     @staticmethod
@@ -39,13 +44,28 @@ class Iface:
         """
         raise NotImplementedError
 
+    def set_capture_filter(self, predicate: typing.Optional[CapturePredicate]) -> None:
+        """
+        Installs the predicate that decides which captured frames are delivered to the capture handlers;
+        None delivers every frame. It can be replaced at any moment.
+        The predicate is invoked from the capture thread with the session specifier extracted from the header
+        of the native capture, before the DCS frame is constructed, so a rejected frame costs only the parsing
+        of its header. The session is None if the frame is not a valid UAVCAN frame or if the transport
+        does not provide framing (serial), so such frames cannot be filtered.
+        Rejected frames are counted in :attr:`IfaceStatistics.n_filtered`; they are not seen by any handler.
+        """
+        raise NotImplementedError
+
     async def spoof(self, transfer: pyuavcan.transport.AlienTransfer, monotonic_deadline: float) -> bool:
         """
         Wraps :meth:`pyuavcan.transport.Transport.spoof`.
         """
         raise NotImplementedError
 
-    def sample_statistics(self) -> IfaceStatistics:
+    def sample_statistics(self, monotonic_ns: typing.Optional[int] = None) -> IfaceStatistics:
+        """
+        :param monotonic_ns: The moment the media utilization is estimated for; the current time by default.
+        """
         raise NotImplementedError
 
     def close(self) -> None:
@@ -55,22 +75,76 @@ class Iface:
         raise NotImplementedError
 
 
-@dataclasses.dataclass(frozen=True)
-class IfaceCapture:
+CapturePredicate = typing.Callable[[typing.Optional[pyuavcan.transport.AlienSessionSpecifier]], bool]
+"""
+See :meth:`Iface.set_capture_filter`.
+"""
+
+
+class IfaceCapture(typing.NamedTuple):
+    """
+    This is constructed for every captured frame, so it is a named tuple rather than a frozen dataclass:
+    the construction of the latter is several times slower.
+    """
+
     timestamp: pyuavcan.transport.Timestamp
     frame: DCSFrame
-    # We could also provide the source node-ID for subject sharding purposes (for load balancing),
-    # but it would require us to parse and repackage the byte stream for the serial transport
-    # because it has no native framing support. May revise this later.
+
+    source_node_id: typing.Optional[int] = None
+    """
+    Used for subject sharding (load balancing), so it is extracted from the header cheaply without validation.
+    None if the frame is anonymous, not a UAVCAN frame, or if the transport has no native framing (serial),
+    because parsing and repackaging the byte stream would cost more than the sharding saves.
+    """
 
 
 @dataclasses.dataclass
 class IfaceStatistics:
     n_frames: int = 0
     n_media_layer_bytes: int = 0
-    media_utilization_pct: typing.Optional[int] = None
+    media_utilization_pct: typing.Optional[int] = None  # Mean over the estimation window; None if unknown.
+    media_utilization_peak_pct: typing.Optional[int] = None  # The highest short-term value within the window.
     n_errors: int = 0
+    n_filtered: int = 0  # Captured frames rejected by the capture filter; see Iface.set_capture_filter().
 
 
-pyuavcan.util.import_submodules(sys.modules[__name__])
-_DESCENDANTS = list(pyuavcan.util.iter_descendants(Iface))
+BACKENDS: typing.Dict[str, str] = {
+    "can": f"{__name__}.can",
+    "serial": f"{__name__}.serial",
+    "udp": f"{__name__}.udp",
+}
+"""
+Maps :attr:`Iface.TRANSPORT_NAME` to the module that contains the implementation.
+The backends are not imported until a config selects them because they pull in the transports and their drivers,
+which would slow down the startup of the worker processes for no benefit.
+"""
+
+_loaded: typing.Dict[str, typing.Type[Iface]] = {}
+
+
+def load_backend(transport_name: str) -> typing.Type[Iface]:
+    """
+    Imports the backend if it has not been imported yet. Raises :class:`TypeError` if it is not registered.
+
+    >>> load_backend("udp").TRANSPORT_NAME
+    'udp'
+    >>> load_backend("udp") is load_backend("udp")
+    True
+    >>> load_backend("carrier_pigeon")
+    Traceback (most recent call last):
+    ...
+    TypeError: Unknown transport: 'carrier_pigeon'
+    """
+    try:
+        return _loaded[transport_name]
+    except LookupError:
+        pass
+    try:
+        module = importlib.import_module(BACKENDS[transport_name])
+    except LookupError:
+        raise TypeError(f"Unknown transport: {transport_name!r}") from None
+    for des in pyuavcan.util.iter_descendants(Iface):
+        if des.__module__ == module.__name__ and getattr(des, "TRANSPORT_NAME", None) == transport_name:
+            _loaded[transport_name] = des
+            return des
+    raise TypeError(f"Module {module.__name__} does not implement transport {transport_name!r}")
@@ -0,0 +1,101 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import typing
+
+
+class RateEstimator:
+    """
+    Sliding-window estimate of the rate of some quantity (bits, bus busy time, etc.) and of its peak over the window,
+    intended for computing the media utilization in the iface implementations.
+
+    The window is split into equal buckets. The hot path only adds the amount to the current bucket,
+    so the cost per event is constant and no per-event timestamps are retained.
+    The incomplete current bucket is not included into the estimate, so it lags by up to one bucket.
+
+    The amounts may be added from one thread (e.g., the sniffer) while the estimate is sampled from another one;
+    a concurrent sample may then be slightly off, which is acceptable for an estimate.
+
+    Feed 100 units every 10 ms for half a second; the window is one second long:
+
+    >>> est = RateEstimator(capacity=20_000.0, window=1.0, bucket_count=10)
+    >>> for i in range(50):
+    ...     est.add(100, i * 10_000_000)
+    >>> est.sample(500_000_000)  # Five complete buckets of 1000 units each.
+    (5000.0, 10000.0)
+    >>> est.sample_utilization_pct(500_000_000)
+    (25, 50)
+    >>> est.sample(1_200_000_000)  # Two seconds later, the first two buckets have left the window.
+    (3000.0, 10000.0)
+    >>> est.sample(1_500_000_000)
+    (0.0, 0.0)
+    >>> RateEstimator(capacity=None).sample_utilization_pct(0)
+    (None, None)
+    """
+
+    def __init__(self, capacity: typing.Optional[float], window: float = 1.0, bucket_count: int = 10) -> None:
+        """
+        :param capacity: The maximum rate of the medium in the same units (per second) as the amounts,
+            used for computing the utilization. None or non-positive if unknown.
+        :param window: The duration of the estimation window, in seconds.
+        :param bucket_count: The number of buckets in the window. The peak rate is estimated over one bucket.
+        """
+        if window <= 0 or bucket_count < 1:
+            raise ValueError(f"Invalid rate estimation window: {window} s, {bucket_count} buckets")
+        self._capacity = capacity if capacity is not None and capacity > 0 else None
+        self._bucket_ns = max(1, round(window * 1e9 / bucket_count))
+        self._bucket_duration = self._bucket_ns * 1e-9
+        # Each slot holds the sum of a completed bucket and its absolute index (monotonic time over bucket duration).
+        self._sums = [0.0] * bucket_count
+        self._indexes = [-1] * bucket_count
+        self._index = 0
+        self._sum = 0.0
+
+    @property
+    def capacity(self) -> typing.Optional[float]:
+        return self._capacity
+
+    def add(self, amount: float, monotonic_ns: int) -> None:
+        index = monotonic_ns // self._bucket_ns
+        if index > self._index:
+            slot = self._index % len(self._sums)
+            self._sums[slot], self._indexes[slot] = self._sum, self._index
+            self._index, self._sum = index, 0.0
+        # A timestamp that is slightly out of order (e.g., from another capture source) goes into the current bucket.
+        self._sum += amount
+
+    def sample(self, monotonic_ns: int) -> typing.Tuple[float, float]:
+        """
+        :returns: (mean rate over the window, peak rate over one bucket of the window), in units per second.
+        """
+        current = monotonic_ns // self._bucket_ns
+        lo = current - len(self._sums)
+        total, peak = 0.0, 0.0
+        # The latest bucket stays in the fields until the next addition, so it is checked separately.
+        # The stale slot it is going to be stored into is then older than the window, so nothing is counted twice.
+        for index, value in zip(self._indexes + [self._index], self._sums + [self._sum]):
+            if lo <= index < current:
+                total += value
+                peak = max(peak, value)
+        return total / (self._bucket_duration * len(self._sums)), peak / self._bucket_duration
+
+    def sample_utilization_pct(self, monotonic_ns: int) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+        """
+        :returns: The mean and peak rates relative to the capacity, in percent; None if the capacity is unknown.
+        """
+        if self._capacity is None:
+            return None, None
+        mean, peak = self.sample(monotonic_ns)
+        return _to_pct(mean / self._capacity), _to_pct(peak / self._capacity)
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(capacity={self._capacity}, "
+            f"window={self._bucket_duration * len(self._sums)}, bucket_count={len(self._sums)})"
+        )
+
+
+def _to_pct(x: float) -> int:
+    return round(min(1.0, x) * 100)
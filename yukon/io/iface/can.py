@@ -0,0 +1,234 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import copy
+import time
+import typing
+import logging
+import pyuavcan.transport.can
+from pyuavcan.transport import AlienSessionSpecifier
+from pyuavcan.transport.can.media import Media, FrameFormat, DataFrame
+import uavcan.metatransport.can
+from uavcan.metatransport.can import ArbitrationID_0_1 as ArbitrationID
+from org_uavcan_yukon.io.iface.transport import CAN_0_1 as DCSCANConfig
+from . import Iface, DCSFrame, DCSTransportConfig, IfaceCapture, IfaceStatistics, RateEstimator, CapturePredicate
+
+
+_logger = logging.getLogger(__name__)
+
+_ARBITRATION_ID_CACHE_CAPACITY = 4096
+"""
+UAVCAN/CAN uses a limited set of CAN IDs in practice so the cache hit rate is high.
+The limit protects against unbounded growth if the bus is flooded with random identifiers.
+"""
+
+
+class CANIface(Iface):
+    TRANSPORT_NAME = "can"
+
+    def __init__(self, transport: pyuavcan.transport.can.CANTransport, bitrate: typing.Tuple[int, int]) -> None:
+        """
+        :param bitrate: (arbitration, data); for Classic CAN the data bit rate equals the arbitration bit rate.
+        """
+        self._transport = transport
+        self._fd = transport.protocol_parameters.mtu > min(Media.VALID_MTU_SET)
+        self._capture_handlers: typing.List[typing.Callable[[IfaceCapture], None]] = []
+        self._capture_broadcast: typing.Callable[[IfaceCapture], object] = pyuavcan.util.broadcast([])
+        self._stats = IfaceStatistics()
+        self._capture_filter: typing.Optional[CapturePredicate] = None
+        self._arbitration_id_cache: typing.Dict[FrameFormat, typing.Dict[int, _ArbitrationIDCacheEntry]] = {
+            fmt: {} for fmt in FrameFormat
+        }
+        # The time it takes to transmit a frame is tabulated for every data length to keep the hot path cheap.
+        self._frame_duration = {
+            fmt: [_compute_frame_duration(fmt, size, bitrate, self._fd) for size in range(max(Media.VALID_MTU_SET) + 1)]
+            for fmt in FrameFormat
+        }
+        # The amount is the bus busy time, so the capacity is one second per second.
+        self._busy_time = RateEstimator(capacity=1.0)
+
+    @staticmethod
+    def new(cfg: DCSTransportConfig) -> CANIface:
+        can_cfg = cfg.can
+        assert can_cfg
+        bitrate_arbitration = int(can_cfg.bitrate_arbitration)
+        bitrate_data = int(can_cfg.bitrate_data) or bitrate_arbitration
+        media = _construct_media(can_cfg)
+        tr = pyuavcan.transport.can.CANTransport(media, local_node_id=None)
+        return CANIface(tr, (bitrate_arbitration, bitrate_data))
+
+    @staticmethod
+    def capture_from_dcs(ts: pyuavcan.transport.Timestamp, fr: DCSFrame) -> pyuavcan.transport.Capture:
+        can_frame = fr.can
+        assert can_frame
+        data_frame = can_frame.data_classic or can_frame.data_fd
+        if not data_frame:
+            raise ValueError(f"Unsupported frame kind: {can_frame}")
+
+        arb_id = data_frame.arbitration_id
+        if arb_id.extended:
+            fmt, identifier = FrameFormat.EXTENDED, arb_id.extended.value
+        elif arb_id.base:
+            fmt, identifier = FrameFormat.BASE, arb_id.base.value
+        else:
+            assert False
+
+        return pyuavcan.transport.can.CANCapture(
+            timestamp=ts,
+            frame=DataFrame(fmt, int(identifier), bytearray(data_frame.data.tobytes())),
+            own=False,
+        )
+
+    def begin_capture(self, handler: typing.Callable[[IfaceCapture], None]) -> None:
+        if not self._capture_handlers:
+            self._transport.begin_capture(self._process_capture)
+        self._capture_handlers.append(handler)
+        if len(self._capture_handlers) == 1:
+            self._capture_broadcast = handler
+        else:
+            self._capture_broadcast = pyuavcan.util.broadcast(list(self._capture_handlers))
+
+    def set_capture_filter(self, predicate: typing.Optional[CapturePredicate]) -> None:
+        self._capture_filter = predicate
+
+    async def spoof(self, transfer: pyuavcan.transport.AlienTransfer, monotonic_deadline: float) -> bool:
+        return await self._transport.spoof(transfer, monotonic_deadline)
+
+    def sample_statistics(self, monotonic_ns: typing.Optional[int] = None) -> IfaceStatistics:
+        util, peak = self._busy_time.sample_utilization_pct(
+            monotonic_ns if monotonic_ns is not None else time.monotonic_ns()
+        )
+        self._stats.media_utilization_pct, self._stats.media_utilization_peak_pct = util, peak
+        self._stats.n_errors = self._transport.sample_statistics().in_frames_errored
+        return copy.copy(self._stats)
+
+    def close(self) -> None:
+        self._transport.close()
+
+    def _process_capture(self, cap: pyuavcan.transport.Capture) -> None:
+        """
+        Invoked for every frame on the bus, so the conversion avoids anything that is not strictly necessary.
+        The media layer delivers frames in batches; the transport invokes this handler for each frame of the batch.
+        """
+        assert isinstance(cap, pyuavcan.transport.can.CANCapture)
+        fr = cap.frame
+        data = fr.data
+        fmt = fr.format
+        try:
+            arb_id, source_node_id, session = self._arbitration_id_cache[fmt][fr.identifier]
+        except LookupError:
+            arb_id, source_node_id, session = self._make_arbitration_id(fmt, fr.identifier)
+
+        stats = self._stats
+        stats.n_frames += 1
+        stats.n_media_layer_bytes += len(data)
+        self._busy_time.add(self._frame_duration[fmt][len(data)], cap.timestamp.monotonic_ns)
+
+        flt = self._capture_filter
+        if flt is not None and not flt(session):
+            stats.n_filtered += 1
+            return
+
+        if self._fd:
+            dcs = DCSFrame(can=uavcan.metatransport.can.Frame_0_2(data_fd=_DataFD(arb_id, data)))
+        else:
+            dcs = DCSFrame(can=uavcan.metatransport.can.Frame_0_2(data_classic=_DataClassic(arb_id, data)))
+
+        iface_cap = IfaceCapture(cap.timestamp, dcs, source_node_id)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("%s: Captured %r", self, iface_cap)
+        self._capture_broadcast(iface_cap)
+
+    def _make_arbitration_id(self, fmt: FrameFormat, identifier: int) -> _ArbitrationIDCacheEntry:
+        """
+        The source node-ID and the session are cached along with the arbitration ID
+        because they are also defined by the CAN ID.
+        """
+        session: typing.Optional[AlienSessionSpecifier] = None
+        if fmt == FrameFormat.EXTENDED:  # UAVCAN/CAN uses only extended identifiers.
+            arb_id = ArbitrationID(extended=uavcan.metatransport.can.ExtendedArbitrationID_0_1(identifier))
+            # The session is defined by the CAN ID alone, so it is parsed from a probe frame that carries
+            # a valid single-frame tail byte; this way the result does not depend on the payload of the actual frame.
+            probe = pyuavcan.transport.can.CANCapture(
+                _ZERO_TIMESTAMP, DataFrame(FrameFormat.EXTENDED, identifier, bytearray(_PROBE_TAIL)), own=False
+            )
+            parsed = probe.parse()
+            if parsed is not None:
+                session = parsed[0]
+        else:
+            arb_id = ArbitrationID(base=uavcan.metatransport.can.BaseArbitrationID_0_1(identifier))
+        out = arb_id, (session.source_node_id if session is not None else None), session
+        cache = self._arbitration_id_cache[fmt]
+        if len(cache) >= _ARBITRATION_ID_CACHE_CAPACITY:
+            cache.clear()
+        cache[identifier] = out
+        return out
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, self._transport)
+
+
+_ZERO_TIMESTAMP = pyuavcan.transport.Timestamp(0, 0)
+_PROBE_TAIL = b"\xE0"  # Start of transfer, end of transfer, toggle bit set, transfer-ID zero.
+
+_ArbitrationIDCacheEntry = typing.Tuple[ArbitrationID, typing.Optional[int], typing.Optional[AlienSessionSpecifier]]
+
+_DataClassic = uavcan.metatransport.can.DataClassic_0_1
+_DataFD = uavcan.metatransport.can.DataFD_0_1
+
+
+def _construct_media(cfg: DCSCANConfig) -> Media:
+    iface_name = cfg.iface_name.value.tobytes().decode()
+    bitrate_arbitration = int(cfg.bitrate_arbitration)
+    bitrate_data = int(cfg.bitrate_data)
+    bitrate: typing.Union[int, typing.Tuple[int, int]]
+    if bitrate_data:
+        bitrate, mtu = (bitrate_arbitration, bitrate_data), max(Media.VALID_MTU_SET)
+    else:
+        bitrate, mtu = bitrate_arbitration, min(Media.VALID_MTU_SET)
+
+    if cfg.driver == DCSCANConfig.DRIVER_SOCKETCAN:
+        from pyuavcan.transport.can.media.socketcan import SocketCANMedia
+
+        return SocketCANMedia(iface_name, mtu)
+
+    from pyuavcan.transport.can.media.pythoncan import PythonCANMedia
+
+    try:
+        prefix = {
+            DCSCANConfig.DRIVER_NULL: "virtual",
+            DCSCANConfig.DRIVER_SLCAN: "slcan",
+            DCSCANConfig.DRIVER_PCAN: "pcan",
+            DCSCANConfig.DRIVER_KVASER: "kvaser",
+        }[cfg.driver]
+    except LookupError:
+        raise ValueError(f"Unsupported CAN driver: {cfg.driver}") from None
+    if cfg.driver == DCSCANConfig.DRIVER_NULL:
+        iface_name = ""  # The virtual bus is shared by all NULL ifaces in this process.
+    return PythonCANMedia(f"{prefix}:{iface_name}", bitrate, mtu)
+
+
+def _compute_frame_duration(fmt: FrameFormat, size: int, bitrate: typing.Tuple[int, int], fd: bool) -> float:
+    """
+    Estimates the time it takes to transmit a data frame, bit stuffing excluded.
+    In CAN FD, the data phase (from BRS to the CRC delimiter) is transmitted at the data bit rate.
+
+    >>> round(_compute_frame_duration(FrameFormat.EXTENDED, 8, (1_000_000, 1_000_000), False) * 1e6)
+    131
+    >>> round(_compute_frame_duration(FrameFormat.BASE, 0, (1_000_000, 1_000_000), False) * 1e6)
+    47
+    >>> round(_compute_frame_duration(FrameFormat.EXTENDED, 64, (1_000_000, 5_000_000), True) * 1e6)
+    157
+    """
+    ext = fmt == FrameFormat.EXTENDED
+    arbitration_rate, data_rate = bitrate
+    tail = 1 + 2 + 7 + 3  # CRC delimiter, ACK, EOF, IFS.
+    if not fd:
+        head = 1 + 11 + 1 + 1 + 1 + 4 + (20 if ext else 0)  # SOF, ID, RTR/SRR, IDE, r0, DLC (+ ID ext, RTR, r1).
+        return (head + 8 * size + 15 + tail) / arbitration_rate
+    head = 1 + 11 + 1 + 1 + 1 + 1 + (19 if ext else 0)  # SOF, ID, RRS/SRR, IDE, FDF, res (+ ID ext, RRS).
+    crc = 17 if size <= 16 else 21
+    data_phase = 1 + 1 + 4 + 8 * size + 4 + crc  # BRS, ESI, DLC, data, stuff count, CRC.
+    return (head + tail) / arbitration_rate + data_phase / data_rate
@@ -0,0 +1,220 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import copy
+import time
+import typing
+import logging
+import threading
+import numpy
+import serial
+import pyuavcan.transport.serial
+from uavcan.metatransport.serial import Fragment_0_2 as Fragment
+from . import Iface, DCSFrame, DCSTransportConfig, IfaceCapture, IfaceStatistics, RateEstimator, CapturePredicate
+
+
+_logger = logging.getLogger(__name__)
+
+_LOOPBACK_PORT_NAME = "loop://"
+
+_BITS_PER_BYTE = 10
+"""
+8N1: start bit, eight data bits, stop bit.
+"""
+
+
+class SerialIface(Iface):
+    """
+    UAVCAN/serial has no native framing, so instead of relying on the per-frame capture provided by the transport,
+    this implementation intercepts the raw byte stream at the port level using :class:`_CapturingPortMixin`.
+    Every chunk read from the port is reported as a sequence of fragments (as many as needed to fit the fragment
+    capacity) in one go, which costs the same regardless of how many frames the chunk contains.
+    The reader thread of the transport reads everything that is waiting in the OS buffer at once,
+    so the chunks grow with the data rate, keeping the per-chunk overhead amortized at multi-megabaud rates.
+
+    Frames emitted by the local transport (spoofed) are captured on write unless the port is a loopback,
+    in which case they are captured when read back.
+    """
+
+    TRANSPORT_NAME = "serial"
+
+    def __init__(
+        self,
+        port: serial.SerialBase,
+        transport_factory: typing.Callable[[serial.SerialBase], pyuavcan.transport.serial.SerialTransport],
+    ) -> None:
+        """
+        :param port: Shall be constructed by :func:`_open_capturing_port`.
+        """
+        if not isinstance(port, _CapturingPortMixin):
+            raise TypeError(f"The port shall be constructed by _open_capturing_port(), got {type(port).__name__}")
+        self._port = port
+        self._loopback = str(port.port).startswith(_LOOPBACK_PORT_NAME)
+        self._capture_handlers: typing.List[typing.Callable[[IfaceCapture], None]] = []
+        self._capture_broadcast: typing.Callable[[IfaceCapture], object] = pyuavcan.util.broadcast([])
+        self._capture_lock = threading.Lock()  # Captures are emitted from the reader thread and the writer executor.
+        self._stats = IfaceStatistics()
+        # The utilization of a loopback is undefined. Baud rates are in symbols per second, so the bits include framing.
+        self._bits = RateEstimator(capacity=None if self._loopback else port.baudrate)
+
+        port.capture_sink = self._on_port_data  # Before the transport starts using the port.
+        self._transport = transport_factory(port)
+
+    @staticmethod
+    def new(cfg: DCSTransportConfig) -> SerialIface:
+        ser_cfg = cfg.serial
+        assert ser_cfg
+        port_name = ser_cfg.port_name.value.tobytes().decode() or _LOOPBACK_PORT_NAME
+        baudrate = int(ser_cfg.baudrate) or None
+        port = _open_capturing_port(port_name)
+        if baudrate is not None:
+            port.baudrate = baudrate
+
+        def construct_transport(p: serial.SerialBase) -> pyuavcan.transport.serial.SerialTransport:
+            return pyuavcan.transport.serial.SerialTransport(
+                p,
+                local_node_id=None,
+                service_transfer_multiplier=2 if ser_cfg.duplicate_service_transfers else 1,
+            )
+
+        try:
+            return SerialIface(port, construct_transport)
+        except Exception:
+            port.close()
+            raise
+
+    @staticmethod
+    def capture_from_dcs(ts: pyuavcan.transport.Timestamp, fr: DCSFrame) -> pyuavcan.transport.Capture:
+        ser_frame = fr.serial
+        assert ser_frame
+        return pyuavcan.transport.serial.SerialCapture(ts, memoryview(ser_frame.data.tobytes()), own=False)
+
+    def begin_capture(self, handler: typing.Callable[[IfaceCapture], None]) -> None:
+        with self._capture_lock:
+            self._capture_handlers.append(handler)
+            if len(self._capture_handlers) == 1:
+                self._capture_broadcast = handler
+            else:
+                self._capture_broadcast = pyuavcan.util.broadcast(list(self._capture_handlers))
+
+    def set_capture_filter(self, predicate: typing.Optional[CapturePredicate]) -> None:
+        """
+        The captured fragments are pieces of the byte stream that are not aligned with the frames,
+        so the session is never known and every fragment is accepted. The predicate is not used.
+        """
+
+    async def spoof(self, transfer: pyuavcan.transport.AlienTransfer, monotonic_deadline: float) -> bool:
+        return await self._transport.spoof(transfer, monotonic_deadline)
+
+    def sample_statistics(self, monotonic_ns: typing.Optional[int] = None) -> IfaceStatistics:
+        tr_stats = self._transport.sample_statistics()
+        assert isinstance(tr_stats, pyuavcan.transport.serial.SerialTransportStatistics)
+        self._stats.n_frames = tr_stats.in_frames + tr_stats.out_frames
+        self._stats.n_errors = tr_stats.out_incomplete
+        util, peak = self._bits.sample_utilization_pct(
+            monotonic_ns if monotonic_ns is not None else time.monotonic_ns()
+        )
+        self._stats.media_utilization_pct, self._stats.media_utilization_peak_pct = util, peak
+        return copy.copy(self._stats)
+
+    def close(self) -> None:
+        self._transport.close()
+
+    def _on_port_data(self, ts: pyuavcan.transport.Timestamp, chunk: bytes, tx: bool) -> None:
+        if not (tx and self._loopback):  # The loopback reads back everything that is written.
+            self._emit(ts, chunk)
+
+    def _emit(self, ts: pyuavcan.transport.Timestamp, chunk: bytes) -> None:
+        buf = numpy.frombuffer(chunk, dtype=numpy.uint8)
+        with self._capture_lock:
+            self._stats.n_media_layer_bytes += len(buf)
+            self._bits.add(len(buf) * _BITS_PER_BYTE, ts.monotonic_ns)
+            if not self._capture_handlers:
+                return
+            for offset in range(0, len(buf), Fragment.CAPACITY_BYTES):
+                iface_cap = IfaceCapture(ts, DCSFrame(serial=Fragment(buf[offset : offset + Fragment.CAPACITY_BYTES])))
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("%s: Captured %r", self, iface_cap)
+                self._capture_broadcast(iface_cap)
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, self._transport)
+
+
+_PortDataSink = typing.Callable[[pyuavcan.transport.Timestamp, bytes, bool], None]
+"""
+Accepts (timestamp, chunk, transmitted); see :class:`_CapturingPortMixin`.
+"""
+
+
+class _CapturingPortMixin:
+    """
+    Extends a PySerial port class such that the data passing through the port is reported to the
+    :attr:`capture_sink` in addition to being returned to the caller.
+    The transport requires an instance of :class:`serial.SerialBase`, so the port cannot be wrapped in a proxy;
+    instead, the port is instantiated from a subclass of its own class that has this mixin in front,
+    so the interception is transparent to the transport. Use :func:`_open_capturing_port` to construct one.
+
+    - :meth:`read` is invoked from the reader thread of the transport.
+      If the requested amount has been read, more data may have arrived while the thread was blocked;
+      it is appended to the chunk to avoid splitting the stream into tiny pieces.
+
+    - :meth:`write` is invoked from the writer executor of the transport.
+      The data is a view of the reused serialization buffer, so it is copied before being reported.
+    """
+
+    capture_sink: typing.Optional[_PortDataSink] = None
+
+    def read(self, size: int = 1) -> bytes:
+        chunk: bytes = super().read(size)  # type: ignore
+        if chunk and len(chunk) == size:
+            waiting = self.in_waiting  # type: ignore
+            if waiting > 0:
+                chunk += super().read(waiting)  # type: ignore
+        sink = self.capture_sink
+        if chunk and sink is not None:
+            sink(pyuavcan.transport.Timestamp.now(), chunk, False)
+        return chunk
+
+    def write(self, data: typing.Union[bytes, bytearray, memoryview]) -> typing.Optional[int]:
+        out: typing.Optional[int] = super().write(data)  # type: ignore
+        sink = self.capture_sink
+        if sink is not None:
+            sink(pyuavcan.transport.Timestamp.now(), bytes(data[:out] if out is not None else data), True)
+        return out
+
+
+def _open_capturing_port(url: str) -> serial.SerialBase:
+    """
+    Like :func:`serial.serial_for_url` but the port class is extended with :class:`_CapturingPortMixin`.
+    The port is opened.
+
+    >>> port = _open_capturing_port(_LOOPBACK_PORT_NAME)
+    >>> isinstance(port, _CapturingPortMixin), isinstance(port, serial.SerialBase), port.is_open
+    (True, True, True)
+    >>> chunks = []
+    >>> port.capture_sink = lambda _ts, chunk, tx: chunks.append((chunk, tx))
+    >>> port.write(b"abc")
+    3
+    >>> port.read(3)
+    b'abc'
+    >>> chunks
+    [(b'abc', True), (b'abc', False)]
+    >>> port.close()
+    """
+    base = type(serial.serial_for_url(url, do_not_open=True))
+    try:
+        port_type = _CAPTURING_PORT_TYPES[base]
+    except LookupError:
+        port_type = type(f"Capturing{base.__name__}", (_CapturingPortMixin, base), {})
+        _CAPTURING_PORT_TYPES[base] = port_type
+    port = port_type(None)
+    port.port = url  # This is how serial_for_url() does it: the URL is parsed by the port class when it is set.
+    port.open()
+    return typing.cast(serial.SerialBase, port)
+
+
+_CAPTURING_PORT_TYPES: typing.Dict[type, type] = {}
+
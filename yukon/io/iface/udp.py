@@ -3,39 +3,81 @@
 # Author: Pavel Kirienko <pavel@uavcan.org>
 
 from __future__ import annotations
+import sys
 import copy
+import time
+import struct
 import typing
 import socket
 import logging
+from pathlib import Path
 import numpy
 import pyuavcan.transport.udp
 import uavcan.metatransport.ethernet
 from uavcan.metatransport.ethernet import EtherType_0_1 as EtherType
-from . import Iface, DCSFrame, DCSTransportConfig, IfaceCapture, IfaceStatistics
+from . import Iface, DCSFrame, DCSTransportConfig, IfaceCapture, IfaceStatistics, RateEstimator, CapturePredicate
 
 
 _logger = logging.getLogger(__name__)
 
+_ADDR_CACHE_CAPACITY = 1024
+"""
+The number of distinct addresses on a sane network is small, but in case of a bad actor we don't want to leak memory.
+"""
+
+_ETHERTYPE_IP_V4 = EtherType(EtherType.IP_V4)
+_ETHERTYPE_IP_V6 = EtherType(EtherType.IP_V6)
+
+_IP_V4_HEADER_SIZE = 20
+
+_ETHERNET_OVERHEAD_SIZE = 14 + 4 + 8 + 12
+"""
+The bytes occupying the medium per frame in addition to the payload: header, FCS, preamble with SFD, inter-frame gap.
+The VLAN tag, if any, is not accounted for.
+"""
+
+_ETHERNET_PAYLOAD_SIZE_MIN = 46
+"""
+Shorter payloads are padded.
+"""
+
+_SYSFS_NET = Path("/sys/class/net")
+
+_SIOCGIFADDR = 0x8915
+
 
 class UDPIface(Iface):
     TRANSPORT_NAME = "udp"
 
-    def __init__(self, transport: pyuavcan.transport.Transport) -> None:
+    def __init__(self, transport: pyuavcan.transport.Transport, link_speed: typing.Optional[float] = None) -> None:
+        """
+        :param link_speed: In bit/s, used for estimating the media utilization. None if unknown.
+        """
         self._transport = transport
         self._capture_handlers: typing.List[typing.Callable[[IfaceCapture], None]] = []
+        self._capture_broadcast: typing.Callable[[IfaceCapture], object] = pyuavcan.util.broadcast([])
         self._stats = IfaceStatistics()
+        self._capture_filter: typing.Optional[CapturePredicate] = None
+        self._addr_cache: typing.Dict[bytes, numpy.ndarray] = {}
+        # The amounts are in bytes to keep the hot path short.
+        self._media_bytes = RateEstimator(capacity=link_speed / 8 if link_speed is not None else None)
 
     @staticmethod
     def new(cfg: DCSTransportConfig) -> UDPIface:
         udp_cfg = cfg.udp
         assert udp_cfg
+        local_nic_address = udp_cfg.local_nic_address.value.tobytes().decode()
+        link_speed = _get_link_speed(local_nic_address)
+        if link_speed is None and udp_cfg.link_speed_fallback > 0:
+            link_speed = float(udp_cfg.link_speed_fallback) * 1e6
+        _logger.info("Link speed of the NIC at %r: %s bit/s", local_nic_address, link_speed)
         tr = pyuavcan.transport.udp.UDPTransport(
-            udp_cfg.local_nic_address.value.tobytes().decode(),
+            local_nic_address,
             local_node_id=None,
             mtu=udp_cfg.mtu,
             service_transfer_multiplier=2 if udp_cfg.duplicate_service_transfers else 1,
         )
-        return UDPIface(tr)
+        return UDPIface(tr, link_speed)
 
     @staticmethod
     def capture_from_dcs(ts: pyuavcan.transport.Timestamp, fr: DCSFrame) -> pyuavcan.transport.Capture:
@@ -63,48 +105,144 @@ class UDPIface(Iface):
         if not self._capture_handlers:
             self._transport.begin_capture(self._process_capture)
         self._capture_handlers.append(handler)
+        if len(self._capture_handlers) == 1:
+            self._capture_broadcast = handler
+        else:
+            self._capture_broadcast = pyuavcan.util.broadcast(list(self._capture_handlers))
+
+    def set_capture_filter(self, predicate: typing.Optional[CapturePredicate]) -> None:
+        self._capture_filter = predicate
 
     async def spoof(self, transfer: pyuavcan.transport.AlienTransfer, monotonic_deadline: float) -> bool:
         return await self._transport.spoof(transfer, monotonic_deadline)
 
-    def sample_statistics(self) -> IfaceStatistics:
+    def sample_statistics(self, monotonic_ns: typing.Optional[int] = None) -> IfaceStatistics:
+        util, peak = self._media_bytes.sample_utilization_pct(
+            monotonic_ns if monotonic_ns is not None else time.monotonic_ns()
+        )
+        self._stats.media_utilization_pct, self._stats.media_utilization_peak_pct = util, peak
         return copy.copy(self._stats)
 
     def close(self) -> None:
         self._transport.close()
 
     def _process_capture(self, cap: pyuavcan.transport.Capture) -> None:
+        """
+        This is the hot path invoked for every captured packet from the sniffer thread. Observe that:
+
+        - The payload is not copied; the DSDL object is bound to a view of the captured packet.
+        - The address arrays are immutable so they are shared between all frames with the same address.
+        - The debug log arguments are not constructed unless the debug level is enabled.
+        - The frames rejected by the capture filter are not converted at all.
+        """
         assert isinstance(cap, pyuavcan.transport.udp.UDPCapture)
-
-        def mk_addr(x: memoryview) -> bytes:
-            return x.tobytes().ljust(6, b"\x00")[:6]
-
         llp = cap.link_layer_packet
         if llp.protocol == socket.AF_INET:
-            et = EtherType.IP_V4
+            et = _ETHERTYPE_IP_V4
         elif llp.protocol == socket.AF_INET6:
-            et = EtherType.IP_V6
+            et = _ETHERTYPE_IP_V6
         else:
             _logger.warning("%s: Unsupported transport layer protocol: %r", self, llp.protocol)
             return
 
+        payload = llp.payload
+        stats = self._stats
+        stats.n_frames += 1
+        stats.n_media_layer_bytes += len(payload)
+        self._media_bytes.add(
+            max(len(payload), _ETHERNET_PAYLOAD_SIZE_MIN) + _ETHERNET_OVERHEAD_SIZE, cap.timestamp.monotonic_ns
+        )
+        # Error counts are not provided because UDPTransport does not provide the required stats. May change this later.
+
+        flt = self._capture_filter
+        if flt is not None and not flt(_parse_session(cap)):
+            stats.n_filtered += 1
+            return
+
         dcs = DCSFrame(
             udp=uavcan.metatransport.ethernet.Frame_0_1(
-                destination=mk_addr(llp.destination),
-                source=mk_addr(llp.source),
+                destination=self._get_addr(llp.destination),
+                source=self._get_addr(llp.source),
                 ethertype=et,
-                payload=numpy.asarray(llp.payload, dtype=numpy.uint8),
+                payload=numpy.frombuffer(payload, dtype=numpy.uint8),
             ),
         )
 
-        self._stats.n_frames += 1
-        self._stats.n_media_layer_bytes += len(llp.payload)
-        # TODO: populate the media utilization estimate (requires querying the OS network iface speed).
-        # Error counts are not provided because UDPTransport does not provide the required stats. May change this later.
-
-        iface_cap = IfaceCapture(timestamp=cap.timestamp, frame=dcs)
-        _logger.debug("%s: Captured %r", self, iface_cap)
-        pyuavcan.util.broadcast(self._capture_handlers)(iface_cap)
+        # The node-ID is the least significant part of the source IP address, which is at offset 12 in the IPv4 header.
+        source_node_id: typing.Optional[int] = None
+        if et is _ETHERTYPE_IP_V4 and len(payload) >= _IP_V4_HEADER_SIZE:
+            source_node_id = (payload[14] << 8) | payload[15]
+
+        iface_cap = IfaceCapture(cap.timestamp, dcs, source_node_id)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("%s: Captured %r", self, iface_cap)
+        self._capture_broadcast(iface_cap)
+
+    def _get_addr(self, x: memoryview) -> numpy.ndarray:
+        """
+        Converts the link-layer address into a MAC-48 address, caching the result.
+        Read-only memoryviews are hashable and compare equal to bytes, so the lookup does not allocate.
+        """
+        try:
+            return self._addr_cache[x]  # type: ignore
+        except (KeyError, TypeError, ValueError):  # ValueError is raised if the memoryview is not read-only.
+            pass
+        key = x.tobytes()
+        out = numpy.frombuffer(key.ljust(6, b"\x00")[:6], dtype=numpy.uint8)
+        if len(self._addr_cache) >= _ADDR_CACHE_CAPACITY:
+            self._addr_cache.clear()
+        self._addr_cache[key] = out
+        return out
 
     def __repr__(self) -> str:
         return pyuavcan.util.repr_attributes(self, self._transport)
+
+
+def _parse_session(cap: pyuavcan.transport.udp.UDPCapture) -> typing.Optional[pyuavcan.transport.AlienSessionSpecifier]:
+    try:
+        parsed = cap.parse()
+    except (ValueError, NotImplementedError):  # Unsupported protocol.
+        return None
+    return parsed[0] if parsed is not None else None
+
+
+def _get_link_speed(local_nic_address: str) -> typing.Optional[float]:
+    """
+    Returns the link speed in bit/s of the local NIC that has the specified IPv4 address, or None if unknown.
+    Only Linux is supported, where the speed is read from sysfs.
+    Virtual NICs (loopback, bridges, etc.) do not report the speed; neither do the NICs with the link down.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        name = _find_nic_name(local_nic_address)
+        if name is None:
+            _logger.info("Could not find the NIC with address %r", local_nic_address)
+            return None
+        speed_mbps = int((_SYSFS_NET / name / "speed").read_text())
+    except (OSError, ValueError) as ex:
+        _logger.info("Could not read the link speed of the NIC at %r: %s", local_nic_address, ex)
+        return None
+    return speed_mbps * 1e6 if speed_mbps > 0 else None
+
+
+def _find_nic_name(address: str) -> typing.Optional[str]:
+    """
+    Linux-specific. IPv6 is not supported.
+
+    >>> _find_nic_name("127.0.0.1") if sys.platform.startswith("linux") else "lo"
+    'lo'
+    """
+    import fcntl  # pylint: disable=import-outside-toplevel
+
+    packed = socket.inet_aton(address)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _, name in socket.if_nameindex():
+            try:
+                # struct ifreq: the name is followed by struct sockaddr_in, where the address is at offset 4.
+                ifreq = fcntl.ioctl(sock.fileno(), _SIOCGIFADDR, struct.pack("40s", name.encode()))
+            except OSError:  # No IPv4 address is assigned.
+                continue
+            if ifreq[20:24] == packed:
+                return name
+    return None
@@ -0,0 +1,10 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from ._recorder import Recorder as Recorder
+from ._recorder import RecorderSettings as RecorderSettings
+from ._recorder import RecorderStatistics as RecorderStatistics
+
+from ._reader import CaptureLog as CaptureLog
+from ._reader import LogRecord as LogRecord
@@ -0,0 +1,103 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+"""
+A capture log is a directory of segment files named by their index, e.g., ``000000.ycap``, ``000001.ycap``.
+Each segment begins with :data:`SEGMENT_HEADER` followed by records.
+Each record is :data:`RECORD_HEADER` followed by the serialized DCS frame (``org_uavcan_yukon.io.frame.Frame``).
+All values are little-endian. The records are never modified once written, so a segment that is being recorded
+is always valid up to the last complete record.
+
+The reader keeps a sparse index of each segment in a sidecar file with the same name plus :data:`INDEX_SUFFIX`.
+It begins with :data:`INDEX_HEADER` followed by entries, each describing a block of consecutive records:
+:data:`INDEX_ENTRY` followed by :data:`INDEX_ENTRY_IFACE` repeated for each iface present in the block.
+The index is derived data; it can be deleted at any time and it will be rebuilt.
+"""
+
+from __future__ import annotations
+import struct
+import typing
+import pyuavcan
+from ..iface import IfaceCapture
+
+
+SEGMENT_SUFFIX = ".ycap"
+
+SEGMENT_MAGIC = b"YUKONCAP"
+
+FORMAT_VERSION = 1
+
+SEGMENT_HEADER = struct.Struct("<8sII")
+"""
+Magic, format version, reserved.
+"""
+
+RECORD_MARKER = 0xCA97
+
+RECORD_HEADER = struct.Struct("<HBBIQQ")
+"""
+Record marker, iface_id, capture shard, serialized frame size, timestamp (system, microseconds), sequence number.
+The marker allows the reader to detect corruption early.
+"""
+
+
+INDEX_SUFFIX = ".idx"
+
+INDEX_MAGIC = b"YUKONIDX"
+
+INDEX_HEADER = struct.Struct("<8sII")
+"""
+Magic, format version, reserved.
+"""
+
+INDEX_ENTRY = struct.Struct("<QQIQQQQQB")
+"""
+Offset of the first record, offset past the last record, number of records,
+timestamp min and max (system, microseconds), subject-ID Bloom filter (64 bits), source node-ID Bloom filter
+(128 bits as two 64-bit halves, low first), number of ifaces.
+"""
+
+INDEX_ENTRY_IFACE = struct.Struct("<BQQ")
+"""
+iface_id, sequence number min and max.
+"""
+
+
+def segment_file_name(index: int) -> str:
+    """
+    >>> segment_file_name(12)
+    '000012.ycap'
+    """
+    return f"{index:06d}{SEGMENT_SUFFIX}"
+
+
+def encode_segment_header() -> bytes:
+    return SEGMENT_HEADER.pack(SEGMENT_MAGIC, FORMAT_VERSION, 0)
+
+
+def encode_record(out: bytearray, iface_id: int, shard: int, sequence_number: int, cap: IfaceCapture) -> None:
+    """
+    Appends the record to the buffer.
+
+    >>> import uavcan.metatransport.serial
+    >>> from org_uavcan_yukon.io.frame import Frame_0_1
+    >>> buf = bytearray()
+    >>> frame = Frame_0_1(serial=uavcan.metatransport.serial.Fragment_0_2(b"abc"))
+    >>> encode_record(buf, 3, 1, 123, IfaceCapture(pyuavcan.transport.Timestamp(5_000_000, 0), frame))
+    >>> marker, iface_id, shard, size, ts, seq = RECORD_HEADER.unpack_from(buf)
+    >>> marker == RECORD_MARKER, iface_id, shard, ts, seq, size == len(buf) - RECORD_HEADER.size
+    (True, 3, 1, 5000, 123, True)
+    """
+    fragments: typing.Iterable[memoryview] = pyuavcan.dsdl.serialize(cap.frame)
+    offset = len(out)
+    out += _EMPTY_HEADER
+    for frag in fragments:
+        out += frag
+    size = len(out) - offset - RECORD_HEADER.size
+    RECORD_HEADER.pack_into(
+        out, offset, RECORD_MARKER, iface_id, shard, size, cap.timestamp.system_ns // 1000, sequence_number
+    )
+
+
+_EMPTY_HEADER = bytes(RECORD_HEADER.size)
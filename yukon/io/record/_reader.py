@@ -0,0 +1,477 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import os
+import mmap
+import bisect
+import typing
+import logging
+import dataclasses
+from pathlib import Path
+import pyuavcan
+from pyuavcan.transport import AlienSessionSpecifier, MessageDataSpecifier, Timestamp
+from org_uavcan_yukon.io.frame import Capture_0_1 as DCSCapture
+from ..iface import Iface, IfaceCapture, DCSFrame
+from .._time import timestamp_to_dcs
+from ._format import SEGMENT_SUFFIX, SEGMENT_HEADER, SEGMENT_MAGIC, FORMAT_VERSION, RECORD_HEADER, RECORD_MARKER
+from ._format import INDEX_SUFFIX, INDEX_MAGIC, INDEX_HEADER, INDEX_ENTRY, INDEX_ENTRY_IFACE
+
+
+_logger = logging.getLogger(__name__)
+
+INDEX_BLOCK_SIZE = 1024
+"""
+Number of records per index entry. Smaller blocks make queries more selective at the expense of the index size.
+"""
+
+
+class LogRecord(typing.NamedTuple):
+    iface_id: int
+    shard: int
+    sequence_number: int
+    capture: IfaceCapture
+    """
+    The monotonic timestamp is not recorded so it is always zero.
+    """
+
+    def to_dcs(self) -> DCSCapture:
+        return DCSCapture(
+            timestamp=timestamp_to_dcs(self.capture.timestamp),
+            iface_id=self.iface_id,
+            sequence_number=self.sequence_number,
+            frame=self.capture.frame,
+        )
+
+
+class CaptureLog:
+    """
+    Read access to a capture log directory written by :class:`Recorder`.
+
+    The segments are memory-mapped, so opening a log takes constant time regardless of its size,
+    except when a segment is seen for the first time and its index needs to be built.
+    Queries use the sparse index to skip the blocks of records that cannot match the filters,
+    and the records are decoded lazily as the returned generators are iterated.
+
+    The log may be recorded concurrently; :meth:`refresh` picks up new segments and new records,
+    extending the index incrementally. Queries invoke it automatically.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self._directory = Path(directory)
+        self._segments: typing.Dict[Path, _Segment] = {}
+        self.refresh()
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    @property
+    def time_range(self) -> typing.Optional[typing.Tuple[float, float]]:
+        """
+        The earliest and the latest system timestamp in the log, in seconds. None if the log is empty.
+        """
+        ranges = [r for r in (s.time_range for s in self._segments.values()) if r is not None]
+        if not ranges:
+            return None
+        return min(lo for lo, _ in ranges) * 1e-6, max(hi for _, hi in ranges) * 1e-6
+
+    def refresh(self) -> None:
+        for path in sorted(self._directory.glob("*" + SEGMENT_SUFFIX)):
+            if path not in self._segments:
+                self._segments[path] = _Segment(path)
+        for seg in self._segments.values():
+            seg.refresh()
+
+    def query(
+        self,
+        time_range: typing.Optional[typing.Tuple[float, float]] = None,
+        iface_id: typing.Optional[int] = None,
+        shard: typing.Optional[int] = None,
+        sequence_number_range: typing.Optional[typing.Tuple[int, int]] = None,
+        subject_id: typing.Optional[int] = None,
+        source_node_id: typing.Optional[int] = None,
+    ) -> typing.Iterator[LogRecord]:
+        """
+        Yields the records matching all of the specified filters in the order they were recorded.
+
+        :param time_range: (min, max) system time in seconds, inclusive.
+        :param iface_id: Only records captured from this iface.
+        :param shard: Only records published via this capture shard.
+        :param sequence_number_range: (min, max) inclusive. Meaningless unless iface_id is also given,
+            and the shard as well if the capture is sharded, because each shard is numbered separately.
+        :param subject_id: Only frames of message transfers with this subject-ID.
+            A serial capture fragment matches if any of the complete frames in it matches.
+        :param source_node_id: Only frames emitted by this node.
+        """
+        self.refresh()
+        flt = _Filter(
+            ts_min=int(time_range[0] * 1e6) if time_range else None,
+            ts_max=int(time_range[1] * 1e6) if time_range else None,
+            iface_id=iface_id,
+            shard=shard,
+            seq_range=sequence_number_range,
+            subject_id=subject_id,
+            source_node_id=source_node_id,
+        )
+        for seg in list(self._segments.values()):
+            for block in seg.select(flt.ts_min, flt.ts_max):
+                if flt.may_match(block):
+                    for rec in seg.read(block.offset, block.end):
+                        if flt.matches(rec):
+                            yield rec
+
+    def close(self) -> None:
+        for seg in self._segments.values():
+            seg.close()
+        self._segments.clear()
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, str(self._directory), segments=len(self._segments))
+
+
+@dataclasses.dataclass
+class _Block:
+    offset: int
+    end: int
+    n_records: int = 0
+    ts_min: int = 2 ** 64 - 1
+    ts_max: int = 0
+    subject_bloom: int = 0
+    source_bloom: int = 0
+    seq_ranges: typing.Dict[int, typing.Tuple[int, int]] = dataclasses.field(default_factory=dict)
+
+    def add(self, end: int, rec: LogRecord, ts_us: int) -> None:
+        self.end = end
+        self.n_records += 1
+        self.ts_min = min(self.ts_min, ts_us)
+        self.ts_max = max(self.ts_max, ts_us)
+        seq = rec.sequence_number
+        lo, hi = self.seq_ranges.get(rec.iface_id, (seq, seq))
+        self.seq_ranges[rec.iface_id] = min(lo, seq), max(hi, seq)
+        sessions = _extract_sessions(rec.capture)
+        if sessions is None:  # Unknown content, the block may contain anything.
+            self.subject_bloom, self.source_bloom = _ALL_BITS_64, _ALL_BITS_128
+            return
+        for ss in sessions:
+            if isinstance(ss.data_specifier, MessageDataSpecifier):
+                self.subject_bloom |= _subject_bit(ss.data_specifier.subject_id)
+            if ss.source_node_id is not None:
+                self.source_bloom |= _source_bit(ss.source_node_id)
+
+    def encode(self) -> bytes:
+        out = INDEX_ENTRY.pack(
+            self.offset,
+            self.end,
+            self.n_records,
+            self.ts_min,
+            self.ts_max,
+            self.subject_bloom,
+            self.source_bloom & _ALL_BITS_64,
+            self.source_bloom >> 64,
+            len(self.seq_ranges),
+        )
+        return out + b"".join(INDEX_ENTRY_IFACE.pack(k, *v) for k, v in self.seq_ranges.items())
+
+    @staticmethod
+    def decode(data: memoryview, offset: int) -> typing.Tuple[_Block, int]:
+        """
+        :returns: The block and the offset past it. Raises struct.error if the data is truncated.
+        """
+        off, end, n_records, ts_min, ts_max, subjects, src_lo, src_hi, n_ifaces = INDEX_ENTRY.unpack_from(data, offset)
+        offset += INDEX_ENTRY.size
+        seq_ranges = {}
+        for _ in range(n_ifaces):
+            iface_id, seq_min, seq_max = INDEX_ENTRY_IFACE.unpack_from(data, offset)
+            offset += INDEX_ENTRY_IFACE.size
+            seq_ranges[iface_id] = seq_min, seq_max
+        return _Block(off, end, n_records, ts_min, ts_max, subjects, src_lo | (src_hi << 64), seq_ranges), offset
+
+
+class _Segment:
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._file = open(path, "rb")  # pylint: disable=consider-using-with
+        self._map: typing.Optional[mmap.mmap] = None
+        self._indexed: typing.List[_Block] = []  # Complete blocks, persisted.
+        self._time_index = _TimeIndex()  # Of the complete blocks.
+        self._tail: typing.Optional[_Block] = None  # The last incomplete block, not persisted.
+        self._index_file: typing.Optional[typing.BinaryIO] = None
+        self._broken = False
+        self._load_index()
+
+    @property
+    def blocks(self) -> typing.List[_Block]:
+        return self._indexed + ([self._tail] if self._tail else [])
+
+    @property
+    def time_range(self) -> typing.Optional[typing.Tuple[int, int]]:
+        """
+        The earliest and the latest system timestamp in the segment, in microseconds. None if it is empty.
+        """
+        out = self._time_index.time_range
+        if self._tail is not None:
+            tail = self._tail.ts_min, self._tail.ts_max
+            out = (min(out[0], tail[0]), max(out[1], tail[1])) if out is not None else tail
+        return out
+
+    def select(self, ts_min: typing.Optional[int], ts_max: typing.Optional[int]) -> typing.List[_Block]:
+        """
+        The blocks that may contain records within the time range (inclusive, in microseconds), in the order of
+        recording. The complete blocks are located by bisection; the tail block is always included.
+        """
+        lo, hi = self._time_index.locate(ts_min, ts_max)
+        return self._indexed[lo:hi] + ([self._tail] if self._tail else [])
+
+    def refresh(self) -> None:
+        size = os.fstat(self._file.fileno()).st_size
+        if size < SEGMENT_HEADER.size or self._broken:
+            return
+        if self._map is None or len(self._map) != size:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._map[:8] != SEGMENT_MAGIC or SEGMENT_HEADER.unpack_from(self._map)[1] != FORMAT_VERSION:
+                _logger.error("%s is not a capture log segment or its version is not supported", self._path)
+                self._broken = True
+                return
+        self._extend_index()
+
+    def read(self, offset: int, end: int) -> typing.Iterator[LogRecord]:
+        for rec, _, _ in self._iterate(offset, end):
+            yield rec
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        self._file.close()
+
+    def _iterate(self, offset: int, end: int) -> typing.Iterator[typing.Tuple[LogRecord, int, int]]:
+        """
+        Yields (record, offset past the record, timestamp in microseconds).
+        Stops at the first incomplete or invalid record.
+        """
+        mm = self._map
+        assert mm is not None
+        while offset + RECORD_HEADER.size <= end:
+            marker, iface_id, shard, size, ts_us, seq = RECORD_HEADER.unpack_from(mm, offset)
+            start = offset + RECORD_HEADER.size
+            if marker != RECORD_MARKER:
+                _logger.error("%s: corrupted record at offset %d", self._path, offset)
+                self._broken = True
+                return
+            if start + size > end:
+                return  # Not yet written completely.
+            # The data is copied out of the map so that the map can be closed while the records are still alive.
+            frame = pyuavcan.dsdl.deserialize(DCSFrame, [memoryview(mm[start : start + size])])
+            offset = start + size
+            if frame is None:
+                _logger.error("%s: could not deserialize record at offset %d", self._path, start)
+                continue
+            ts = Timestamp(system_ns=ts_us * 1000, monotonic_ns=0)
+            yield LogRecord(iface_id, shard, seq, IfaceCapture(ts, frame)), offset, ts_us
+
+    def _extend_index(self) -> None:
+        assert self._map is not None
+        if self._tail is None:
+            start = self._indexed[-1].end if self._indexed else SEGMENT_HEADER.size
+            block = _Block(start, start)
+        else:
+            block = self._tail
+        for rec, end, ts_us in self._iterate(block.end, len(self._map)):
+            block.add(end, rec, ts_us)
+            if block.n_records >= INDEX_BLOCK_SIZE:
+                self._indexed.append(block)
+                self._time_index.append(block.ts_min, block.ts_max)
+                self._persist(block)
+                block = _Block(end, end)
+        self._tail = block if block.n_records > 0 else None
+
+    def _load_index(self) -> None:
+        path = self._path.with_name(self._path.name + INDEX_SUFFIX)
+        try:
+            data = memoryview(path.read_bytes())
+        except OSError:
+            data = memoryview(b"")
+        blocks: typing.List[_Block] = []
+        offset = INDEX_HEADER.size
+        size = os.fstat(self._file.fileno()).st_size
+        if len(data) >= INDEX_HEADER.size and INDEX_HEADER.unpack_from(data)[:2] == (INDEX_MAGIC, FORMAT_VERSION):
+            try:
+                while offset < len(data):
+                    block, next_offset = _Block.decode(data, offset)
+                    if block.offset != (blocks[-1].end if blocks else SEGMENT_HEADER.size) or block.end > size:
+                        break  # Stale or not matching the segment; the remainder will be rebuilt.
+                    blocks.append(block)
+                    offset = next_offset
+            except Exception as ex:  # Most likely truncated.
+                _logger.debug("%s: index is damaged at offset %d: %s", path, offset, ex)
+        else:
+            offset = 0
+        self._indexed = blocks
+        for block in blocks:
+            self._time_index.append(block.ts_min, block.ts_max)
+        _logger.debug("%s: loaded %d index entries", self._path, len(blocks))
+        try:
+            self._index_file = open(path, "r+b" if path.exists() else "w+b")  # pylint: disable=consider-using-with
+            if offset == 0:
+                self._index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, FORMAT_VERSION, 0))
+                offset = INDEX_HEADER.size
+            self._index_file.truncate(offset)
+            self._index_file.seek(offset)
+        except OSError as ex:
+            _logger.info("%s: the index will not be persisted: %s", self._path, ex)
+            self._index_file = None
+
+    def _persist(self, block: _Block) -> None:
+        if self._index_file is not None:
+            try:
+                self._index_file.write(block.encode())
+                self._index_file.flush()
+            except OSError as ex:
+                _logger.info("%s: could not persist the index: %s", self._path, ex)
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, str(self._path), blocks=len(self._indexed))
+
+
+class _TimeIndex:
+    """
+    Locates the blocks that may contain the records within a time range by bisection. The timestamps of the blocks
+    are not necessarily monotonic (e.g., the system clock may be adjusted during the recording), but the running
+    maximum of ts_max and the minimum of ts_min over the following blocks are, so they are kept for bisection.
+    Appending takes constant time as long as the time does not go backward.
+
+    >>> ti = _TimeIndex()
+    >>> for ts_min, ts_max in [(0, 10), (10, 20), (5, 30), (30, 40), (40, 50)]:
+    ...     ti.append(ts_min, ts_max)
+    >>> ti.locate(21, 29)  # The third block overlaps although it begins before the end of the second one.
+    (2, 3)
+    >>> ti.locate(None, 4), ti.locate(41, None), ti.locate(60, None), ti.locate(None, None)
+    ((0, 1), (4, 5), (5, 5), (0, 5))
+    >>> ti.time_range
+    (0, 50)
+    """
+
+    def __init__(self) -> None:
+        self._ts_max_running: typing.List[int] = []
+        self._ts_min_following: typing.List[int] = []
+
+    @property
+    def time_range(self) -> typing.Optional[typing.Tuple[int, int]]:
+        if not self._ts_max_running:
+            return None
+        return self._ts_min_following[0], self._ts_max_running[-1]
+
+    def append(self, ts_min: int, ts_max: int) -> None:
+        running = self._ts_max_running
+        running.append(max(running[-1], ts_max) if running else ts_max)
+        following = self._ts_min_following
+        following.append(ts_min)
+        index = len(following) - 2
+        while index >= 0 and following[index] > ts_min:
+            following[index] = ts_min
+            index -= 1
+
+    def locate(self, ts_min: typing.Optional[int], ts_max: typing.Optional[int]) -> typing.Tuple[int, int]:
+        """
+        :returns: The slice of the blocks outside of which none can intersect the time range.
+        """
+        lo = bisect.bisect_left(self._ts_max_running, ts_min) if ts_min is not None else 0
+        hi = bisect.bisect_right(self._ts_min_following, ts_max) if ts_max is not None else len(self._ts_max_running)
+        return lo, max(lo, hi)
+
+
+@dataclasses.dataclass(frozen=True)
+class _Filter:
+    ts_min: typing.Optional[int]
+    ts_max: typing.Optional[int]
+    iface_id: typing.Optional[int]
+    shard: typing.Optional[int]
+    seq_range: typing.Optional[typing.Tuple[int, int]]
+    subject_id: typing.Optional[int]
+    source_node_id: typing.Optional[int]
+
+    def may_match(self, block: _Block) -> bool:
+        if self.ts_min is not None and block.ts_max < self.ts_min:
+            return False
+        if self.ts_max is not None and block.ts_min > self.ts_max:
+            return False
+        if self.iface_id is not None:  # The ranges span all shards of the iface, which is conservative.
+            try:
+                seq_min, seq_max = block.seq_ranges[self.iface_id]
+            except LookupError:
+                return False
+            if self.seq_range is not None and (seq_max < self.seq_range[0] or seq_min > self.seq_range[1]):
+                return False
+        if self.subject_id is not None and not block.subject_bloom & _subject_bit(self.subject_id):
+            return False
+        if self.source_node_id is not None and not block.source_bloom & _source_bit(self.source_node_id):
+            return False
+        return True
+
+    def matches(self, rec: LogRecord) -> bool:
+        ts_us = rec.capture.timestamp.system_ns // 1000
+        if (self.ts_min is not None and ts_us < self.ts_min) or (self.ts_max is not None and ts_us > self.ts_max):
+            return False
+        if self.shard is not None and rec.shard != self.shard:
+            return False
+        if self.iface_id is not None:
+            if rec.iface_id != self.iface_id:
+                return False
+            if self.seq_range is not None and not self.seq_range[0] <= rec.sequence_number <= self.seq_range[1]:
+                return False
+        if self.subject_id is None and self.source_node_id is None:
+            return True
+        for ss in _extract_sessions(rec.capture) or []:
+            if (self.source_node_id is None or ss.source_node_id == self.source_node_id) and (
+                self.subject_id is None
+                or (
+                    isinstance(ss.data_specifier, MessageDataSpecifier)
+                    and ss.data_specifier.subject_id == self.subject_id
+                )
+            ):
+                return True
+        return False
+
+
+_ALL_BITS_64 = 2 ** 64 - 1
+_ALL_BITS_128 = 2 ** 128 - 1
+
+
+def _subject_bit(subject_id: int) -> int:
+    return 1 << (subject_id % 64)
+
+
+def _source_bit(node_id: int) -> int:
+    return 1 << (node_id % 128)
+
+
+def _extract_sessions(cap: IfaceCapture) -> typing.Optional[typing.Sequence[AlienSessionSpecifier]]:
+    """
+    :returns: The sessions of the transport frames contained in the capture (there may be several in a serial
+        fragment, or none if it does not contain a complete frame); None if the capture cannot be parsed.
+    """
+    frame = cap.frame
+    if frame.serial:
+        from pyuavcan.transport.serial import SerialFrame
+
+        out = []
+        for image in frame.serial.data.tobytes().split(bytes([SerialFrame.FRAME_DELIMITER_BYTE])):
+            parsed = SerialFrame.parse_from_cobs_image(memoryview(image)) if image else None
+            if parsed is not None:
+                out.append(
+                    AlienSessionSpecifier(parsed.source_node_id, parsed.destination_node_id, parsed.data_specifier)
+                )
+        return out
+    try:
+        parsed = Iface.resolve(frame).capture_from_dcs(cap.timestamp, frame).parse()  # type: ignore
+    except Exception as ex:
+        _logger.debug("Could not parse %r: %s", cap, ex)
+        return None
+    return [parsed[0]] if parsed is not None else []
@@ -0,0 +1,204 @@
+# Copyright (C) 2021  UAVCAN Consortium  <uavcan.org>
+# This software is distributed under the terms of the MIT License.
+# Author: Pavel Kirienko <pavel@uavcan.org>
+
+from __future__ import annotations
+import os
+import copy
+import time
+import typing
+import logging
+import threading
+import collections
+import dataclasses
+from pathlib import Path
+import pyuavcan
+from ..iface import IfaceCapture
+from ._format import encode_record, encode_segment_header, segment_file_name
+
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass(frozen=True)
+class RecorderSettings:
+    segment_size_max: int = 256 * 1024 ** 2
+    """
+    A new segment is started when the current one reaches this size.
+    The limit may be exceeded by up to one write block because records are never split.
+    """
+
+    segment_duration_max: float = 3600.0
+    """
+    A new segment is started when the current one has been open for this long, in seconds.
+    """
+
+    flush_interval: float = 0.1
+    """
+    How often the writer thread wakes up to move the accumulated records to the disk, in seconds.
+    """
+
+    fsync_interval: float = 1.0
+    """
+    The data is flushed to the storage device at this interval, in seconds.
+    Upon a power loss, at most this much of the most recent data is lost.
+    """
+
+    buffer_capacity: int = 256 * 1024
+    """
+    Frames that arrive while this many are already waiting for the writer thread are dropped.
+    This bounds the memory consumption if the disk cannot keep up.
+    """
+
+    write_block_size: int = 1024 ** 2
+    """
+    Records are accumulated in a buffer of roughly this size before being handed over to the OS in one write.
+    """
+
+
+@dataclasses.dataclass
+class RecorderStatistics:
+    n_frames: int = 0  # Written to the disk.
+    n_bytes: int = 0  # Including the headers.
+    n_dropped: int = 0  # Due to buffer overflow or disk errors.
+    n_segments: int = 0
+    n_errors: int = 0  # Disk errors.
+
+
+class Recorder:
+    """
+    Persists the capture stream into an append-only segmented log (see the format description in ``_format``).
+
+    The capture path only appends references to the captured frames to a bounded queue, which is cheap and
+    never blocks; the frames are serialized and written by a dedicated thread, so a slow disk can only cause
+    the queue to overflow, in which case the excess is dropped and counted.
+    Dropped frames are visible in the log as sequence number gaps.
+    """
+
+    def __init__(self, directory: Path, settings: RecorderSettings) -> None:
+        self._directory = Path(directory)
+        self._settings = settings
+        self._stats = RecorderStatistics()
+        self._n_lost_on_error = 0  # Kept separately because n_dropped is updated from the capture path.
+        self._queue: typing.Deque[typing.Tuple[int, int, IfaceCapture]] = collections.deque()
+        self._file: typing.Optional[typing.BinaryIO] = None
+        self._segment_index = 0
+        self._segment_size = 0
+        self._segment_opened_at = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._thread_fn, name="io_recorder", daemon=True)
+        self._thread.start()
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    @property
+    def statistics(self) -> RecorderStatistics:
+        out = copy.copy(self._stats)
+        out.n_dropped += self._n_lost_on_error
+        return out
+
+    def feed(self, iface_id: int, shard: int, sequence_number: int, cap: IfaceCapture) -> None:
+        """
+        This is a capture observer. The frame is queued for writing; this method never blocks.
+        """
+        if len(self._queue) >= self._settings.buffer_capacity:
+            self._stats.n_dropped += 1
+        else:
+            self._queue.append((iface_id, shard, sequence_number, cap))
+
+    def close(self) -> None:
+        """
+        Writes out the remaining data and waits for the writer thread to finish.
+        """
+        self._stop.set()
+        self._thread.join()
+
+    def _thread_fn(self) -> None:
+        _logger.info("%s: Started", self)
+        next_fsync_at = time.monotonic() + self._settings.fsync_interval
+        stopping = False
+        while not stopping:
+            stopping = self._stop.wait(self._settings.flush_interval)
+            try:
+                self._drain()
+                if self._file is not None and (stopping or time.monotonic() >= next_fsync_at):
+                    next_fsync_at = time.monotonic() + self._settings.fsync_interval
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+            except OSError as ex:
+                self._stats.n_errors += 1
+                _logger.error("%s: Write failed, starting a new segment: %s", self, ex)
+                self._close_segment()
+            except Exception as ex:  # pragma: no cover
+                _logger.exception("%s: Unhandled exception: %s", self, ex)
+        self._close_segment()
+        _logger.info("%s: Stopped; %s", self, self._stats)
+
+    def _drain(self) -> None:
+        queue = self._queue
+        block_size = self._settings.write_block_size
+        block = bytearray()
+        n_frames = 0
+        try:
+            while queue:
+                iface_id, shard, seq, cap = queue.popleft()
+                encode_record(block, iface_id, shard, seq, cap)
+                n_frames += 1
+                if len(block) >= block_size:
+                    self._write(block, n_frames)
+                    block, n_frames = bytearray(), 0
+            self._write(block, n_frames)
+        except OSError:
+            self._n_lost_on_error += n_frames
+            raise
+
+    def _write(self, block: bytearray, n_frames: int) -> None:
+        if not block:
+            return
+        now = time.monotonic()
+        if self._file is not None and (
+            self._segment_size + len(block) > self._settings.segment_size_max
+            or now - self._segment_opened_at >= self._settings.segment_duration_max
+        ):
+            self._close_segment()
+        if self._file is None:
+            self._open_segment(now)
+        assert self._file is not None
+        self._file.write(block)
+        self._segment_size += len(block)
+        self._stats.n_frames += n_frames
+        self._stats.n_bytes += len(block)
+
+    def _open_segment(self, now: float) -> None:
+        self._directory.mkdir(parents=True, exist_ok=True)
+        path = self._directory / segment_file_name(self._segment_index)
+        self._segment_index += 1
+        # A buffered file either writes the whole block or raises; unlike a raw file, it never returns a short count.
+        # The blocks are normally larger than its buffer, so they are passed through without an extra copy.
+        self._file = open(path, "xb")  # pylint: disable=consider-using-with
+        header = encode_segment_header()
+        self._file.write(header)
+        self._segment_size = len(header)
+        self._segment_opened_at = now
+        self._stats.n_segments += 1
+        _logger.info("%s: New segment %s", self, path)
+
+    def _close_segment(self) -> None:
+        if self._file is None:
+            return
+        f, self._file = self._file, None
+        try:
+            f.flush()
+            os.fsync(f.fileno())
+        except OSError as ex:
+            _logger.error("%s: Could not sync %s: %s", self, f.name, ex)
+        finally:
+            try:
+                f.close()
+            except OSError:
+                pass  # The buffered data could not be written out; the failure has been reported above.
+
+    def __repr__(self) -> str:
+        return pyuavcan.util.repr_attributes(self, str(self._directory))